@@ -0,0 +1,318 @@
+# ------------------------------------------------------------------
+# In-process load test for the checklist application
+#
+# Seeds a SQLite database with a configurable data set and drives the
+# busiest routes through the Flask test client from several threads,
+# reporting latency percentiles, throughput and SQL query counts per
+# route as JSON. Run from the root of the repository:
+#
+#   python benchmarks/loadtest.py --users 10 --lists 20 --items 200 \
+#       --history 500 --threads 4 --iterations 50 --output after.json
+#
+# Pass --compare with an earlier report to see the change per route.
+# ------------------------------------------------------------------
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from checklist_app import create_app, db, init_db  # noqa: E402
+from checklist_app.models import (Checklist, ChecklistHistory,  # noqa: E402
+                                  ChecklistItem, HistoryAction, User,
+                                  recount_items)
+from checklist_app.passwords import hash_password  # noqa: E402
+
+PASSWORD = "loadtest"
+ROUTES = ("checklist.index", "checklist.view", "checklist.toggle_item",
+          "checklist.toggle_all", "auth.login", "admin.list_users")
+_BATCH = 500
+
+
+def _insert(table, rows):
+    """Insert the rows in batches with executemany."""
+    for i in range(0, len(rows), _BATCH):
+        db.session.execute(table.insert(), rows[i:i + _BATCH])
+
+
+def seed(users, lists, items, history, seed=0):
+    """Seed the database of the current app. Every user has the same
+    password so that it only needs to be hashed once.
+
+    Returns:
+    --------
+    A dict of user id to the ids of the lists of that user.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    password = hash_password(PASSWORD)
+
+    _insert(User.__table__, [
+        {"email": f"user{u}@loadtest.url", "password": password,
+         "given_name": "User", "family_name": str(u), "is_admin": False,
+         "deactivated": 0, "created": now}
+        for u in range(users)
+    ])
+    user_ids = [u.id for u in User.query.filter(
+        User.email.like('%@loadtest.url')).order_by(User.id)]
+
+    _insert(Checklist.__table__, [
+        {"title": f"List {u}.{m}", "description": "Seeded by the load test",
+         "created_id": user_id, "created": now, "is_deleted": False}
+        for u, user_id in enumerate(user_ids) for m in range(lists)
+    ])
+    owned = defaultdict(list)
+    for checklist_id, user_id in db.session.query(
+            Checklist.id, Checklist.created_id).order_by(Checklist.id):
+        if user_id in user_ids:
+            owned[user_id].append(checklist_id)
+
+    for user_id, checklist_ids in owned.items():
+        for checklist_id in checklist_ids:
+            _insert(ChecklistItem.__table__, [
+                {"text": f"Item {k}", "done": rng.random() < 0.5,
+                 "active": True, "checklist_id": checklist_id,
+                 "created": now}
+                for k in range(items)
+            ])
+            item_ids = [id for id, in db.session.query(
+                ChecklistItem.id).filter_by(checklist_id=checklist_id)
+                .order_by(ChecklistItem.id)]
+            _insert(ChecklistHistory.__table__, [
+                {"action": HistoryAction.DONE.value,
+                 "item_id": item_ids[h % items] if item_ids else None,
+                 "created": now - timedelta(minutes=history - h),
+                 "checklist_id": checklist_id, "user_id": user_id}
+                for h in range(history)
+            ])
+
+    # The items were inserted without the models so the counts kept on
+    # each list are filled in afterwards.
+    recount_items()
+    db.session.commit()
+    return dict(owned)
+
+
+class QueryCounter():
+    """Counts the statements executed by the engine for the request being
+    made on the current thread."""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args, **kwargs):
+        if getattr(self._local, "active", False):
+            self._local.count += 1
+
+    def start(self):
+        self._local.active = True
+        self._local.count = 0
+
+    def stop(self):
+        self._local.active = False
+        return self._local.count
+
+
+def percentile(values, pct):
+    """Returns the nearest rank percentile of the values."""
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def _worker(app, counter, results, owned, items, iterations, user_index,
+            rng):
+    """Make the requests for one thread as one of the seeded users."""
+    user_index = user_index % len(owned)
+    checklist_ids = owned[user_index][1]
+    email = f"user{user_index}@loadtest.url"
+    client = app.test_client()
+    admin = app.test_client()
+
+    def request(route, call):
+        counter.start()
+        started = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - started
+        queries = counter.stop()
+        results.append((route, elapsed, queries, response.status_code))
+
+    login = {"username": email, "password": PASSWORD}
+    client.post('/auth/login', data=login)
+    admin.post('/auth/login', data={"username": "admin@bebleo.url",
+                                    "password": "admin"})
+
+    for _ in range(iterations):
+        checklist_id = rng.choice(checklist_ids)
+        item_id = rng.choice(items[checklist_id])
+
+        request("checklist.index", lambda: client.get('/checklist/'))
+        request("checklist.view",
+                lambda: client.get(f'/checklist/{checklist_id}'))
+        request("checklist.toggle_item",
+                lambda: client.get(f'/checklist/{checklist_id}/check/'
+                                   f'{item_id}'))
+        request("checklist.toggle_all",
+                lambda: client.get(f'/checklist/{checklist_id}/check/all'))
+        request("auth.login",
+                lambda: app.test_client().post('/auth/login', data=login))
+        request("admin.list_users", lambda: admin.get('/admin/users'))
+
+
+def report(results, elapsed):
+    """Summarise the results per route."""
+    by_route = defaultdict(list)
+    for route, seconds, queries, status in results:
+        by_route[route].append((seconds, queries, status))
+
+    routes = {}
+    for route in ROUTES:
+        samples = by_route.get(route, [])
+        latencies = [s[0] * 1000 for s in samples]
+        routes[route] = {
+            "requests": len(samples),
+            "errors": sum(1 for s in samples if s[2] >= 400),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "mean_ms": sum(latencies) / len(latencies) if samples else None,
+            "throughput_rps": len(samples) / elapsed if elapsed else None,
+            "queries_per_request": (sum(s[1] for s in samples) / len(samples)
+                                    if samples else None),
+            "max_queries": max((s[1] for s in samples), default=None),
+        }
+
+    return {
+        "elapsed_s": elapsed,
+        "requests": len(results),
+        "throughput_rps": len(results) / elapsed if elapsed else None,
+        "routes": routes,
+    }
+
+
+def compare(before, after):
+    """Returns the percentage change of the latency and queries of each
+    route between two reports. Negative is faster."""
+    changes = {}
+    for route, stats in after["routes"].items():
+        old = before.get("routes", {}).get(route)
+        if not old:
+            continue
+
+        changes[route] = {}
+        for key in ("p50_ms", "p95_ms", "p99_ms", "queries_per_request"):
+            if old.get(key) and stats.get(key) is not None:
+                changes[route][key] = round(
+                    (stats[key] - old[key]) / old[key] * 100, 1)
+
+    return changes
+
+
+def run(users=5, lists=10, items=100, history=100, threads=4,
+        iterations=20, seed_value=0, config=None):
+    """Seed a new database and run the load test against it.
+
+    Returns:
+    --------
+    The report as a dict.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        test_config = {
+            "SQLALCHEMY_DATABASE_URI":
+                f"sqlite:///{os.path.join(folder, 'loadtest.sqlite3')}",
+            "WTF_CSRF_ENABLED": False,
+            "PASSWORD_HASH_WORKERS": 0,
+            "FORCE_HTTPS": False,
+            # Every login comes from the same address and a handful of
+            # accounts, which the limits would soon turn away.
+            "RATELIMIT_ENABLED": False,
+        }
+        test_config.update(config or {})
+        app = create_app(test_config)
+
+        with app.app_context():
+            init_db()
+            owned = seed(users, lists, items, history, seed_value)
+            item_ids = defaultdict(list)
+            for item_id, checklist_id in db.session.query(
+                    ChecklistItem.id, ChecklistItem.checklist_id):
+                item_ids[checklist_id].append(item_id)
+            counter = QueryCounter(db.engine)
+            db.session.remove()
+
+        results = []
+        ordered = sorted(owned.items())
+        workers = [
+            threading.Thread(
+                target=_worker,
+                args=(app, counter, results, ordered, item_ids, iterations,
+                      t, random.Random(seed_value + t))
+            )
+            for t in range(threads)
+        ]
+
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+    summary = report(results, elapsed)
+    summary["dataset"] = {"users": users, "lists": lists, "items": items,
+                          "history": history, "threads": threads,
+                          "iterations": iterations}
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test the checklist application in process.")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--lists", type=int, default=10,
+                        help="Lists per user.")
+    parser.add_argument("--items", type=int, default=100,
+                        help="Items per list.")
+    parser.add_argument("--history", type=int, default=100,
+                        help="History rows per list.")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=20,
+                        help="Passes over the routes made by each thread.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report to this file.")
+    parser.add_argument("--compare",
+                        help="An earlier report to compare the results to.")
+    args = parser.parse_args(argv)
+
+    summary = run(args.users, args.lists, args.items, args.history,
+                  args.threads, args.iterations, args.seed)
+
+    if args.compare:
+        with open(args.compare) as f:
+            summary["change_pct"] = compare(json.load(f), summary)
+
+    output = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
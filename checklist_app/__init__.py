@@ -8,18 +8,21 @@
 
 import logging
 import os
+from datetime import datetime, timedelta
 
 import click
-from flask import Flask
+from flask import Flask, current_app
 from flask.cli import with_appcontext
 from flask_mail import Mail
-from flask_sqlalchemy import SQLAlchemy
 from flask_talisman import Talisman
 from flask_wtf.csrf import CSRFProtect
-from werkzeug.security import generate_password_hash
+
+from checklist_app import assets, instrumentation, passwords, ratelimit
+from checklist_app.database import (DEFAULT_SQLITE_PRAGMAS, TunedSQLAlchemy,
+                                    db_pragmas_command)
 
 csrf = CSRFProtect()
-db = SQLAlchemy()
+db = TunedSQLAlchemy()
 mail = Mail()
 log = logging.getLogger(__name__)
 talisman = Talisman()
@@ -27,8 +30,7 @@ talisman = Talisman()
 _content_security_policy = {
     'default-src': '\'self\'',
     'script-src': [
-        '\'self\'',
-        'ajax.googleapis.com'
+        '\'self\''
     ],
 }
 
@@ -43,6 +45,8 @@ def create_app(test_config=None):
 
     app.config.from_mapping(
         SECRET_KEY='<unsafe_secret_k3y/>',
+        FORCE_HTTPS=True,
+        ASSETS_FOLDER=os.path.join(app.instance_path, 'assets'),
         DATABASE=db_path,
         MAIL_SERVER='localhost',
         MAIL_USERNAME='',
@@ -52,8 +56,51 @@ def create_app(test_config=None):
         MAIL_USE_TLS=False,
         MAIL_SENDER='',
         MAIL_SUPPRESS_SEND=True,
+        MAIL_OUTBOX_BATCH_SIZE=100,
+        MAIL_OUTBOX_MAX_ATTEMPTS=5,
+        MAIL_OUTBOX_RETRY_DELAY=30,
+        MAIL_OUTBOX_CLAIM_TIMEOUT=300,
         SQLALCHEMY_DATABASE_URI=f'sqlite:///{db_path}',
-        SQLALCHEMY_TRACK_MODIFICATIONS=False
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SQLALCHEMY_REPLICA_URI=None,
+        REPLICA_STICKY_SECONDS=5,
+        SQLITE_PRAGMAS=DEFAULT_SQLITE_PRAGMAS,
+        SQLITE_POOL_SIZE=5,
+        SQLITE_POOL_OVERFLOW=10,
+        QUERY_REPEAT_ACTION=None,
+        QUERY_REPEAT_LIMIT=None,
+        SERVER_TIMING=True,
+        BULK_ADD_MAX_ITEMS=5000,
+        SEARCH_PAGE_SIZE=20,
+        HISTORY_PAGE_SIZE=20,
+        HISTORY_RETENTION_DAYS=90,
+        LIVE_ENABLED=False,
+        LIVE_HEARTBEAT=15,
+        LIVE_POLL_INTERVAL=5,
+        LIVE_STREAM_TIMEOUT=300,
+        LIVE_RETRY=3,
+        PASSWORD_TOKEN_MAX_PER_USER=3,
+        PASSWORD_TOKEN_SWEEP_INTERVAL=300,
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=60,
+        ADMIN_USERS_PAGE_SIZE=50,
+        ADMIN_USER_COUNT_TTL=300,
+        PASSWORD_HASH_METHOD='pbkdf2:sha256:260000',
+        PASSWORD_HASH_SALT_LENGTH=16,
+        PASSWORD_HASH_WORKERS=2,
+        PASSWORD_HASH_MAX_PENDING=8,
+        PASSWORD_HASH_TIMEOUT=10,
+        PASSWORD_HASH_RETRY_AFTER=1,
+        RATELIMIT_ENABLED=True,
+        RATELIMIT_BACKEND='memory',
+        RATELIMIT_SQLITE_PATH=os.path.join(app.instance_path,
+                                           'ratelimit.sqlite3'),
+        RATELIMIT_MEMORY_MAX_KEYS=10000,
+        RATELIMIT_TRUSTED_PROXIES=0,
+        RATELIMIT_LIMITS={
+            'login': {'ip': (30, 60), 'account': (10, 300)},
+            'password_reset': {'ip': (10, 600), 'account': (3, 900)},
+        }
     )
 
     # Load altenative mappings as necessary
@@ -65,15 +112,22 @@ def create_app(test_config=None):
     # Create the Instance directory if not already there.
     os.makedirs(app.instance_path, exist_ok=True)
 
-    talisman.init_app(app, content_security_policy=_content_security_policy,
+    talisman.init_app(app, force_https=app.config['FORCE_HTTPS'],
+                      content_security_policy=_content_security_policy,
                       content_security_policy_nonce_in=['script-src'])
     db.init_app(app)
     csrf.init_app(app)
     mail.init_app(app)
+    passwords.init_app(app)
+    ratelimit.init_app(app)
+    instrumentation.init_app(app)
+    assets.init_app(app)
     log = app.logger  # noqa: F841
 
     # Register BluePrints
-    from checklist_app import admin, auth, checklist, home
+    from checklist_app import (admin, auth, checklist, export, home, live,
+                               mailer)
+    live.init_app(app)
     app.register_blueprint(auth.bp)
     app.register_blueprint(home.bp)
     app.register_blueprint(checklist.bp)
@@ -81,6 +135,16 @@ def create_app(test_config=None):
 
     # Add the click commands
     app.cli.add_command(init_db_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(db_pragmas_command)
+    app.cli.add_command(recount_items_command)
+    app.cli.add_command(rebuild_search_command)
+    app.cli.add_command(create_indexes_command)
+    app.cli.add_command(mailer.mail_worker_command)
+    app.cli.add_command(export.export_command)
+    app.cli.add_command(archive_history_command)
+    app.cli.add_command(migrate_history_command)
+    app.cli.add_command(purge_tokens_command)
 
     return app
 
@@ -91,7 +155,7 @@ def init_db():
     db.create_all()
     db.session.add(
         User(email="admin@bebleo.url", is_admin=True,
-             password=generate_password_hash("admin"))
+             password=passwords.hash_password("admin"))
     )
     db.session.commit()
 
@@ -101,3 +165,228 @@ def init_db():
 def init_db_command():
     init_db()
     click.echo('Initialized database.')
+
+
+def create_indexes():
+    """Create any indexes declared on the models that are missing from an
+    existing database. Tables that don't exist yet are skipped. Returns
+    the names of the indexes created."""
+    inspector = db.inspect(db.engine)
+    tables = set(inspector.get_table_names())
+
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+
+        existing = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                created.append(index.name)
+
+    return created
+
+
+# Indexes created by earlier versions that have since been replaced by
+# others covering the same queries, as (table, index).
+_SUPERSEDED_INDEXES = (
+    ('checklist_history', 'ix_checklist_history_checklist_id_created'),
+)
+
+
+def drop_superseded_indexes():
+    """Drop the indexes that have been replaced from an existing database.
+    Returns the names of the indexes dropped."""
+    inspector = db.inspect(db.engine)
+    tables = set(inspector.get_table_names())
+
+    dropped = []
+    for table, name in _SUPERSEDED_INDEXES:
+        if table not in tables:
+            continue
+        if name in {i['name'] for i in inspector.get_indexes(table)}:
+            db.session.execute(f'DROP INDEX {name}')
+            dropped.append(name)
+
+    db.session.commit()
+    return dropped
+
+
+@click.command('db-indexes')
+@with_appcontext
+def create_indexes_command():
+    """Create missing indexes without dropping the database."""
+    created = create_indexes()
+    for name in created:
+        click.echo(f'Created index {name}.')
+    click.echo(f'Created {len(created)} missing index(es).')
+
+
+def _add_missing_columns(table):
+    """Add any columns of the table that are missing from it in an
+    existing database. Returns the names of the columns added."""
+    existing = {c['name'] for c in db.inspect(db.engine).get_columns(
+        table.name)}
+
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+
+        _type = column.type.compile(dialect=db.engine.dialect)
+        ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {_type}'
+        if column.server_default is not None:
+            default = getattr(column.server_default.arg, 'text',
+                              column.server_default.arg)
+            ddl += f" NOT NULL DEFAULT {default}"
+        db.session.execute(ddl)
+        added.append(column.name)
+
+    db.session.commit()
+    return added
+
+
+def _relax_not_null(table):
+    """Rebuild the table if any of its columns that may now be null are
+    NOT NULL in an existing database, which SQLite can't alter in place.
+    Returns True if the table was rebuilt."""
+    inspector = db.inspect(db.engine)
+    existing = inspector.get_columns(table.name)
+    not_null = {c['name'] for c in existing if not c['nullable']}
+    if not [c for c in table.columns
+            if c.nullable and not c.primary_key and c.name in not_null]:
+        return False
+
+    # Copy the rows to a new table as SQLite's instructions for altering a
+    # table say. The indexes go with the old table so are dropped first.
+    columns = ', '.join(c['name'] for c in existing)
+    for index in inspector.get_indexes(table.name):
+        db.session.execute(f'DROP INDEX {index["name"]}')
+    db.session.execute(f'ALTER TABLE {table.name} RENAME TO _{table.name}')
+    table.create(bind=db.session.connection())
+    db.session.execute(f'INSERT INTO {table.name} ({columns}) '
+                       f'SELECT {columns} FROM _{table.name}')
+    db.session.execute(f'DROP TABLE _{table.name}')
+    db.session.commit()
+    return True
+
+
+def upgrade_db():
+    """Bring an existing database up to date with the models without
+    dropping it: create the missing tables, then add the missing columns
+    and indexes and drop the indexes that have been replaced. Returns a
+    list of what was changed."""
+    from checklist_app.models import create_search_index
+
+    added = []
+    existing = set(db.inspect(db.engine).get_table_names())
+    db.create_all()
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            added.append(f'Added table {table.name}')
+            continue
+
+        added.extend(f'Added column {table.name}.{column}'
+                     for column in _add_missing_columns(table))
+        if _relax_not_null(table):
+            added.append(f'Added nullable columns to {table.name}')
+
+    added.extend(f'Added index {name}' for name in create_indexes())
+    added.extend(f'Dropped index {name}'
+                 for name in drop_superseded_indexes())
+
+    if create_search_index():
+        added.append('Added table checklist_search')
+    return added
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Add missing tables, columns and indexes to the database and drop
+    the indexes that have been replaced."""
+    for change in upgrade_db():
+        click.echo(f'{change}.')
+    click.echo('Upgraded database.')
+
+
+@click.command('recount-items')
+@click.option('--id', 'checklist_id', type=int, default=None,
+              help='Only recount the checklist with this id.')
+@with_appcontext
+def recount_items_command(checklist_id):
+    """Backfill or repair the item counts kept on each checklist."""
+    from checklist_app.models import Checklist, recount_items
+
+    for column in _add_missing_columns(Checklist.__table__):
+        click.echo(f'Added column {column}.')
+
+    count = recount_items(checklist_id)
+    click.echo(f'Recounted items for {count} checklist(s).')
+
+
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+    """Rebuild the full-text search index of the lists and items."""
+    from checklist_app.models import (create_search_index,
+                                      rebuild_search_index, search_available)
+
+    if not search_available(db.engine):
+        click.echo('Search needs SQLite with FTS5.')
+        return
+
+    if create_search_index():
+        click.echo('Added table checklist_search.')
+    count = rebuild_search_index()
+    click.echo(f'Indexed {count} list(s) and item(s).')
+
+
+@click.command('archive-history')
+@click.option('--days', type=int, default=None,
+              help='Archive history older than this. '
+                   '(Default HISTORY_RETENTION_DAYS)')
+@click.option('--batch-size', default=1000,
+              help='The number of entries to move at a time.')
+@with_appcontext
+def archive_history_command(days, batch_size):
+    """Move old history to the archive, collapsing runs of toggles."""
+    from checklist_app.models import archive_history
+
+    if days is None:
+        days = current_app.config['HISTORY_RETENTION_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+
+    moved, archived, lists = archive_history(cutoff, batch_size)
+    click.echo(f'Archived {moved} history entries of {lists} list(s) as '
+               f'{archived}.')
+
+
+@click.command('migrate-history')
+@click.option('--batch-size', default=1000,
+              help='The number of entries to convert at a time.')
+@with_appcontext
+def migrate_history_command(batch_size):
+    """Convert the descriptions in the history to actions."""
+    from checklist_app.models import migrate_history
+
+    for change in upgrade_db():
+        click.echo(f'{change}.')
+
+    converted, left = migrate_history(batch_size)
+    click.echo(f'Converted {converted} history entries, leaving {left} '
+               f'that could not be read.')
+
+
+@click.command('purge-tokens')
+@click.option('--batch-size', default=500,
+              help='The number of tokens to delete at a time.')
+@with_appcontext
+def purge_tokens_command(batch_size):
+    """Delete the expired password tokens."""
+    from checklist_app.models import purge_expired_tokens
+
+    count = purge_expired_tokens(batch_size)
+    click.echo(f'Deleted {count} expired token(s).')
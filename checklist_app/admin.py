@@ -5,17 +5,52 @@
 # December 13, 2019
 # -----------------------------------------------------
 
-from flask import Blueprint, abort, flash, g, render_template, request, url_for
-from werkzeug.security import generate_password_hash
+from flask import (Blueprint, abort, current_app, flash, g, render_template,
+                   request, url_for)
 
 from checklist_app import db
-from checklist_app.auth import admin_required, login_required
+from checklist_app.auth import (admin_required, invalidate_user,
+                                login_required)
+from checklist_app.cache import TTLCache
+from checklist_app.database import read_replica
 from checklist_app.forms import AddUserForm, EditUserForm
-from checklist_app.models import AccountStatus, User, get_user, get_user_or_404
+from checklist_app.models import (AccountStatus, User, count_users, find_users,
+                                  get_user, get_user_or_404)
+from checklist_app.passwords import hash_password
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
 
+@bp.record_once
+def init_user_count_cache(state):
+    """Create the cache of the number of users found by each search."""
+    state.app.extensions['user_count_cache'] = TTLCache(
+        maxsize=256,
+        ttl=state.app.config['ADMIN_USER_COUNT_TTL'] or 0
+    )
+
+
+def estimate_user_count(search, is_admin, status):
+    """Returns the number of users matching the search, counted at most
+    once every ADMIN_USER_COUNT_TTL seconds, or None if the count isn't
+    shown."""
+    if current_app.config['ADMIN_USER_COUNT_TTL'] is None:
+        return None
+
+    cache = current_app.extensions['user_count_cache']
+    # Searches are keyed as typed since only ASCII letters ignore case.
+    key = (search, is_admin, status)
+    count = cache.get(key)
+    if count is None:
+        count = count_users(search, is_admin, status)
+        cache.set(key, count)
+    return count
+
+
+def _users_changed():
+    current_app.extensions['user_count_cache'].clear()
+
+
 def checked(field):
     """
     Returns True/False based on whether a checkbox has been
@@ -33,17 +68,39 @@ def checked(field):
 
 @bp.route('/users')
 @admin_required
+@read_replica
 def list_users():
     """
-    List all of the users in the application
+    List a page of the users in the application, optionally only those
+    matching a search and the filters given.
 
     Returns
     -------
-    Returns the rendered view that lists all of the users
-    in the application.
+    Returns the rendered view that lists the users.
     """
-    users = User.query.all()
-    return render_template('admin/users.html', users=users)
+    search = request.args.get('q', '').strip()
+    admin = request.args.get('admin', '')
+    status = request.args.get('status', '')
+    after = request.args.get('after', type=int)
+
+    is_admin = {'1': True, '0': False}.get(admin)
+    try:
+        account_status = AccountStatus[status] if status else None
+    except KeyError:
+        abort(400)
+
+    users, next_after = find_users(search, is_admin, account_status, after,
+                                   current_app.config['ADMIN_USERS_PAGE_SIZE'])
+    next_url = None
+    if next_after is not None:
+        next_url = url_for('admin.list_users', q=search, admin=admin,
+                           status=status, after=next_after)
+
+    count = estimate_user_count(search, is_admin, account_status)
+    return render_template('admin/users.html', users=users, search=search,
+                           admin=admin, status=status,
+                           statuses=list(AccountStatus), count=count,
+                           next_url=next_url)
 
 
 @bp.route('/users/<int:id>', methods=('GET', 'POST'))
@@ -95,6 +152,8 @@ def edit_user(id: int):
             user.account_status = AccountStatus(deactivated)
             db.session.add(user)
             db.session.commit()
+            invalidate_user(user.id)
+            _users_changed()
             saved = True
 
     return render_template('admin/edit_user.html', form=form, user=user,
@@ -126,9 +185,10 @@ def add_user():
         else:
             user = User(email=username, given_name=given_name,
                         family_name=family_name, is_admin=is_admin,
-                        password=generate_password_hash(password))
+                        password=hash_password(password))
             db.session.add(user)
             db.session.commit()
+            _users_changed()
             saved = True
 
     return render_template('admin/add_user.html', form=form, success=saved)
@@ -0,0 +1,253 @@
+# ------------------------------------------------------------------
+# checklist.assets
+# Builds the stylesheets and scripts into minified bundles named for
+# a hash of their content, with gzip and brotli copies, and serves
+# them so that browsers can cache them forever.
+# ------------------------------------------------------------------
+
+import gzip
+import io
+import json
+import os
+import re
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+
+import click
+from flask import (Blueprint, abort, current_app, request, send_from_directory,
+                   url_for)
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+__all__ = (
+    "BUNDLES",
+    "asset_url",
+    "build_assets",
+    "build_assets_command",
+    "init_app",
+    "source_digests",
+)
+
+# The bundles built and the files in the static folder that make them up.
+# Stylesheets imported with @import are included in the bundle.
+BUNDLES = OrderedDict([
+    ('app.css', ['style.css']),
+    ('checklist.js', ['scripts/jquery-3.4.1.min.js', 'scripts/scripts.js']),
+])
+
+MANIFEST = 'manifest.json'
+ONE_YEAR = 60 * 60 * 24 * 365
+
+bp = Blueprint('assets', __name__, url_prefix='/assets')
+_lock = Lock()
+
+_css_comment = re.compile(r'/\*.*?\*/', re.S)
+_css_import = re.compile(r'@import\s+(?:url\()?[\'"]?([^\'")]+)[\'"]?\)?\s*;')
+_css_space = re.compile(r'\s*([{};,>])\s*')
+
+
+def _read_css(path, seen=None):
+    """Read the stylesheet without comments and with its imports inlined."""
+    seen = set() if seen is None else seen
+    path = os.path.normpath(path)
+    if path in seen:
+        return ''
+    seen.add(path)
+
+    with io.open(path, encoding='utf8') as f:
+        text = _css_comment.sub('', f.read())
+
+    folder = os.path.dirname(path)
+    return _css_import.sub(
+        lambda m: _read_css(os.path.join(folder, m.group(1)), seen), text)
+
+
+def minify_css(text):
+    """Remove the comments and the whitespace that isn't needed."""
+    text = _css_comment.sub('', text)
+    text = _css_space.sub(r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    """Remove blank lines, indentation and lines that are only comments.
+    Anything further is left to a proper minifier."""
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines
+                     if line and not line.startswith('//'))
+
+
+def _compress(data):
+    """Returns the data gzipped without a timestamp so builds repeat."""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+                       mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def _write(folder, name, data):
+    with open(os.path.join(folder, name), 'wb') as f:
+        f.write(data)
+
+
+def _read_sources(static_folder, name):
+    """Returns the text of each of the sources of the bundle, stylesheets
+    with their imports inlined, as a list of (path, text)."""
+    paths = [os.path.join(static_folder, s) for s in BUNDLES[name]]
+    if name.endswith('.css'):
+        return [(p, _read_css(p)) for p in paths]
+
+    sources = []
+    for path in paths:
+        with io.open(path, encoding='utf8') as f:
+            sources.append((path, f.read()))
+    return sources
+
+
+def _digest(sources):
+    return sha256('\0'.join(text for _, text in sources)
+                  .encode('utf8')).hexdigest()
+
+
+def source_digests(static_folder):
+    """Returns a hash of the sources of each bundle by its name."""
+    return {name: _digest(_read_sources(static_folder, name))
+            for name in BUNDLES}
+
+
+def build_assets(static_folder, output_folder):
+    """Build each bundle into the output folder as <name>.<hash>.<ext>
+    with .gz and, if brotli is installed, .br copies, then write the
+    manifest of bundle names to built names along with a hash of the
+    sources each was built from.
+
+    Returns:
+    --------
+    The manifest of bundle names to built names.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = {}
+    digests = {}
+
+    for name in BUNDLES:
+        sources = _read_sources(static_folder, name)
+        digests[name] = _digest(sources)
+        if name.endswith('.css'):
+            text = minify_css('\n'.join(text for _, text in sources))
+        else:
+            text = ';\n'.join(
+                text if '.min.' in path else minify_js(text)
+                for path, text in sources)
+
+        data = text.encode('utf8')
+        stem, ext = os.path.splitext(name)
+        built = f'{stem}.{sha256(data).hexdigest()[:12]}{ext}'
+
+        _write(output_folder, built, data)
+        _write(output_folder, built + '.gz', _compress(data))
+        if brotli is not None:
+            _write(output_folder, built + '.br', brotli.compress(data))
+
+        manifest[name] = built
+
+    _write(output_folder, MANIFEST, json.dumps(
+        {"bundles": manifest, "sources": digests}, indent=2, sort_keys=True
+    ).encode('utf8'))
+    return manifest
+
+
+def _read_manifest(path):
+    """Returns the bundles and the hashes of their sources in the manifest,
+    or None if there isn't one or it is from an older build."""
+    try:
+        with io.open(path, encoding='utf8') as f:
+            saved = json.load(f)
+        return saved['bundles'], saved['sources']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _manifest():
+    """Returns the manifest for the app, building the bundles first if
+    they haven't been built or any of their sources has changed since.
+    The sources are checked once per process, or on every request in
+    debug mode, so a deploy with new sources rebuilds on its first
+    request."""
+    app = current_app._get_current_object()
+    manifest = app.extensions.get('assets')
+    if manifest is not None and not app.debug:
+        return manifest
+
+    with _lock:
+        folder = app.config['ASSETS_FOLDER']
+        saved = _read_manifest(os.path.join(folder, MANIFEST))
+        if saved is not None and \
+                saved[1] == source_digests(app.static_folder):
+            manifest = saved[0]
+        else:
+            manifest = build_assets(app.static_folder, folder)
+
+        app.extensions['assets'] = manifest
+        return manifest
+
+
+def asset_url(name):
+    """Returns the URL of the built bundle with the name given, such as
+    asset_url('app.css'). Available in templates."""
+    return url_for('assets.serve', filename=_manifest()[name])
+
+
+@bp.route('/<string:filename>')
+def serve(filename):
+    """Serve a built bundle, compressed if the client accepts it, with
+    headers that let it be cached indefinitely."""
+    if filename not in _manifest().values():
+        abort(404)
+
+    folder = current_app.config['ASSETS_FOLDER']
+    mimetype = 'text/css' if filename.endswith('.css') \
+        else 'application/javascript'
+
+    encoding = None
+    for _encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if _encoding in request.accept_encodings and \
+                os.path.exists(os.path.join(folder, filename + suffix)):
+            encoding = _encoding
+            filename += suffix
+            break
+
+    response = send_from_directory(folder, filename, mimetype=mimetype,
+                                   conditional=True)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = ONE_YEAR
+    response.cache_control.immutable = True
+    return response
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Build the minified and compressed stylesheets and scripts."""
+    manifest = build_assets(current_app.static_folder,
+                            current_app.config['ASSETS_FOLDER'])
+    current_app.extensions['assets'] = manifest
+    for name, built in manifest.items():
+        click.echo(f'Built {name} as {built}.')
+
+
+def init_app(app):
+    """Serve the built bundles and make asset_url available to templates."""
+    app.register_blueprint(bp)
+    app.add_template_global(asset_url)
+    app.cli.add_command(build_assets_command)
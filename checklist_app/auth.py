@@ -11,18 +11,73 @@ import functools
 
 from flask import (Blueprint, abort, current_app, flash, g, redirect,
                    render_template, request, session, url_for)
-from flask_mail import Mail
-from werkzeug.security import generate_password_hash
+from sqlalchemy.orm import make_transient_to_detached
 
 from checklist_app import db
+from checklist_app.cache import TTLCache
 from checklist_app.forms import (LoginForm, RegistrationForm,
                                  SendPasswordChangeForm, UpdatePasswordForm)
 from checklist_app.models import (AccountStatus, PasswordToken,
                                   TokenExpiredError, TokenInvalidError, User,
-                                  get_user, save_token, validate_token)
+                                  get_user, queue_message, save_token,
+                                  validate_token)
+from checklist_app.passwords import hash_password, password_needs_rehash
+from checklist_app.ratelimit import rate_limited
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# Endpoints that never need the logged in user.
+_anonymous_endpoints = ('static', 'assets.serve', 'home.favicon')
+
+# Columns of the logged in user kept in the cache. The password hash is
+# left out and loaded only if it is needed, as is the version of the
+# user's lists which changes too often to cache.
+_cached_columns = [c.key for c in User.__table__.columns
+                   if c.key not in ('password', 'lists_version')]
+
+
+@bp.record_once
+def init_user_cache(state):
+    """Create the cache of logged in users for the app."""
+    state.app.extensions['user_cache'] = TTLCache(
+        maxsize=state.app.config['USER_CACHE_SIZE'],
+        ttl=state.app.config['USER_CACHE_TTL']
+    )
+
+
+def user_cache():
+    """Returns the cache of logged in users for the current app."""
+    return current_app.extensions['user_cache']
+
+
+def user_cache_info():
+    """Returns the hits, misses and size of the logged in user cache."""
+    return user_cache().info()
+
+
+def invalidate_user(user_id):
+    """Remove the user from the cache after the user has been changed."""
+    user_cache().invalidate(user_id)
+
+
+def load_logged_in_user(user_id):
+    """Get the user with the id from the cache, or the database if not
+    cached, attached to the current session."""
+    values = user_cache().get(user_id)
+
+    if values is None:
+        user = get_user(id=user_id)
+        if user is not None:
+            user_cache().set(user_id, {c: getattr(user, c)
+                                       for c in _cached_columns})
+        return user
+
+    # Rebuild the user as though it was loaded and merge it into the
+    # session without querying the database.
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
 
 def login_required(view):
     @functools.wraps(view)
@@ -50,6 +105,7 @@ def admin_required(view):
 
 
 @bp.route('/forgotpassword', methods=('GET', 'POST'))
+@rate_limited('password_reset')
 def send_password_change():
     """Get the user email and send the link with the reset token."""
     form = SendPasswordChangeForm()
@@ -65,15 +121,17 @@ def send_password_change():
             # If no user exists with that email flash that message.
             flash("No user found with email.")
         else:
-            token = save_token(user.id)
+            # The token and the message are committed together so that
+            # neither is kept without the other.
+            token = save_token(user.id, commit=False)
             _body = render_template('emails/send_password_change.txt',
                                     host=request.host, user=user,
                                     token=token)
-            mail = Mail(current_app)
-            mail.send_message(subject='Reset Password Link',
-                              recipients=[user.email],
-                              sender='Bebleo <noreply@bebleo.url>',
-                              body=_body)
+            queue_message(subject='Reset Password Link',
+                          recipients=[user.email],
+                          sender='Bebleo <noreply@bebleo.url>',
+                          body=_body)
+            db.session.commit()
             sent = True
 
     return render_template('auth/send_password_change.html', email_sent=sent,
@@ -81,6 +139,7 @@ def send_password_change():
 
 
 @bp.route('/forgotpassword/<string:token>', methods=('GET', 'POST'))
+@rate_limited('password_reset')
 def forgot_password(token=None):
     """Allow user to change the password based on providing a token"""
 
@@ -98,17 +157,16 @@ def forgot_password(token=None):
             _token = PasswordToken.query.filter_by(token=token).first()
             validate_token(token, user.id)
 
-            user.password = generate_password_hash(password)
+            user.password = hash_password(password)
             db.session.add(user)
             db.session.delete(_token)
+            queue_message(subject='Password reset',
+                          recipients=[user.email],
+                          sender='Bebleo <noreply@bebleo.url>',
+                          body=render_template('emails/password_reset.txt',
+                                               user=user))
             db.session.commit()
-
-            mail = Mail(current_app)
-            mail.send_message(subject='Password reset',
-                              recipients=[user.email],
-                              sender='Bebleo <noreply@bebleo.url>',
-                              body=render_template('emails/password_reset.txt',
-                                                   user=user))
+            invalidate_user(user.id)
 
             return redirect(url_for('home.index'))
 
@@ -143,9 +201,10 @@ def register():
         else:
             user = User(email=username, given_name=given_name,
                         family_name=family_name,
-                        password=generate_password_hash(password))
+                        password=hash_password(password))
             db.session.add(user)
             db.session.commit()
+            invalidate_user(user.id)
 
             current_app.logger.info(f'Registered user: {username}')
             return redirect(url_for('home.index'))
@@ -154,6 +213,7 @@ def register():
 
 
 @bp.route('/login', methods=('GET', 'POST'))
+@rate_limited('login')
 def login():
     """Login."""
     form = LoginForm(request.form)
@@ -162,6 +222,11 @@ def login():
         if form._user.deactivated:
             return redirect(url_for('auth.deactivated'))
 
+        if password_needs_rehash(form._user.password):
+            # Upgrade hashes made with an older method or cost.
+            form._user.password = hash_password(form.password.data)
+            db.session.commit()
+
         session.clear()
         session['user_id'] = form._user.id
         return redirect(url_for('home.index'))
@@ -178,8 +243,12 @@ def logout():
 
 @bp.before_app_request
 def fetch_logged_in_user():
+    g.user = None
+    if request.endpoint in _anonymous_endpoints:
+        return
+
     user_id = session.get('user_id')
-    g.user = get_user(id=user_id) if user_id else None
+    g.user = load_logged_in_user(user_id) if user_id else None
 
 
 @bp.route('/disabled', methods=('GET', 'POST'))
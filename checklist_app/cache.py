@@ -0,0 +1,73 @@
+# ------------------------------------------------------------------
+# checklist.cache
+# Small in-process caches used to avoid repeating the same lookups
+# on every request.
+# ------------------------------------------------------------------
+
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import monotonic
+
+__all__ = (
+    "CacheInfo",
+    "TTLCache",
+)
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class TTLCache():
+    """A thread safe least recently used cache whose entries expire ttl
+    seconds after they are set. A ttl or maxsize of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=128, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """Return the value for the key or the default if it is missing or
+        has expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Store the value for the key evicting the least recently used
+        entry if the cache is full."""
+        if not self.maxsize or not self.ttl:
+            return
+
+        with self._lock:
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Remove the entry for the key if there is one."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all of the entries and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        """Return the hits, misses and size of the cache."""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._data))
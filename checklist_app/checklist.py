@@ -1,20 +1,131 @@
-from flask import (Blueprint, abort, flash, g, redirect, render_template,
-                   request, url_for)
+from hashlib import sha1
+from time import time
+
+from flask import (Blueprint, Response, abort, current_app, flash, g, jsonify,
+                   make_response, redirect, render_template, request, session,
+                   stream_with_context, url_for)
+from flask_wtf.csrf import generate_csrf
+from werkzeug.http import is_resource_modified
 
 from checklist_app import db
 from checklist_app.auth import login_required
-from checklist_app.forms import AddItemForm, CreateListForm, EditListForm
-from checklist_app.models import Checklist, ChecklistItem
+from checklist_app.database import read_replica
+from checklist_app.export import (LIST_FIELDS, RECORD_FIELDS, checklist_rows,
+                                  export_response, list_rows, parse_since)
+from checklist_app.forms import (AddItemForm, BulkAddItemsForm, CreateListForm,
+                                 EditListForm)
+from checklist_app.live import event_stream, stream_response
+from checklist_app.models import (Checklist, ChecklistHistory, ChecklistItem,
+                                  HistoryAction, User, describe_history,
+                                  search_checklists)
 
 bp = Blueprint('checklist', __name__, url_prefix='/checklist')
 
+# The most changes read at a time for the live updates of a list.
+_LIVE_BATCH = 100
+
+# Changes to many items at once, after which the list is reloaded.
+_BULK_ACTIONS = (HistoryAction.ADDED_ITEMS, HistoryAction.MARKED_DONE,
+                 HistoryAction.MARKED_NOT_DONE)
+
 
-def get_checklist(id):
-    """Gets the checklist identified by the id."""
-    checklist = Checklist.query.filter_by(id=id).first_or_404()
+def get_checklist(id, query=None):
+    """Gets the checklist identified by the id. Only the header is loaded
+    unless a query with other loader options, such as
+    Checklist.query.for_view(), is given."""
+    if query is None:
+        query = Checklist.query
+
+    checklist = query.filter_by(id=id).first_or_404()
     return checklist
 
 
+def page_etag(*parts):
+    """Returns a strong ETag for a page made from the parts given. The
+    user and the CSRF token embedded in the page are included so that a
+    page isn't reused by another session or after its token expires."""
+    generate_csrf()
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    window = int(time() // (limit / 2)) if limit else 0
+    csrf = session.get(current_app.config.get('WTF_CSRF_FIELD_NAME',
+                                              'csrf_token'), '')
+
+    value = '.'.join(str(p) for p in parts + (g.user.id, g.user.is_admin,
+                                              window, csrf))
+    return sha1(value.encode()).hexdigest()
+
+
+def is_not_modified(etag, last_modified=None):
+    """Returns True if the client's copy of the page is current. Pages
+    with flashed messages waiting are always sent."""
+    if session.get('_flashes'):
+        return False
+
+    return not is_resource_modified(request.environ, etag=etag,
+                                    last_modified=last_modified)
+
+
+def conditional(response, etag, last_modified=None):
+    """Add the headers that let the client revalidate the page."""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def get_item(checklist, item_id):
+    """Gets the item identified by the id if it belongs to the checklist."""
+    return ChecklistItem.query.filter_by(
+        id=item_id, checklist_id=checklist.id
+    ).first_or_404()
+
+
+def item_json(item):
+    """Returns the item as a dict suitable for a JSON response."""
+    _urls = {"id": item.checklist_id, "item_id": item.id}
+    return {
+        "id": item.id,
+        "text": item.text,
+        "done": item.done,
+        "active": item.active,
+        "toggle_url": url_for('checklist.toggle_item', **_urls),
+        "edit_url": url_for('checklist.edit_item', **_urls),
+        "delete_url": url_for('checklist.delete_item', **_urls),
+        "toggle_json_url": url_for('checklist.toggle_item_json', **_urls),
+        "delete_json_url": url_for('checklist.delete_item_json', **_urls),
+    }
+
+
+def history_json(change, description=None):
+    """Returns the entry in the history as a dict suitable for JSON. The
+    entry is described unless its description is given."""
+    if description is None:
+        description, = describe_history([change])
+
+    return {
+        "id": change.id,
+        "created": change.created.strftime('%Y-%m-%d %H:%M'),
+        "description": description,
+        "changes": getattr(change, 'changes', 1),
+    }
+
+
+def described(entries):
+    """Returns the entries of the history paired with their descriptions."""
+    return list(zip(entries, describe_history(entries)))
+
+
+def change_json(checklist, item, change):
+    """Returns the response for a change made to an item of a checklist."""
+    return jsonify(
+        item=item_json(item),
+        history=history_json(change),
+        percent_complete=checklist.percent_complete,
+    )
+
+
 @bp.route('/create', methods=('GET', 'POST'))
 @login_required
 def create():
@@ -27,6 +138,7 @@ def create():
             created_by=g.user,
             assigned_to=g.user
         )
+        checklist.touch()
         db.session.add(checklist)
         db.session.commit()
 
@@ -46,6 +158,7 @@ def edit(id):
     if form.validate_on_submit():
         checklist.title = form.list_title.data
         checklist.description = form.list_description.data
+        checklist.touch()
         db.session.add(checklist)
         db.session.commit()
 
@@ -70,6 +183,7 @@ def delete(id):
             abort(401)
 
         checklist.is_deleted = True
+        checklist.touch()
         db.session.add(checklist)
         db.session.commit()
 
@@ -84,20 +198,203 @@ def delete(id):
 @bp.route('/')
 @bp.route('')
 @login_required
+@read_replica
 def index():
+    lists_version = db.session.query(User.lists_version) \
+        .filter_by(id=g.user.id).scalar()
+    etag = page_etag('index', lists_version)
+    if is_not_modified(etag):
+        return conditional(Response(status=304), etag)
+
+    # The completion is read from the counts on the checklist so there's
+    # no need to load the items of every list.
     checklists = Checklist.query.filter_by(
         created_by=g.user,
         is_deleted=False
     ).all()
-    return render_template('checklist/index.html', lists=checklists)
+    response = make_response(
+        render_template('checklist/index.html', lists=checklists))
+    return conditional(response, etag)
+
+
+@bp.route('/search')
+@login_required
+@read_replica
+def search():
+    """Search the user's lists and their items, best match first, a page
+    at a time."""
+    query = request.args.get('q', '')
+    after = request.args.get('after')
+    if after:
+        try:
+            score, rowid = after.split('_')
+            after = (float(score), int(rowid))
+        except ValueError:
+            abort(400)
+
+    results, next_after = search_checklists(
+        g.user.id, query, after or None,
+        current_app.config['SEARCH_PAGE_SIZE'])
+    more_url = None
+    if next_after is not None:
+        more_url = url_for('checklist.search', q=query,
+                           after='{!r}_{}'.format(*next_after))
+
+    return render_template('checklist/search.html', query=query,
+                           results=results, more_url=more_url)
 
 
 @bp.route('/<int:id>')
 @login_required
+@read_replica
 def view(id):
+    # Check the client's copy against the version of the list before
+    # loading the list itself.
+    stamp = db.session.query(Checklist.version, Checklist.updated) \
+        .filter_by(id=id).first_or_404()
+    etag = page_etag('view', id, stamp.version)
+    if is_not_modified(etag, stamp.updated):
+        return conditional(Response(status=304), etag, stamp.updated)
+
+    checklist = get_checklist(id, Checklist.query.for_view())
+    response = make_response(render_view(checklist, AddItemForm()))
+    return conditional(response, etag, stamp.updated)
+
+
+def older_history_url(checklist, before, archived=False):
+    """Returns the URL of the history older than the entry with the id in
+    before, moving on to the archive at the end of the history, or None if
+    there is nothing older."""
+    if before is not None:
+        return url_for('checklist.history', id=checklist.id, before=before,
+                       archived=1 if archived else None)
+
+    if not archived and checklist.archived_count:
+        return url_for('checklist.history', id=checklist.id, archived=1)
+
+    return None
+
+
+def render_view(checklist, form):
+    """Render the list with its items and latest history."""
+    history, before = checklist.history_page(
+        limit=current_app.config['HISTORY_PAGE_SIZE'])
+
+    return render_template('checklist/view_list.html', checklist=checklist,
+                           form=form, history=described(history),
+                           older_url=older_history_url(checklist, before))
+
+
+@bp.route('/<int:id>/history')
+@login_required
+@read_replica
+def history(id):
+    """A page of the history of the list older than the entry in before,
+    or of the archived history if archived is given, as JSON if asked for
+    or otherwise as a page."""
     checklist = get_checklist(id)
-    form = AddItemForm()
-    return render_template('checklist/view_list.html', checklist=checklist, form=form)
+    before = request.args.get('before', type=int)
+    archived = bool(request.args.get('archived'))
+    entries, before = checklist.history_page(
+        before, current_app.config['HISTORY_PAGE_SIZE'], archived)
+    older_url = older_history_url(checklist, before, archived)
+
+    history = described(entries)
+    best = request.accept_mimetypes.best_match(['text/html',
+                                                'application/json'])
+    if best == 'application/json':
+        return jsonify(history=[history_json(e, d) for e, d in history],
+                       older_url=older_url)
+
+    return render_template('checklist/history.html', checklist=checklist,
+                           history=history, older_url=older_url)
+
+
+def live_changes(id, after):
+    """Returns the changes to the list after the entry in its history with
+    the id given, each as its id and the data sent to the browser."""
+    entries = ChecklistHistory.query.filter(
+        ChecklistHistory.checklist_id == id,
+        ChecklistHistory.id > after
+    ).order_by(ChecklistHistory.id).limit(_LIVE_BATCH).all()
+    if not entries:
+        return []
+
+    # Read the items first so that describing the history reuses them.
+    item_ids = {e.item_id for e in entries if e.item_id is not None}
+    items = {}
+    if item_ids:
+        items = {item.id: item for item in ChecklistItem.query.filter(
+            ChecklistItem.id.in_(item_ids))}
+    percent_complete = get_checklist(id).percent_complete
+
+    changes = []
+    for entry, description in described(entries):
+        item = items.get(entry.item_id)
+        changes.append((entry.id, {
+            "history": history_json(entry, description),
+            "item": item_json(item) if item is not None else None,
+            "reload": entry.action in _BULK_ACTIONS,
+            "percent_complete": percent_complete,
+        }))
+    return changes
+
+
+@bp.route('/<int:id>/events')
+@login_required
+def events(id):
+    """Stream the changes to the list as Server-Sent Events, starting after
+    the change with the id in the Last-Event-ID header when the browser
+    reconnects, or in last_id."""
+    if not current_app.config['LIVE_ENABLED']:
+        abort(404)
+
+    get_checklist(id)
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_id', 0, type=int)
+
+    def poll(after):
+        try:
+            return live_changes(id, after)
+        finally:
+            # Don't hold a connection from the pool between polls.
+            db.session.close()
+
+    db.session.close()
+    return stream_response(stream_with_context(
+        event_stream(id, last_id, poll)))
+
+
+@bp.route('/export.<string:fmt>')
+@login_required
+@read_replica
+def export_lists(fmt):
+    """Stream the user's lists as CSV or NDJSON, only those changed since
+    the time in since if given."""
+    since = _since()
+    return export_response(list_rows(g.user.id, since), LIST_FIELDS, fmt,
+                           'checklists')
+
+
+@bp.route('/<int:id>/export.<string:fmt>')
+@login_required
+@read_replica
+def export_checklist(id, fmt):
+    """Stream the list with its items and history as CSV or NDJSON. Only
+    the owner of the list may export it."""
+    since = _since()
+    checklist = get_checklist(
+        id, Checklist.query.filter_by(created_id=g.user.id))
+    return export_response(checklist_rows(checklist, since), RECORD_FIELDS,
+                           fmt, f'checklist-{id}')
+
+
+def _since():
+    try:
+        return parse_since(request.args.get('since'))
+    except ValueError:
+        abort(400)
 
 
 @bp.route('/<int:id>/check/<int:item_id>')
@@ -118,12 +415,38 @@ def toggle_item(id, item_id):
 def toggle_all(id):
     checklist = get_checklist(id)
 
-    [i.toggle(g.user) for i in checklist.items if i.done is False]
+    checklist.mark_items(True, g.user)
     db.session.commit()
 
     return redirect(url_for('checklist.view', id=id))
 
 
+@bp.route('/<int:id>/uncheck/all')
+@login_required
+def untoggle_all(id):
+    checklist = get_checklist(id)
+
+    checklist.mark_items(False, g.user)
+    db.session.commit()
+
+    return redirect(url_for('checklist.view', id=id))
+
+
+@bp.route('/<int:id>/items/mark', methods=('POST',))
+@login_required
+def mark_items_json(id):
+    """Mark the items with the ids posted as item_id as done, or as not
+    done if done is posted as 0, and return the number changed as JSON."""
+    checklist = get_checklist(id)
+    item_ids = request.form.getlist('item_id', type=int)
+    done = request.form.get('done', '1') != '0'
+
+    count = checklist.mark_items(done, g.user, item_ids)
+    db.session.commit()
+
+    return jsonify(count=count, percent_complete=checklist.percent_complete)
+
+
 @bp.route('/<int:id>/add', methods=('GET', 'POST'))
 @login_required
 def add_item(id):
@@ -136,7 +459,90 @@ def add_item(id):
         db.session.commit()
         return redirect(url_for('checklist.view', id=id))
 
-    return render_template('checklist/view_list.html', checklist=checklist, form=form)
+    checklist = get_checklist(id, Checklist.query.for_view())
+    return render_view(checklist, form)
+
+
+@bp.route('/<int:id>/clone')
+@login_required
+def clone(id):
+    """Copy the list, or create a list from the template, with every item
+    not done."""
+    checklist = get_checklist(id)
+    copy = checklist.clone(g.user)
+    db.session.commit()
+    return redirect(url_for('checklist.view', id=copy.id))
+
+
+@bp.route('/<int:id>/template')
+@login_required
+def save_template(id):
+    """Save a copy of the list as a template."""
+    checklist = get_checklist(id)
+    template = checklist.clone(g.user, as_template=True)
+    db.session.commit()
+    return redirect(url_for('checklist.view', id=template.id))
+
+
+@bp.route('/<int:id>/add/bulk', methods=('GET', 'POST'))
+@login_required
+def add_items(id):
+    """Add many items at once from pasted text or an uploaded CSV file."""
+    checklist = get_checklist(id)
+    form = BulkAddItemsForm()
+
+    if form.validate_on_submit():
+        checklist.add_items(form.texts, g.user)
+        db.session.commit()
+        return redirect(url_for('checklist.view', id=id))
+
+    return render_template('checklist/bulk_add.html', checklist=checklist,
+                           form=form)
+
+
+@bp.route('/<int:id>/items/<int:item_id>/toggle', methods=('POST',))
+@login_required
+def toggle_item_json(id, item_id):
+    """Toggle the item and return it with the change made as JSON."""
+    checklist = get_checklist(id)
+    item = get_item(checklist, item_id)
+
+    item.toggle(g.user)
+    change = checklist.last_change
+    db.session.commit()
+
+    return change_json(checklist, item, change)
+
+
+@bp.route('/<int:id>/items/<int:item_id>/delete', methods=('POST',))
+@login_required
+def delete_item_json(id, item_id):
+    """Delete the item and return it with the change made as JSON."""
+    checklist = get_checklist(id)
+    item = get_item(checklist, item_id)
+
+    checklist.delete_item(item, g.user)
+    change = checklist.last_change
+    db.session.commit()
+
+    return change_json(checklist, item, change)
+
+
+@bp.route('/<int:id>/items/add', methods=('POST',))
+@login_required
+def add_item_json(id):
+    """Add an item and return it with the change made as JSON."""
+    checklist = get_checklist(id)
+    form = AddItemForm()
+
+    if not form.validate_on_submit():
+        return jsonify(errors=form.errors), 400
+
+    item = checklist.add_item(form.item_text.data, g.user)
+    change = checklist.last_change
+    db.session.commit()
+
+    return change_json(checklist, item, change), 201
 
 
 @bp.route('/<int:id>/edit/<int:item_id>')
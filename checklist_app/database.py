@@ -0,0 +1,212 @@
+# ------------------------------------------------------------------
+# checklist.database
+# The Flask-SQLAlchemy extension tuned for file-backed SQLite: each
+# connection is set up with the pragmas in SQLITE_PRAGMAS, such as
+# WAL so that readers aren't blocked by writers, and connections are
+# pooled rather than opened for every request.
+#
+# Views marked with read_replica read from SQLALCHEMY_REPLICA_URI, if
+# set, unless they write or the user wrote in the last few seconds.
+# ------------------------------------------------------------------
+
+import functools
+import logging
+from collections import OrderedDict
+from time import time
+
+import click
+from flask import current_app, g, has_request_context
+from flask import session as user_session
+from flask.cli import with_appcontext
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool
+
+__all__ = (
+    "DEFAULT_SQLITE_PRAGMAS",
+    "REPLICA",
+    "RoutingSession",
+    "TunedSQLAlchemy",
+    "db_pragmas_command",
+    "effective_pragmas",
+    "read_replica",
+)
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PRAGMAS = OrderedDict([
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -16000),
+    ('mmap_size', 134217728),
+    ('foreign_keys', 'ON'),
+])
+
+# Passes the pragmas from apply_driver_hacks, which sees the app, to
+# create_engine, which doesn't.
+_PRAGMAS_OPTION = '_sqlite_pragmas'
+
+# The bind key of the replica in SQLALCHEMY_BINDS.
+REPLICA = '__replica__'
+
+# The key in the user's session of the time until which they read from
+# the primary.
+_STICKY_KEY = '_primary_until'
+
+
+def _is_file(sa_url):
+    return sa_url.drivername.startswith('sqlite') and \
+        sa_url.database not in (None, '', ':memory:')
+
+
+def effective_pragmas(connection, pragmas):
+    """Returns the values in effect on the DBAPI connection for each of
+    the pragmas named."""
+    cursor = connection.cursor()
+    try:
+        values = OrderedDict()
+        for name in pragmas:
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+        return values
+    finally:
+        cursor.close()
+
+
+def _set_pragmas(pragmas, engine):
+    reported = []
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+
+        # Report what is in effect for the first connection, warning if
+        # the journal mode wasn't accepted, as happens with WAL on a
+        # network file system.
+        if not reported:
+            reported.append(True)
+            values = effective_pragmas(dbapi_connection, pragmas)
+            log.info(f'SQLite pragmas for {engine.url}: {dict(values)}')
+
+            mode = pragmas.get('journal_mode')
+            if mode and _is_file(engine.url) and \
+                    str(values['journal_mode']).lower() != mode.lower():
+                log.warning(f'SQLite journal_mode is '
+                            f'{values["journal_mode"]}, not {mode}.')
+
+    event.listen(engine, 'connect', on_connect)
+
+
+def read_replica(view):
+    """Read from the replica, if there is one, while handling the view.
+    Only for views that read, though should one write anyway it and the
+    rest of the request go to the primary."""
+    @functools.wraps(view)
+    def route_to_replica(**kwargs):
+        primary_until = user_session.get(_STICKY_KEY)
+        if primary_until is None or primary_until < time():
+            g._read_replica = True
+
+        return view(**kwargs)
+
+    return route_to_replica
+
+
+def _wrote(*args):
+    """Keep the user on the primary for a while after a write so that
+    they see it whether or not the replica has caught up."""
+    if not has_request_context():
+        return
+
+    g._read_replica = False
+    seconds = current_app.config['REPLICA_STICKY_SECONDS']
+    if seconds:
+        user_session[_STICKY_KEY] = time() + seconds
+
+
+class RoutingSession(SignallingSession):
+    """Sends the statements of views marked with read_replica to the
+    replica and everything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and \
+                g.get('_read_replica') and \
+                self.app.config['SQLALCHEMY_REPLICA_URI']:
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA)
+
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+event.listen(RoutingSession, 'after_flush', _wrote)
+event.listen(RoutingSession, 'after_bulk_update', _wrote)
+event.listen(RoutingSession, 'after_bulk_delete', _wrote)
+
+
+class TunedSQLAlchemy(SQLAlchemy):
+    """Applies the SQLite settings from the app config to the engine and
+    routes reads to the replica when there is one."""
+
+    def init_app(self, app):
+        replica = app.config.setdefault('SQLALCHEMY_REPLICA_URI', None)
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        if replica:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds[REPLICA] = replica
+            app.config['SQLALCHEMY_BINDS'] = binds
+
+        super(TunedSQLAlchemy, self).init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super(TunedSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+
+        if not sa_url.drivername.startswith('sqlite'):
+            return
+
+        options[_PRAGMAS_OPTION] = app.config['SQLITE_PRAGMAS']
+
+        if _is_file(sa_url) and app.config['SQLITE_POOL_SIZE']:
+            # Keep connections open, and their pragmas and page cache with
+            # them, instead of opening a new connection every request.
+            options['poolclass'] = QueuePool
+            options['pool_size'] = app.config['SQLITE_POOL_SIZE']
+            options['max_overflow'] = app.config['SQLITE_POOL_OVERFLOW']
+            options.setdefault('connect_args', {})
+            options['connect_args']['check_same_thread'] = False
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop(_PRAGMAS_OPTION, None)
+        engine = super(TunedSQLAlchemy, self).create_engine(sa_url,
+                                                            engine_opts)
+        if pragmas:
+            _set_pragmas(pragmas, engine)
+        return engine
+
+
+@click.command('db-pragmas')
+@with_appcontext
+def db_pragmas_command():
+    """Show the SQLite pragmas in effect on a new connection."""
+    from checklist_app import db
+
+    if not db.engine.url.drivername.startswith('sqlite'):
+        click.echo('The database is not SQLite.')
+        return
+
+    connection = db.engine.raw_connection()
+    try:
+        values = effective_pragmas(connection,
+                                   current_app.config['SQLITE_PRAGMAS'])
+    finally:
+        connection.close()
+
+    for name, value in values.items():
+        click.echo(f'{name} = {value}')
@@ -0,0 +1,206 @@
+# ------------------------------------------------------------------
+# checklist.export
+# Streams a user's checklists, or one checklist with its items and
+# history, as CSV or newline delimited JSON. Rows are read in batches
+# and written out as they are read so that the memory used doesn't
+# grow with the size of the export.
+# ------------------------------------------------------------------
+
+import csv
+import io
+import json
+from datetime import datetime
+
+import click
+from flask import Response, abort, stream_with_context
+from flask.cli import with_appcontext
+
+from checklist_app import db
+from checklist_app.models import (Checklist, ChecklistHistory,
+                                  ChecklistHistoryArchive, ChecklistItem,
+                                  describe_history, get_user)
+
+__all__ = (
+    "FORMATS",
+    "LIST_FIELDS",
+    "RECORD_FIELDS",
+    "checklist_rows",
+    "export_command",
+    "export_response",
+    "list_rows",
+    "parse_since",
+    "render",
+)
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# The columns of an export of a user's lists.
+LIST_FIELDS = ('id', 'title', 'description', 'created', 'updated',
+               'is_template', 'active_count', 'done_count')
+
+# The columns of an export of one list, whose records are the list, its
+# items and its history. For the list the text is the title.
+RECORD_FIELDS = ('record', 'id', 'created', 'text', 'done', 'active',
+                 'user_id')
+
+_BATCH = 500
+_CHUNK = 16 * 1024
+_SINCE_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+
+def parse_since(value):
+    """Returns the datetime in the ISO 8601 value, with or without the
+    time, or None if the value is empty. Raises a ValueError if it can't
+    be read."""
+    if not value:
+        return None
+
+    for _format in _SINCE_FORMATS:
+        try:
+            return datetime.strptime(value, _format)
+        except ValueError:
+            pass
+    raise ValueError(f"Can't read {value} as a date and time.")
+
+
+def list_rows(user_id, since=None):
+    """Yield the lists of the user, only those changed since the time
+    given if there is one."""
+    query = db.session.query(*(getattr(Checklist, f) for f in LIST_FIELDS)) \
+        .filter(Checklist.created_id == user_id,
+                Checklist.is_deleted == db.false())
+    if since is not None:
+        query = query.filter(Checklist.updated >= since)
+
+    for row in query.order_by(Checklist.id).yield_per(_BATCH):
+        yield dict(zip(LIST_FIELDS, row))
+
+
+def checklist_rows(checklist, since=None):
+    """Yield the list, its active items and its history, archived or not,
+    as records.
+
+    Given a time since, the list and its items are only included if the
+    list has changed since then, and only the history recorded since then
+    is included.
+    """
+    changed = since is None or (checklist.updated is not None and
+                                checklist.updated >= since)
+    if changed:
+        yield {'record': 'list', 'id': checklist.id,
+               'created': checklist.created, 'text': checklist.title,
+               'done': None, 'active': None,
+               'user_id': checklist.created_id}
+
+        items = db.session.query(
+            ChecklistItem.id, ChecklistItem.created, ChecklistItem.text,
+            ChecklistItem.done, ChecklistItem.active
+        ).filter(
+            ChecklistItem.checklist_id == checklist.id,
+            ChecklistItem.active == db.true()
+        ).order_by(ChecklistItem.id)
+        for row in items.yield_per(_BATCH):
+            yield dict(zip(RECORD_FIELDS, ('item',) + tuple(row) + (None,)))
+
+    # The archived history is older than the rest so comes first.
+    for model in (ChecklistHistoryArchive, ChecklistHistory):
+        history = db.session.query(
+            model.id, model.created, model.action, model.description,
+            model.user_id, model.item_id, model.count, model.detail
+        ).filter(model.checklist_id == checklist.id)
+        if since is not None:
+            history = history.filter(model.created >= since)
+
+        for rows in _batches(history.order_by(model.id).yield_per(_BATCH)):
+            for row, description in zip(rows, describe_history(rows)):
+                yield {'record': 'history', 'id': row.id,
+                       'created': row.created, 'text': description,
+                       'done': None, 'active': None, 'user_id': row.user_id}
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == _BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't export {type(value).__name__}.")
+
+
+def render(rows, fields, fmt):
+    """Yield the rows written as CSV with a header or as one JSON object
+    per line, in chunks of about 16KB."""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fields, extrasaction='ignore')
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(row, default=_json_value))
+            buffer.write('\n')
+
+    for row in rows:
+        write(row)
+        if buffer.tell() >= _CHUNK:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_response(rows, fields, fmt, filename):
+    """Returns a response streaming the rows as an attachment."""
+    if fmt not in FORMATS:
+        abort(404)
+
+    response = Response(stream_with_context(render(rows, fields, fmt)),
+                        mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename={filename}.{fmt}'
+    return response
+
+
+@click.command('export')
+@click.option('--user', 'email', required=True,
+              help='The email of the user whose lists are exported.')
+@click.option('--list', 'checklist_id', type=int, default=None,
+              help='Export this list with its items and history.')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)),
+              default='csv')
+@click.option('--since', type=click.DateTime(formats=_SINCE_FORMATS),
+              default=None, help='Only what has changed since this time.')
+@click.option('--output', type=click.File('w'), default=None,
+              help='The file to write to instead of standard output.')
+@with_appcontext
+def export_command(email, checklist_id, fmt, since, output):
+    """Export a user's lists, or one list, as CSV or NDJSON."""
+    user = get_user(username=email)
+    if user is None:
+        raise click.BadParameter(f'No user {email}.', param_hint='--user')
+
+    if checklist_id is None:
+        chunks = render(list_rows(user.id, since), LIST_FIELDS, fmt)
+    else:
+        checklist = Checklist.query.filter_by(
+            id=checklist_id, created_id=user.id).first()
+        if checklist is None:
+            raise click.BadParameter(f'{email} has no list {checklist_id}.',
+                                     param_hint='--list')
+        chunks = render(checklist_rows(checklist, since), RECORD_FIELDS, fmt)
+
+    for chunk in chunks:
+        click.echo(chunk, file=output, nl=False)
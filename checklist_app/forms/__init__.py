@@ -2,4 +2,5 @@
 from .admin_forms import AddUserForm, EditUserForm
 from .auth_forms import (LoginForm, RegistrationForm, SendPasswordChangeForm,
                          UpdatePasswordForm)
-from .checklist_forms import AddItemForm, CreateListForm, EditListForm
+from .checklist_forms import (AddItemForm, BulkAddItemsForm, CreateListForm,
+                              EditListForm)
@@ -1,8 +1,8 @@
 from flask_wtf import FlaskForm
-from werkzeug.security import check_password_hash
 from wtforms import BooleanField, PasswordField, StringField, ValidationError
 
 from checklist_app.models import get_user
+from checklist_app.passwords import check_password
 
 from .shared_validators import (confirm_req, password_conf, password_req,
                                 username_combo, username_email)
@@ -23,7 +23,7 @@ class LoginForm(FlaskForm):
 
     def validate_password(self, field):
         if self._user:
-            if not check_password_hash(self._user.password, field.data):
+            if not check_password(self._user.password, field.data):
                 raise ValidationError(self.error_msg)
 
 
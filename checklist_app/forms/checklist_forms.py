@@ -1,7 +1,17 @@
+import csv
+import io
+
+from flask import current_app
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField
+from flask_wtf.file import FileAllowed, FileField
+from wtforms import BooleanField, StringField, TextAreaField, ValidationError
 from wtforms.validators import InputRequired
 
+MAX_ITEM_LENGTH = 1000
+
+# The names of a column in the header of a CSV file that holds the text.
+_TEXT_COLUMNS = ("text", "item", "items", "task")
+
 
 class CreateListForm(FlaskForm):
     list_title = StringField(
@@ -22,3 +32,68 @@ class AddItemForm(FlaskForm):
         validators=[InputRequired("Text for item required.")],
         default=""
     )
+
+
+class BulkAddItemsForm(FlaskForm):
+    """Add many items at once, one per line of the text or of an uploaded
+    .txt file, or one per row of an uploaded CSV file with the text in the
+    first column. If the CSV file has a header the text is read from the
+    column named text, item, items or task if there is one. The items read
+    are kept in texts once the form has been validated."""
+    items_text = TextAreaField("items_text", default="")
+    items_file = FileField(
+        "items_file",
+        validators=[FileAllowed(["csv", "txt"], "Upload a .csv or .txt file.")]
+    )
+    has_header = BooleanField("has_header")
+
+    def _lines(self):
+        """Yield the number and text of each line, or of each row of a CSV
+        file after its header if has_header is checked."""
+        upload = self.items_file.data
+        if not upload:
+            yield from enumerate(self.items_text.data.splitlines(), 1)
+            return
+
+        if not upload.filename.lower().endswith(".csv"):
+            stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig")
+            for number, line in enumerate(stream, 1):
+                yield number, line.rstrip("\n")
+            return
+
+        stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig",
+                                  newline="")
+        column = 0
+        for number, row in enumerate(csv.reader(stream), 1):
+            if number == 1 and self.has_header.data:
+                names = [name.strip().lower() for name in row]
+                named = [name for name in _TEXT_COLUMNS if name in names]
+                if named:
+                    column = names.index(named[0])
+                continue
+            yield number, row[column] if len(row) > column else ""
+
+    def validate_items_text(self, field):
+        # Check the items as they're read so that a bad file is rejected
+        # without reading the rest of it.
+        max_items = current_app.config["BULK_ADD_MAX_ITEMS"]
+        self.texts = []
+        try:
+            for number, text in self._lines():
+                text = text.strip()
+                if not text:
+                    continue
+                if len(text) > MAX_ITEM_LENGTH:
+                    raise ValidationError(
+                        f"Item on line {number} is longer than "
+                        f"{MAX_ITEM_LENGTH} characters.")
+                if len(self.texts) == max_items:
+                    raise ValidationError(
+                        f"No more than {max_items} items can be added at "
+                        f"once.")
+                self.texts.append(text)
+        except (UnicodeDecodeError, csv.Error):
+            raise ValidationError("The file couldn't be read as UTF-8 CSV.")
+
+        if not self.texts:
+            raise ValidationError("Enter or upload at least one item.")
@@ -0,0 +1,134 @@
+# ------------------------------------------------------------------
+# checklist.instrumentation
+# Counts the SQL statements made by each request and the time spent
+# on them. The totals are returned in a Server-Timing header and
+# logged, and a request repeating the same statement more than
+# QUERY_REPEAT_LIMIT times is reported as a likely N+1 query.
+# ------------------------------------------------------------------
+
+import json
+from collections import Counter
+from time import perf_counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = (
+    "RepeatedQueryError",
+    "init_app",
+    "query_stats",
+)
+
+
+class RepeatedQueryError(Exception):
+    """Raised when a request repeats a statement more times than allowed."""
+
+
+class QueryStats():
+    """The statements made while handling one request."""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+
+def query_stats():
+    """Returns the statistics for the current request or None."""
+    if not has_request_context():
+        return None
+
+    return g.get('_query_stats')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('_query_started', []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info['_query_started'].pop()
+    stats = query_stats()
+    if stats is not None:
+        stats.record(statement, perf_counter() - started)
+
+
+def _handle_error(context):
+    # The statement failed so after_cursor_execute won't be called.
+    if context.connection is not None:
+        started = context.connection.info.get('_query_started')
+        if started:
+            started.pop()
+
+
+def _start_request():
+    g._query_stats = QueryStats()
+
+
+def _check_repeats(stats):
+    limit = current_app.config['QUERY_REPEAT_LIMIT']
+    if limit is None or not stats.statements:
+        return
+
+    statement, count = stats.statements.most_common(1)[0]
+    if count <= limit:
+        return
+
+    message = (f"{request.endpoint} ran the same statement {count} times: "
+               f"{statement}")
+    action = current_app.config['QUERY_REPEAT_ACTION']
+    if action is None:
+        action = 'raise' if current_app.testing else 'warn'
+
+    if action == 'raise':
+        raise RepeatedQueryError(message)
+    current_app.logger.warning(message)
+
+
+def _finish_request(response):
+    stats = query_stats()
+    if stats is None:
+        return response
+
+    total = (perf_counter() - stats.started) * 1000
+    db_time = stats.duration * 1000
+
+    if current_app.config['SERVER_TIMING']:
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={db_time:.2f};desc="{stats.count} queries", '
+            f'app;dur={total:.2f}'
+        )
+
+    current_app.logger.info(json.dumps({
+        "endpoint": request.endpoint,
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "queries": stats.count,
+        "db_ms": round(db_time, 2),
+        "total_ms": round(total, 2),
+    }))
+
+    _check_repeats(stats)
+    return response
+
+
+def init_app(app):
+    """Count the statements made by each request to the app."""
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
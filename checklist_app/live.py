@@ -0,0 +1,161 @@
+# ------------------------------------------------------------------
+# checklist.live
+# Pushes the changes to a list to the browsers viewing it as Server-
+# Sent Events. A stream reads the history recorded after the last
+# entry it sent whenever a commit in the same process wakes it, and
+# every LIVE_POLL_INTERVAL seconds regardless so that changes made by
+# other workers are also sent.
+# ------------------------------------------------------------------
+
+import json
+from collections import defaultdict
+from threading import Event, Lock
+from time import monotonic
+
+from flask import Response, current_app, has_app_context
+from sqlalchemy import event
+
+from checklist_app.database import RoutingSession
+from checklist_app.models import ChecklistHistory
+
+__all__ = (
+    "Broker",
+    "event_stream",
+    "format_event",
+    "init_app",
+    "stream_response",
+)
+
+# The key in the session's info of the lists changed in the transaction.
+_CHANGED_KEY = '_live_changed'
+
+
+class Broker():
+    """Wakes the streams of a list when a change to it is committed."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, key):
+        """Returns an Event that is set on each change to the list."""
+        subscription = Event()
+        with self._lock:
+            self._subscribers[key].add(subscription)
+        return subscription
+
+    def unsubscribe(self, key, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def publish(self, key):
+        with self._lock:
+            for subscription in self._subscribers.get(key, ()):
+                subscription.set()
+
+    def count(self, key=None):
+        """Returns the number of streams open, of one list or of all."""
+        with self._lock:
+            if key is not None:
+                return len(self._subscribers.get(key, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+
+def _broker():
+    return current_app.extensions['live_broker']
+
+
+def _after_flush(session, flush_context):
+    changed = [obj.checklist_id for obj in session.new
+               if isinstance(obj, ChecklistHistory)]
+    if changed:
+        session.info.setdefault(_CHANGED_KEY, set()).update(changed)
+
+
+def _after_commit(session):
+    changed = session.info.pop(_CHANGED_KEY, None)
+    if changed and has_app_context() and \
+            'live_broker' in current_app.extensions:
+        for checklist_id in changed:
+            _broker().publish(checklist_id)
+
+
+def _after_rollback(session):
+    session.info.pop(_CHANGED_KEY, None)
+
+
+event.listen(RoutingSession, 'after_flush', _after_flush)
+event.listen(RoutingSession, 'after_commit', _after_commit)
+event.listen(RoutingSession, 'after_rollback', _after_rollback)
+
+
+def format_event(data, id=None, name=None):
+    """Returns the data as JSON in a Server-Sent Event."""
+    lines = []
+    if id is not None:
+        lines.append(f'id: {id}')
+    if name is not None:
+        lines.append(f'event: {name}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream(key, last_id, poll):
+    """Yield the changes to the list as events until LIVE_STREAM_TIMEOUT,
+    when the browser reconnects, with a comment every LIVE_HEARTBEAT
+    seconds without a change so that proxies keep the stream open.
+
+    Parameters:
+    -----------
+    * key: The id of the list.
+    * last_id: The id of the last change the browser has.
+    * poll: A function returning the changes after an id as a list of
+      the id of each change and the data to send for it.
+    """
+    config = current_app.config
+    broker = _broker()
+    subscription = broker.subscribe(key)
+    started = last_sent = monotonic()
+    try:
+        # Ask the browser to wait a moment before reconnecting.
+        yield f'retry: {int(config["LIVE_RETRY"] * 1000)}\n\n'
+
+        while True:
+            subscription.clear()
+            changes = poll(last_id)
+            for id, data in changes:
+                yield format_event(data, id=id, name='change')
+                last_id = id
+
+            now = monotonic()
+            if changes:
+                last_sent = now
+            if now - started >= config['LIVE_STREAM_TIMEOUT']:
+                return
+            if now - last_sent >= config['LIVE_HEARTBEAT']:
+                yield ': heartbeat\n\n'
+                last_sent = now
+
+            subscription.wait(min(
+                config['LIVE_POLL_INTERVAL'],
+                config['LIVE_HEARTBEAT'] - (now - last_sent),
+                config['LIVE_STREAM_TIMEOUT'] - (now - started)))
+    finally:
+        broker.unsubscribe(key, subscription)
+
+
+def stream_response(events):
+    """Returns a response streaming the events."""
+    response = Response(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def init_app(app):
+    """Create the broker of the changes to lists for the app."""
+    app.extensions['live_broker'] = Broker()
@@ -0,0 +1,148 @@
+# ------------------------------------------------------------------
+# checklist.mailer
+# Sends the messages queued in the outbox. Requests only queue the
+# message; the worker sends them in batches over one connection.
+# ------------------------------------------------------------------
+
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import Message
+
+from checklist_app import db, mail
+from checklist_app.models import OutboxMessage, outbox_depth
+
+__all__ = (
+    "mail_worker_command",
+    "send_pending",
+)
+
+
+def _retry_later(message, error, now):
+    """Record the failure and schedule the next attempt, backing off
+    exponentially until the maximum number of attempts is reached."""
+    message.attempts += 1
+    message.last_error = str(error)
+
+    if message.attempts >= current_app.config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+        message.failed = True
+        current_app.logger.error(f"Giving up on message {message.id}: "
+                                 f"{error}")
+    else:
+        delay = current_app.config['MAIL_OUTBOX_RETRY_DELAY']
+        message.next_attempt = now + timedelta(
+            seconds=delay * 2 ** (message.attempts - 1))
+        current_app.logger.warning(f"Failed to send message {message.id}, "
+                                   f"retrying at {message.next_attempt}.")
+
+
+def _claim(batch_size, now):
+    """Claim the messages that are due in one short UPDATE, so that two
+    workers never send the same message. A claim not released within
+    MAIL_OUTBOX_CLAIM_TIMEOUT seconds, by a worker that died, lapses.
+
+    Returns:
+    --------
+    The token the messages were claimed with.
+    """
+    token = uuid4().hex
+    lapsed = now - timedelta(
+        seconds=current_app.config['MAIL_OUTBOX_CLAIM_TIMEOUT'])
+    claimable = (
+        OutboxMessage.sent.is_(None),
+        OutboxMessage.failed == db.false(),
+        OutboxMessage.next_attempt <= now,
+        db.or_(OutboxMessage.claimed_at.is_(None),
+               OutboxMessage.claimed_at < lapsed),
+    )
+    due = db.session.query(OutboxMessage.id).filter(*claimable) \
+        .order_by(OutboxMessage.next_attempt, OutboxMessage.id) \
+        .limit(batch_size).subquery()
+
+    # The conditions are repeated so that a message claimed by another
+    # worker since the subquery was read is left alone.
+    OutboxMessage.query.filter(
+        OutboxMessage.id.in_(db.select([due.c.id])), *claimable
+    ).update({OutboxMessage.claimed_by: token,
+              OutboxMessage.claimed_at: now}, synchronize_session=False)
+    db.session.commit()
+    return token
+
+
+def send_pending(batch_size=None):
+    """Send the messages in the outbox that are due over a single
+    connection to the mail server, after claiming them.
+
+    Parameters:
+    -----------
+    * batch_size: The most messages to send. (Default MAIL_OUTBOX_BATCH_SIZE)
+
+    Returns:
+    --------
+    The number of messages sent.
+    """
+    if batch_size is None:
+        batch_size = current_app.config['MAIL_OUTBOX_BATCH_SIZE']
+
+    now = datetime.utcnow()
+    token = _claim(batch_size, now)
+    messages = OutboxMessage.query.filter_by(claimed_by=token) \
+        .order_by(OutboxMessage.next_attempt, OutboxMessage.id).all()
+
+    if not messages:
+        return 0
+
+    sent = 0
+    try:
+        with mail.connect() as connection:
+            for message in messages:
+                try:
+                    connection.send(Message(
+                        subject=message.subject,
+                        recipients=message.recipient_list,
+                        sender=message.sender,
+                        body=message.body
+                    ))
+                except Exception as e:
+                    _retry_later(message, e, now)
+                else:
+                    message.sent = datetime.utcnow()
+                    sent += 1
+    except Exception as e:
+        # Couldn't connect to, or lost the connection to, the server.
+        # Those already sent, or rescheduled or given up on above, aren't
+        # counted again.
+        for message in messages:
+            if message.sent is None and not message.failed and \
+                    message.next_attempt <= now:
+                _retry_later(message, e, now)
+
+    for message in messages:
+        message.claimed_by = message.claimed_at = None
+    db.session.commit()
+    return sent
+
+
+@click.command('mail-worker')
+@click.option('--once', is_flag=True, help='Send what is due and exit.')
+@click.option('--interval', default=5.0,
+              help='Seconds to wait when the outbox is empty.')
+@click.option('--batch-size', type=int, default=None,
+              help='The most messages to send over one connection.')
+@with_appcontext
+def mail_worker_command(once, interval, batch_size):
+    """Send the messages waiting in the outbox."""
+    while True:
+        sent = send_pending(batch_size)
+        if sent or once:
+            click.echo(f'Sent {sent} message(s), {outbox_depth()} waiting.')
+        db.session.remove()
+
+        if once:
+            break
+        if not sent:
+            time.sleep(interval)
@@ -1,4 +1,6 @@
 # flake8: noqa
 from checklist_app.models.checklist import *
+from checklist_app.models.outbox import *
 from checklist_app.models.password_token import *
+from checklist_app.models.search import *
 from checklist_app.models.user import *
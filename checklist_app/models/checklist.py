@@ -1,17 +1,90 @@
-from datetime import datetime
+import re
+from datetime import datetime, timedelta
+from enum import IntEnum
 
-from checklist_app import db
+from flask_sqlalchemy import BaseQuery
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.sql import ClauseElement
+
+from checklist_app import db
 
 __all__ = (
     "Checklist",
     "ChecklistFactory",
     "ChecklistHistory",
-    "ChecklistItem"
+    "ChecklistHistoryArchive",
+    "ChecklistItem",
+    "HistoryAction",
+    "archive_history",
+    "describe_history",
+    "migrate_history",
+    "recount_items",
 )
 
 
+# Rows per INSERT when adding items in bulk. With five values each this
+# stays under the 999 parameters allowed by older versions of SQLite.
+_INSERT_ROWS = 150
+
+
+class HistoryAction(IntEnum):
+    """The changes recorded in the history of a list."""
+    ADDED_ITEM = 1
+    ADDED_ITEMS = 2
+    DONE = 3
+    NOT_DONE = 4
+    MARKED_DONE = 5
+    MARKED_NOT_DONE = 6
+    DELETED_ITEM = 7
+    FROM_LIST = 8
+    FROM_TEMPLATE = 9
+
+
+# How each action is described, after the name of the user who made it.
+_DESCRIPTIONS = {
+    HistoryAction.ADDED_ITEM: "added {item}.",
+    HistoryAction.ADDED_ITEMS: "added {count} {items}.",
+    HistoryAction.DONE: "marked {item} as done.",
+    HistoryAction.NOT_DONE: "marked {item} as not done.",
+    HistoryAction.MARKED_DONE: "marked {count} {items} as done.",
+    HistoryAction.MARKED_NOT_DONE: "marked {count} {items} as not done.",
+    HistoryAction.DELETED_ITEM: "deleted {item}.",
+    HistoryAction.FROM_LIST: "created this list from the list {detail}.",
+    HistoryAction.FROM_TEMPLATE:
+        "created this list from the template {detail}.",
+}
+
+
+class ChecklistQuery(BaseQuery):
+    """Query for checklists with the loader options used by the views.
+
+    The items and history of a checklist are loaded only when accessed so
+    a plain query loads just the header. Views that show the items or
+    history should ask for them here so they are loaded up front.
+    """
+
+    def with_active_items(self):
+        """Load the active items of the lists in one further SELECT."""
+        return self.options(db.selectinload(Checklist.active_items))
+
+    def with_history(self):
+        """Load the history of the lists in the same SELECT."""
+        return self.options(db.joinedload(Checklist.history))
+
+    def for_view(self):
+        """Load what is shown when viewing a list. Only the latest history
+        is shown so it is read a page at a time with history_page."""
+        return self.with_active_items()
+
+
 class Checklist(db.Model):
+    query_class = ChecklistQuery
+    __table_args__ = (
+        # Lists of a user as shown on the index.
+        db.Index('ix_checklist_created_id_is_deleted',
+                 'created_id', 'is_deleted'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String, nullable=False)
     description = db.Column(db.Text, nullable=True)
@@ -21,62 +94,299 @@ class Checklist(db.Model):
                             nullable=False)
     created = db.Column(db.DateTime, default=datetime.utcnow)
     is_deleted = db.Column(db.Boolean, default=False)
+    # Denormalised counts of the active and the completed active items so
+    # that the completion can be read without loading the items.
+    active_count = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
+    done_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
+    # Bumped on every change so that cached copies of the list can be
+    # validated without loading it.
+    version = db.Column(db.Integer, nullable=False, default=0,
+                        server_default='0')
+    updated = db.Column(db.DateTime, default=datetime.utcnow)
+    # Templates are lists kept to be cloned rather than worked through.
+    is_template = db.Column(db.Boolean, nullable=False, default=False,
+                            server_default='0')
+    # The number of entries moved from the history to the archive.
+    archived_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
 
     created_by = db.relationship('User')
     assigned_to = db.relationship('User')
-
-    @hybrid_property
-    def active_items(self):
-        return self.items.query.filter_by(active=True).all()
+    active_items = db.relationship(
+        'ChecklistItem',
+        primaryjoin='and_(Checklist.id == ChecklistItem.checklist_id, '
+                    'ChecklistItem.active == True)',
+        order_by='ChecklistItem.id',
+        viewonly=True
+    )
 
     @hybrid_property
     def percent_complete(self):
-        _active_items = [i for i in self.items if i.active]
-        if len(_active_items) == 0:
+        if isinstance(self.__dict__.get('active_count'), ClauseElement) or \
+                isinstance(self.__dict__.get('done_count'), ClauseElement):
+            # The counts are being adjusted in the database so flush to
+            # read them back.
+            db.session.flush()
+
+        if not self.active_count:
             return 0
 
-        done = sum([1 for i in _active_items if i.done])
-        return done / len(_active_items)
+        return (self.done_count or 0) / self.active_count
+
+    def _adjust_counts(self, active=0, done=0):
+        """Adjust the denormalised item counts by the amounts given."""
+        for name, amount in (('active_count', active), ('done_count', done)):
+            if not amount:
+                continue
+
+            pending = self.__dict__.get(name)
+            if isinstance(pending, ClauseElement):
+                # Already being adjusted in this flush so add to that.
+                setattr(self, name, pending + amount)
+            elif db.inspect(self).persistent:
+                # Increment in the database so concurrent changes aren't
+                # lost.
+                setattr(self, name, getattr(Checklist, name) + amount)
+            else:
+                setattr(self, name, (getattr(self, name) or 0) + amount)
+
+    def touch(self):
+        """Bump the version of the checklist, and of the lists of its
+        owner, after a change."""
+        if db.inspect(self).persistent:
+            # Increment in the database so concurrent changes aren't lost.
+            self.version = Checklist.version + 1
+        else:
+            self.version = (self.version or 0) + 1
+        self.updated = datetime.utcnow()
+
+        if self.created_by is not None:
+            self.created_by.touch_lists()
 
-    def record_change(self, description, user):
-        _desc = f"{user.full_name} {description}"
-        record = ChecklistHistory(description=_desc, checklist=self,
-                                  user=user, created=datetime.utcnow())
-        self.history.append(record)
+    def record_change(self, action, user, item=None, count=None,
+                      detail=None):
+        """Record the change in the history of the checklist. The record
+        is also kept as last_change for the caller to report on.
+
+        Parameters:
+        -----------
+        * action: The HistoryAction of the change.
+        * user: The user making the change.
+        * item: The item changed, if the change is to one item.
+        * count: The number of items changed, if the change is to many.
+        * detail: Anything else the description needs.
+        """
+        # Setting the checklist adds the record to the history through the
+        # backref without loading the existing history.
+        record = ChecklistHistory(action=action, checklist=self, user=user,
+                                  item=item, count=count, detail=detail,
+                                  created=datetime.utcnow())
+        self.last_change = record
+        self.touch()
+        return record
 
     def add_item(self, text, user, done=False):
-        item = ChecklistItem(text=text, done=done)
-        self.items.append(item)
-        self.record_change(f"added {item.text}.", user)
+        # Setting the checklist adds the item through the backref without
+        # loading the existing items.
+        item = ChecklistItem(text=text, done=done, checklist=self)
+        self._adjust_counts(active=1, done=1 if done else 0)
+        self.record_change(HistoryAction.ADDED_ITEM, user, item=item)
         return item
 
+    def add_items(self, texts, user, done=False):
+        """Add many items with multi-row INSERTs rather than one statement
+        per item and record one change summarising them.
+
+        Parameters:
+        -----------
+        * texts: The text of each of the items.
+        * user: The user making the change.
+        * done: True to add the items as done.
+
+        Returns:
+        --------
+        The number of items added.
+        """
+        now = datetime.utcnow()
+        if self.id is None:
+            db.session.flush()
+
+        rows = [{"text": text, "done": done, "active": True,
+                 "checklist_id": self.id, "created": now}
+                for text in texts]
+        if not rows:
+            return 0
+
+        insert = ChecklistItem.__table__.insert()
+        for i in range(0, len(rows), _INSERT_ROWS):
+            db.session.execute(insert.values(rows[i:i + _INSERT_ROWS]))
+
+        # The items were added behind the session's back so read them again.
+        db.session.expire(self, ['items', 'active_items'])
+
+        count = len(rows)
+        self._adjust_counts(active=count, done=count if done else 0)
+        self.record_change(HistoryAction.ADDED_ITEMS, user, count=count)
+        return count
+
+    def clone(self, user, title=None, reset_done=True, as_template=False):
+        """Copy the list and its active items. The items are copied in the
+        database with a single INSERT ... SELECT without being loaded.
+
+        Parameters:
+        -----------
+        * user: The user making the copy, who owns it.
+        * title: The title of the copy, by default that of the list.
+        * reset_done: True to copy every item as not done.
+        * as_template: True to make the copy a template.
+
+        Returns:
+        --------
+        The copy, added to the session.
+        """
+        copy = Checklist(
+            title=title or self.title,
+            description=self.description,
+            created_by=user,
+            assigned_to=user,
+            is_template=as_template
+        )
+        db.session.add(copy)
+        db.session.flush()
+
+        columns = ChecklistItem.__table__.c
+        done = db.false() if reset_done else columns.done
+        items = db.select([
+            columns.text, done, db.true(),
+            db.literal(copy.id), db.literal(datetime.utcnow())
+        ]).where(db.and_(
+            columns.checklist_id == self.id,
+            columns.active == db.true()
+        )).order_by(columns.id)
+        insert = ChecklistItem.__table__.insert().from_select(
+            ['text', 'done', 'active', 'checklist_id', 'created'], items)
+        result = db.session.execute(insert)
+
+        count = result.rowcount
+        copy._adjust_counts(active=count,
+                            done=0 if reset_done else self.done_count)
+        action = HistoryAction.FROM_TEMPLATE if self.is_template \
+            else HistoryAction.FROM_LIST
+        copy.record_change(action, user, detail=self.title)
+        return copy
+
+    def history_page(self, before=None, limit=20, archived=False):
+        """Get a page of the history of the list, newest first.
+
+        Parameters:
+        -----------
+        * before: The id of the last entry of the previous page.
+        * limit: The number of entries in a page.
+        * archived: True to read the archived history instead.
+
+        Returns:
+        --------
+        The entries and the id to pass as before for the next page, or None
+        if there are no older entries.
+        """
+        model = ChecklistHistoryArchive if archived else ChecklistHistory
+        query = model.query.filter(model.checklist_id == self.id)
+
+        if before is not None:
+            created = db.session.query(model.created).filter_by(
+                id=before, checklist_id=self.id).scalar()
+            if created is None:
+                return [], None
+
+            # Equivalent to (created, id) < (created, before), written so
+            # that the range on created can be read from the index.
+            query = query.filter(
+                model.created <= created,
+                db.or_(model.created < created, model.id < before)
+            )
+
+        entries = query.order_by(model.created.desc(), model.id.desc()) \
+            .limit(limit + 1).all()
+        more = len(entries) > limit
+        entries = entries[:limit]
+        return entries, entries[-1].id if more else None
+
+    def mark_items(self, done, user, item_ids=None):
+        """Mark the active items of the checklist as done or not done with
+        a single UPDATE and record one change summarising it.
+
+        Parameters:
+        -----------
+        * done: True to mark the items done, False for not done.
+        * user: The user making the change.
+        * item_ids: Limit the change to the items with these ids. If None
+          then all of the active items are marked.
+
+        Returns:
+        --------
+        The number of items changed.
+        """
+        items = ChecklistItem.query.filter(
+            ChecklistItem.checklist_id == self.id,
+            ChecklistItem.active == db.true(),
+            ChecklistItem.done == (not done)
+        )
+        if item_ids is not None:
+            items = items.filter(ChecklistItem.id.in_(item_ids))
+
+        count = items.update({ChecklistItem.done: done},
+                             synchronize_session=False)
+
+        # Expire any of the items already loaded so they are read again.
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, ChecklistItem) and obj.checklist_id == self.id:
+                db.session.expire(obj, ['done'])
+
+        if count:
+            self._adjust_counts(done=count if done else -count)
+            action = HistoryAction.MARKED_DONE if done \
+                else HistoryAction.MARKED_NOT_DONE
+            self.record_change(action, user, count=count)
+
+        return count
+
     def delete_item(self, item, user):
+        if item.active:
+            self._adjust_counts(active=-1, done=-1 if item.done else 0)
+
         item.active = False
-        self.record_change(f"deleted {item.text}.", user)
+        self.record_change(HistoryAction.DELETED_ITEM, user, item=item)
         return item
 
 
 class ChecklistItem(db.Model):
+    __table_args__ = (
+        # Items of a list and the active items of a list.
+        db.Index('ix_checklist_item_checklist_id_active',
+                 'checklist_id', 'active'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.String, nullable=False)
     done = db.Column(db.Boolean, nullable=False, default=False)
     active = db.Column(db.Boolean, nullable=False, default=True)
     checklist_id = db.Column(db.Integer, db.ForeignKey('checklist.id'),
                              nullable=False)
-    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow())
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     checklist = db.relationship('Checklist',
-                                backref=db.backref('items', lazy=False))
+                                backref=db.backref('items', lazy=True))
 
     def toggle(self, user):
         self.done = not self.done
 
-        if self.done:
-            _desc = f"marked {self.text} as done."
-        else:
-            _desc = f"marked {self.text} as not done."
+        if self.active:
+            self.checklist._adjust_counts(done=1 if self.done else -1)
 
-        self.checklist.record_change(_desc, user)
+        action = HistoryAction.DONE if self.done else HistoryAction.NOT_DONE
+        self.checklist.record_change(action, user, item=self)
         return self
 
 
@@ -89,13 +399,393 @@ class ChecklistFactory():
         db.session.commit()
 
 
+def recount_items(checklist_id=None):
+    """Recompute the active and done counts of the checklists from their
+    items. Used to backfill the counts and to repair any drift.
+
+    Parameters:
+    -----------
+    * checklist_id: Limit the recount to one checklist. (Default all)
+
+    Returns:
+    --------
+    The number of checklists updated.
+    """
+    item = ChecklistItem.__table__
+    table = Checklist.__table__
+    active = db.and_(item.c.checklist_id == table.c.id,
+                     item.c.active == db.true())
+
+    active_count = db.select([db.func.count(item.c.id)]) \
+        .where(active).as_scalar()
+    done_count = db.select([db.func.count(item.c.id)]) \
+        .where(db.and_(active, item.c.done == db.true())).as_scalar()
+
+    stmt = table.update().values(active_count=active_count,
+                                 done_count=done_count)
+    if checklist_id is not None:
+        stmt = stmt.where(table.c.id == checklist_id)
+
+    result = db.session.execute(stmt)
+    db.session.commit()
+    return result.rowcount
+
+
 class ChecklistHistory(db.Model):
+    """A change to a list, stored as the action with the ids of the user
+    and item and described when shown by describe_history. Entries from
+    before actions were recorded, that migrate_history couldn't convert,
+    have only a description."""
+    __table_args__ = (
+        # History of a list in the order it was created, read newest first
+        # a page at a time.
+        db.Index('ix_checklist_history_checklist_id_created_id',
+                 'checklist_id', 'created', 'id'),
+        # Changes to an item, such as who marked it done.
+        db.Index('ix_checklist_history_item_id_action', 'item_id', 'action'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    description = db.Column(db.Text, nullable=False)
-    created = db.Column(db.DateTime, default=datetime.utcnow())
+    action = db.Column(db.Integer, nullable=True)
+    description = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
     checklist_id = db.Column(db.Integer, db.ForeignKey('checklist.id'))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    item_id = db.Column(db.Integer, db.ForeignKey('checklist_item.id'),
+                        nullable=True)
+    count = db.Column(db.Integer, nullable=True)
+    detail = db.Column(db.String, nullable=True)
 
     checklist = db.relationship('Checklist',
-                                backref=db.backref('history', lazy=True))
+                                backref=db.backref(
+                                    'history', lazy=True,
+                                    order_by='ChecklistHistory.id'))
     user = db.relationship('User')
+    item = db.relationship('ChecklistItem')
+
+
+class ChecklistHistoryArchive(db.Model):
+    """History moved out of checklist_history once it is older than the
+    retention period. Each entry keeps the id it had in the history and
+    may stand for a run of changes collapsed into one."""
+    __table_args__ = (
+        db.Index('ix_checklist_history_archive_checklist_id_created_id',
+                 'checklist_id', 'created', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    action = db.Column(db.Integer, nullable=True)
+    description = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime)
+    checklist_id = db.Column(db.Integer, db.ForeignKey('checklist.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    item_id = db.Column(db.Integer, db.ForeignKey('checklist_item.id'),
+                        nullable=True)
+    count = db.Column(db.Integer, nullable=True)
+    detail = db.Column(db.String, nullable=True)
+    # The number of changes the entry stands for.
+    changes = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
+
+
+def _load(model, ids, attributes):
+    """Returns the instances of the model with the ids as a dict by id,
+    using those in the session with the attributes loaded and reading the
+    rest with one SELECT."""
+    mapper = db.inspect(model)
+    loaded, missing = {}, []
+    for id in ids:
+        if id is None:
+            continue
+
+        obj = db.session.identity_map.get(
+            mapper.identity_key_from_primary_key([id]))
+        if obj is not None and \
+                not db.inspect(obj).unloaded.intersection(attributes):
+            loaded[id] = obj
+        else:
+            missing.append(id)
+
+    if missing:
+        for obj in model.query.filter(mapper.primary_key[0].in_(missing)):
+            loaded[obj.id] = obj
+    return loaded
+
+
+def describe_history(entries):
+    """Describe the entries of the history, reading the users and items
+    they name all at once.
+
+    Parameters:
+    -----------
+    * entries: Entries of the history, archived or not, or rows with the
+      same columns.
+
+    Returns:
+    --------
+    A list of the descriptions in the same order as the entries.
+    """
+    from checklist_app.models.user import User
+
+    entries = list(entries)
+    actions = [e for e in entries if e.action is not None]
+    users = _load(User, {e.user_id for e in actions},
+                  ('given_name', 'family_name'))
+    items = _load(ChecklistItem, {e.item_id for e in actions}, ('text',))
+
+    descriptions = []
+    for entry in entries:
+        if entry.action is None:
+            descriptions.append(entry.description)
+            continue
+
+        user = users.get(entry.user_id)
+        item = items.get(entry.item_id)
+        description = _DESCRIPTIONS[HistoryAction(entry.action)].format(
+            item=item.text if item is not None else "an item",
+            count=entry.count,
+            items="item" if entry.count == 1 else "items",
+            detail=entry.detail
+        )
+        name = user.full_name if user is not None else "Someone"
+        descriptions.append(f"{name} {description}")
+
+    return descriptions
+
+
+# Descriptions recorded before actions were, less the name of the user,
+# with the action each is converted to by migrate_history. The first
+# that matches is used.
+_LEGACY = (
+    (re.compile(r'^added (\d+) items?\.$'), HistoryAction.ADDED_ITEMS),
+    (re.compile(r'^marked (\d+) items? as done\.$'),
+     HistoryAction.MARKED_DONE),
+    (re.compile(r'^marked (\d+) items? as not done\.$'),
+     HistoryAction.MARKED_NOT_DONE),
+    (re.compile(r'^marked (.+) as not done\.$'), HistoryAction.NOT_DONE),
+    (re.compile(r'^marked (.+) as done\.$'), HistoryAction.DONE),
+    (re.compile(r'^added (.+)\.$'), HistoryAction.ADDED_ITEM),
+    (re.compile(r'^deleted (.+)\.$'), HistoryAction.DELETED_ITEM),
+    (re.compile(r'^created this list from the list (.+)\.$'),
+     HistoryAction.FROM_LIST),
+    (re.compile(r'^created this list from the template (.+)\.$'),
+     HistoryAction.FROM_TEMPLATE),
+)
+
+_ITEM_ACTIONS = (HistoryAction.ADDED_ITEM, HistoryAction.DONE,
+                 HistoryAction.NOT_DONE, HistoryAction.DELETED_ITEM)
+_COUNT_ACTIONS = (HistoryAction.ADDED_ITEMS, HistoryAction.MARKED_DONE,
+                  HistoryAction.MARKED_NOT_DONE)
+
+
+def _parse_legacy(row, name, items):
+    """Returns the columns of the event described by the row, or None if
+    it can't be read. The item is the one with the text in the list that
+    was most recently created by the time of the change."""
+    prefix = f"{name} "
+    if not row.description.startswith(prefix):
+        return None
+
+    description = row.description[len(prefix):]
+    for pattern, action in _LEGACY:
+        match = pattern.match(description)
+        if match:
+            break
+    else:
+        return None
+
+    event = {"action": action.value, "item_id": None, "count": None,
+             "detail": None}
+    value = match.group(1)
+    if action in _COUNT_ACTIONS:
+        event["count"] = int(value)
+    elif action in _ITEM_ACTIONS:
+        # Items are created just after the change adding them is.
+        latest = (row.created or datetime.max) + timedelta(minutes=1)
+        candidates = items.get((row.checklist_id, value), [])
+        before = [i for i in candidates
+                  if i.created is None or i.created <= latest]
+        chosen = (before or candidates or [None])[-1]
+        if chosen is None:
+            return None
+        event["item_id"] = chosen.id
+    else:
+        event["detail"] = value
+
+    return event
+
+
+def migrate_history(batch_size=1000):
+    """Convert the entries of the history, archived or not, that have only
+    a description into actions, a batch at a time. Entries that can't be
+    read are left as they are.
+
+    Parameters:
+    -----------
+    * batch_size: The number of entries converted at a time.
+
+    Returns:
+    --------
+    The number of entries converted and the number left as they were.
+    """
+    from checklist_app.models.user import User
+
+    user = User.__table__
+    item = ChecklistItem.__table__
+
+    converted = left = 0
+    for table in (ChecklistHistory.__table__,
+                  ChecklistHistoryArchive.__table__):
+        update = table.update().where(
+            table.c.id == db.bindparam('_id')
+        ).values(action=db.bindparam('action'),
+                 item_id=db.bindparam('item_id'),
+                 count=db.bindparam('count'),
+                 detail=db.bindparam('detail'),
+                 description=None)
+
+        last = 0
+        while True:
+            rows = db.session.query(
+                table.c.id, table.c.description, table.c.created,
+                table.c.checklist_id, table.c.user_id
+            ).filter(
+                table.c.action.is_(None),
+                table.c.description.isnot(None),
+                table.c.id > last
+            ).order_by(table.c.id).limit(batch_size).all()
+            if not rows:
+                break
+            last = rows[-1].id
+
+            names = {id: f"{given_name} {family_name}"
+                     for id, given_name, family_name in db.session.query(
+                         user.c.id, user.c.given_name, user.c.family_name
+                     ).filter(user.c.id.in_({r.user_id for r in rows}))}
+            items = {}
+            for candidate in db.session.query(
+                    item.c.id, item.c.checklist_id, item.c.text,
+                    item.c.created
+            ).filter(
+                item.c.checklist_id.in_({r.checklist_id for r in rows})
+            ).order_by(item.c.id):
+                items.setdefault((candidate.checklist_id, candidate.text),
+                                 []).append(candidate)
+
+            events = []
+            for row in rows:
+                event = None
+                if row.user_id in names:
+                    event = _parse_legacy(row, names[row.user_id], items)
+                if event is None:
+                    left += 1
+                    continue
+                event["_id"] = row.id
+                events.append(event)
+
+            if events:
+                db.session.execute(update, events)
+            db.session.commit()
+            converted += len(events)
+
+    return converted, left
+
+
+# A toggle of an item recorded before actions were, less whether it was
+# marked done or not.
+_TOGGLE = re.compile(r'^(.* marked .*) as (?:not )?done\.$')
+
+
+def _toggle_key(row):
+    """Returns what identifies the user and item of a toggle, or None if
+    the row isn't a toggle."""
+    if row.action in (HistoryAction.DONE, HistoryAction.NOT_DONE):
+        return (row.user_id, row.item_id)
+
+    if row.action is None:
+        match = _TOGGLE.match(row.description or '')
+        if match:
+            return (row.user_id, match.group(1))
+
+    return None
+
+
+def _collapse(rows):
+    """Yield each row with the number of changes it stands for, a run of
+    consecutive toggles of the same item by the same user being collapsed
+    into the last of them."""
+    last, key, changes = None, None, 0
+    for row in rows:
+        row_key = _toggle_key(row)
+
+        if row_key is not None and row_key == key:
+            last, changes = row, changes + 1
+            continue
+
+        if last is not None:
+            yield last, changes
+        last, key, changes = row, row_key, 1
+
+    if last is not None:
+        yield last, changes
+
+
+def archive_history(cutoff, batch_size=1000):
+    """Move the history recorded before the cutoff to the archive, a list
+    at a time, collapsing runs of toggles of an item as it goes.
+
+    Parameters:
+    -----------
+    * cutoff: Entries created before this are archived.
+    * batch_size: The number of entries read and written at a time.
+
+    Returns:
+    --------
+    The number of entries moved, the number of archive entries they made
+    and the number of lists whose history was archived.
+    """
+    history = ChecklistHistory.__table__
+    archive = ChecklistHistoryArchive.__table__
+    old = db.and_(history.c.created < cutoff,
+                  history.c.checklist_id.isnot(None))
+
+    checklist_ids = [id for id, in db.session.query(
+        history.c.checklist_id).filter(old).distinct()]
+
+    moved = archived = 0
+    for checklist_id in checklist_ids:
+        rows = db.session.query(
+            history.c.id, history.c.action, history.c.description,
+            history.c.created, history.c.user_id, history.c.item_id,
+            history.c.count, history.c.detail
+        ).filter(old, history.c.checklist_id == checklist_id) \
+            .order_by(history.c.created, history.c.id).yield_per(batch_size)
+
+        entries = []
+        count = 0
+        for row, changes in _collapse(rows):
+            entry = dict(zip(row.keys(), row))
+            entry.update(checklist_id=checklist_id, changes=changes)
+            entries.append(entry)
+            if len(entries) == batch_size:
+                db.session.execute(archive.insert(), entries)
+                count += len(entries)
+                entries = []
+        if entries:
+            db.session.execute(archive.insert(), entries)
+            count += len(entries)
+
+        moved += db.session.execute(history.delete().where(
+            db.and_(old, history.c.checklist_id == checklist_id))).rowcount
+        # Bump the version as touch() does so that cached pages of the
+        # list and its history aren't served.
+        checklists = Checklist.__table__
+        db.session.execute(checklists.update().where(
+            checklists.c.id == checklist_id
+        ).values(archived_count=checklists.c.archived_count + count,
+                 version=checklists.c.version + 1,
+                 updated=datetime.utcnow()))
+        db.session.commit()
+        archived += count
+
+    return moved, archived, len(checklist_ids)
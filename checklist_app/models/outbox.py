@@ -0,0 +1,62 @@
+# Messages waiting to be sent by the mail worker
+# Copyright 2020. Licensed under MIT
+
+from datetime import datetime
+
+from checklist_app import db
+
+__all__ = (
+    "OutboxMessage",
+    "outbox_depth",
+    "queue_message",
+)
+
+
+class OutboxMessage(db.Model):
+    __table_args__ = (
+        # Messages due to be sent in the order they were queued.
+        db.Index('ix_outbox_message_sent_next_attempt',
+                 'sent', 'next_attempt'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String, nullable=False)
+    sender = db.Column(db.String, nullable=False)
+    recipients = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False,
+                             default=datetime.utcnow)
+    sent = db.Column(db.DateTime, nullable=True)
+    failed = db.Column(db.Boolean, nullable=False, default=False)
+    last_error = db.Column(db.Text, nullable=True)
+    # The worker sending the message and when it claimed it.
+    claimed_by = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+
+    @property
+    def recipient_list(self):
+        return self.recipients.split('\n')
+
+
+def queue_message(subject, recipients, body, sender):
+    """Add a message to the outbox to be sent by the mail worker. The
+    message is added to the session and saved when the caller commits.
+
+    Returns:
+    --------
+    The OutboxMessage queued.
+    """
+    message = OutboxMessage(subject=subject, sender=sender, body=body,
+                            recipients='\n'.join(recipients))
+    db.session.add(message)
+    return message
+
+
+def outbox_depth():
+    """Returns the number of messages waiting to be sent."""
+    return OutboxMessage.query.filter(
+        OutboxMessage.sent.is_(None),
+        OutboxMessage.failed == db.false()
+    ).count()
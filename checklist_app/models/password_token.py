@@ -1,6 +1,9 @@
 from datetime import datetime, timedelta
 from enum import Enum
 from secrets import token_urlsafe
+from time import monotonic
+
+from flask import current_app
 
 from checklist_app import db
 
@@ -9,10 +12,13 @@ __all__ = (
     "TokenExpiredError",
     "TokenInvalidError",
     "TokenPurpose",
+    "purge_expired_tokens",
     "save_token",
     "validate_token",
 )
 
+TOKEN_LIFETIME = timedelta(hours=24)
+
 
 class TokenExpiredError(Exception):
     def __init__(self, *args):
@@ -33,30 +39,63 @@ class TokenPurpose(Enum):
         return self.value
 
 
+def default_expiry():
+    """Returns the expiry for a token issued now."""
+    return datetime.utcnow() + TOKEN_LIFETIME
+
+
 class PasswordToken(db.Model):
-    default_expiry = datetime.utcnow() + timedelta(hours=24)
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String, nullable=False)
+    token = db.Column(db.String, nullable=False, index=True)
     purpose = db.Column(db.String, nullable=False,
                         default=TokenPurpose.PASSWORD_RESET.value)
-    expires = db.Column(db.DateTime, default=default_expiry)
+    expires = db.Column(db.DateTime, default=default_expiry, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
-                        nullable=False)
+                        nullable=False, index=True)
 
     user = db.relationship('User',
                            backref=db.backref('tokens', lazy=True))
 
 
+def _limit_user_tokens(user_id, limit):
+    """Delete the oldest tokens of the user so that no more than limit
+    remain outstanding."""
+    keep = db.session.query(PasswordToken.id) \
+        .filter_by(user_id=user_id) \
+        .order_by(PasswordToken.id.desc()).limit(limit).subquery()
+
+    PasswordToken.query.filter(
+        PasswordToken.user_id == user_id,
+        PasswordToken.id.notin_(db.select([keep.c.id]))
+    ).delete(synchronize_session=False)
+
+
+def _sweep_if_due():
+    """Purge a batch of expired tokens if the sweep interval has passed
+    since the last sweep by this process."""
+    sweeper = current_app.extensions.setdefault('token_sweeper',
+                                                {"last": monotonic()})
+    interval = current_app.config['PASSWORD_TOKEN_SWEEP_INTERVAL']
+    if monotonic() - sweeper["last"] < interval:
+        return
+
+    sweeper["last"] = monotonic()
+    purge_expired_tokens(max_batches=1)
+
+
 def save_token(user_id, token=None, purpose=TokenPurpose.PASSWORD_RESET,
-               expiry=datetime.utcnow()+timedelta(hours=24)):
+               expiry=None, commit=True):
     """Saves a token to the database and returns it. If no token is
     supplied then the token is generated using secrets.token_urlsafe().
+    Only the newest PASSWORD_TOKEN_MAX_PER_USER tokens of a user are kept.
 
     Parameters:
     -----------
     * user_id: The identifier for the user.
     * token: The token value to be verified. If None then generated for you.
-    * expiry: The expiry for the token.
+    * expiry: The expiry for the token. If None then 24 hours from now.
+    * commit: If False the token is added to the session for the caller to
+      commit along with its other changes.
 
     Returns:
     --------
@@ -65,13 +104,58 @@ def save_token(user_id, token=None, purpose=TokenPurpose.PASSWORD_RESET,
     if token is None:
         token = token_urlsafe()
 
+    if expiry is None:
+        expiry = default_expiry()
+
+    # The sweep commits as it goes so is done before the token is added.
+    _sweep_if_due()
+
+    _limit_user_tokens(user_id,
+                       current_app.config['PASSWORD_TOKEN_MAX_PER_USER'] - 1)
+
     pt = PasswordToken(token=token, expires=expiry, user_id=user_id)
     db.session.add(pt)
-    db.session.commit()
+    if commit:
+        db.session.commit()
 
     return token
 
 
+def purge_expired_tokens(batch_size=500, max_batches=None):
+    """Delete the expired tokens in batches, committing after each batch
+    so that the table isn't locked for long.
+
+    Parameters:
+    -----------
+    * batch_size: The number of tokens to delete in each batch.
+    * max_batches: Stop after this many batches. If None then continue
+      until all of the expired tokens are deleted.
+
+    Returns:
+    --------
+    The number of tokens deleted.
+    """
+    now = datetime.utcnow()
+    deleted = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        batch = db.session.query(PasswordToken.id) \
+            .filter(PasswordToken.expires < now) \
+            .limit(batch_size).subquery()
+        count = PasswordToken.query \
+            .filter(PasswordToken.id.in_(db.select([batch.c.id]))) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+
+        deleted += count
+        batches += 1
+        if count < batch_size:
+            break
+
+    return deleted
+
+
 def _get_token(token):
     """Retrive a password token from the database."""
     _token = PasswordToken.query.filter_by(token=token).first()
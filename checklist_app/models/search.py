@@ -0,0 +1,250 @@
+# ------------------------------------------------------------------
+# checklist.models.search
+# Full-text search over the titles and descriptions of checklists and
+# the text of their active items using an SQLite FTS5 table. Triggers
+# keep the table in step with the checklist and checklist_item tables.
+#
+# Each list and each item has one row: items at rowid id * 2 and lists
+# at rowid id * 2 + 1 so that the triggers find them by rowid. The
+# owner of the list is indexed as the token u<id> so that a search is
+# limited to a user's lists by the full-text index itself.
+# ------------------------------------------------------------------
+
+import re
+from collections import namedtuple
+
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event, text
+
+from checklist_app import db
+from checklist_app.models.checklist import ChecklistItem
+
+__all__ = (
+    "SearchResult",
+    "create_search_index",
+    "rebuild_search_index",
+    "search_available",
+    "search_checklists",
+)
+
+SearchResult = namedtuple(
+    "SearchResult",
+    ["checklist_id", "item_id", "list_title", "title", "snippet", "after"]
+)
+
+_MAX_TERMS = 16
+_START, _END = '\x02', '\x03'
+
+_CREATE_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS checklist_search USING fts5(
+    title, body, owner, checklist_id UNINDEXED,
+    tokenize = 'porter unicode61'
+)"""
+
+_INSERT_LIST = """
+INSERT INTO checklist_search (rowid, title, body, owner, checklist_id)
+SELECT {c}.id * 2 + 1, {c}.title, coalesce({c}.description, ''),
+       'u' || {c}.created_id, {c}.id"""
+
+_INSERT_ITEM = """
+INSERT INTO checklist_search (rowid, title, body, owner, checklist_id)
+SELECT {i}.id * 2, '', {i}.text, 'u' || checklist.created_id,
+       {i}.checklist_id"""
+
+_ITEM_OF = """
+FROM checklist WHERE checklist.id = {i}.checklist_id AND {i}.active"""
+
+_NOT_DELETED = "coalesce({c}.is_deleted, 0) = 0"
+
+_TRIGGERS = (
+    f"""
+CREATE TRIGGER IF NOT EXISTS checklist_search_list_insert
+AFTER INSERT ON checklist BEGIN
+    {_INSERT_LIST.format(c='new')} WHERE {_NOT_DELETED.format(c='new')};
+END""",
+    f"""
+CREATE TRIGGER IF NOT EXISTS checklist_search_list_update
+AFTER UPDATE OF title, description, is_deleted ON checklist BEGIN
+    DELETE FROM checklist_search WHERE rowid = old.id * 2 + 1;
+    {_INSERT_LIST.format(c='new')} WHERE {_NOT_DELETED.format(c='new')};
+END""",
+    """
+CREATE TRIGGER IF NOT EXISTS checklist_search_list_delete
+AFTER DELETE ON checklist BEGIN
+    DELETE FROM checklist_search WHERE rowid = old.id * 2 + 1;
+END""",
+    f"""
+CREATE TRIGGER IF NOT EXISTS checklist_search_item_insert
+AFTER INSERT ON checklist_item BEGIN
+    {_INSERT_ITEM.format(i='new')} {_ITEM_OF.format(i='new')};
+END""",
+    f"""
+CREATE TRIGGER IF NOT EXISTS checklist_search_item_update
+AFTER UPDATE OF text, active ON checklist_item BEGIN
+    DELETE FROM checklist_search WHERE rowid = old.id * 2;
+    {_INSERT_ITEM.format(i='new')} {_ITEM_OF.format(i='new')};
+END""",
+    """
+CREATE TRIGGER IF NOT EXISTS checklist_search_item_delete
+AFTER DELETE ON checklist_item BEGIN
+    DELETE FROM checklist_search WHERE rowid = old.id * 2;
+END""",
+)
+
+# Results are ranked with matches in the title counting for more than
+# those in the description or items and the owner not at all.
+_RANK = "bm25(checklist_search, 4.0, 1.0, 0.0)"
+
+_SEARCH = f"""
+SELECT checklist_search.rowid AS rowid,
+       checklist_search.checklist_id AS checklist_id,
+       checklist.title AS list_title,
+       highlight(checklist_search, 0, '{_START}', '{_END}') AS title,
+       snippet(checklist_search, 1, '{_START}', '{_END}', '...', 16)
+           AS snippet,
+       {_RANK} AS score
+FROM checklist_search
+JOIN checklist ON checklist.id = checklist_search.checklist_id
+WHERE checklist_search MATCH :match
+  AND checklist.created_id = :user_id
+  AND {_NOT_DELETED.format(c='checklist')}
+  {{after}}
+ORDER BY score, checklist_search.rowid
+LIMIT :limit"""
+
+_AFTER = f"""AND ({_RANK} > :score
+       OR ({_RANK} = :score AND checklist_search.rowid > :rowid))"""
+
+
+def search_available(bind):
+    """Returns True if the database is SQLite built with FTS5."""
+    if bind.dialect.name != 'sqlite':
+        return False
+
+    return bool(bind.execute(
+        "SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+def _if_available(ddl, target, bind, **kwargs):
+    return search_available(bind)
+
+
+def _create_search(target, bind, **kwargs):
+    if not search_available(bind):
+        return
+
+    bind.execute(_CREATE_TABLE)
+    for trigger in _TRIGGERS:
+        bind.execute(trigger)
+
+
+# The items table is created after the lists so create the search table
+# and the triggers on both along with it.
+event.listen(ChecklistItem.__table__, 'after_create', _create_search)
+event.listen(
+    ChecklistItem.__table__, 'before_drop',
+    DDL("DROP TABLE IF EXISTS checklist_search").execute_if(
+        callable_=_if_available)
+)
+
+
+def rebuild_search_index():
+    """Replace the contents of the search table with the lists and items
+    in the database.
+
+    Returns:
+    --------
+    The number of rows indexed.
+    """
+    db.session.execute("DELETE FROM checklist_search")
+    count = db.session.execute(
+        _INSERT_LIST.format(c='checklist') +
+        f" FROM checklist WHERE {_NOT_DELETED.format(c='checklist')}"
+    ).rowcount
+    count += db.session.execute(
+        _INSERT_ITEM.format(i='checklist_item') +
+        " FROM checklist_item"
+        " JOIN checklist ON checklist.id = checklist_item.checklist_id"
+        " WHERE checklist_item.active"
+    ).rowcount
+    db.session.execute(
+        "INSERT INTO checklist_search (checklist_search) VALUES ('optimize')")
+    db.session.commit()
+    return count
+
+
+def create_search_index():
+    """Create the search table and its triggers in an existing database
+    that doesn't have them and fill it.
+
+    Returns:
+    --------
+    True if the table was created.
+    """
+    engine = db.engine
+    if not search_available(engine) or \
+            'checklist_search' in db.inspect(engine).get_table_names():
+        return False
+
+    _create_search(ChecklistItem.__table__, engine)
+    rebuild_search_index()
+    return True
+
+
+def _match(user_id, terms):
+    # Quote each word so that nothing typed is taken as FTS5 syntax, and
+    # match the last as a prefix so that results come as the user types.
+    phrases = ['"{}"'.format(t.replace('"', '""')) for t in terms]
+    phrases[-1] += '*'
+    return f'owner : "u{user_id}" AND ({" ".join(phrases)})'
+
+
+def _highlight(value):
+    # Escape what the user wrote before marking the matches.
+    html = str(escape(value or ''))
+    return Markup(html.replace(_START, '<mark>').replace(_END, '</mark>'))
+
+
+def search_checklists(user_id, query, after=None, limit=20):
+    """Search the lists of the user and their active items.
+
+    Parameters:
+    -----------
+    * user_id: The id of the user whose lists are searched.
+    * query: The words to search for. Each must match, the last as a
+      prefix.
+    * after: The after value of the last result of the previous page.
+    * limit: The number of results to return.
+
+    Returns:
+    --------
+    A list of SearchResult ordered best match first, and the after value
+    for the next page or None if there are no more results.
+    """
+    terms = re.findall(r'\w+', query or '')[:_MAX_TERMS]
+    if not terms:
+        return [], None
+
+    params = {"match": _match(user_id, terms), "user_id": user_id,
+              "limit": limit + 1}
+    if after is not None:
+        params["score"], params["rowid"] = after
+
+    rows = db.session.execute(
+        text(_SEARCH.format(after=_AFTER if after is not None else '')),
+        params
+    ).fetchall()
+
+    results = [
+        SearchResult(
+            checklist_id=row.checklist_id,
+            item_id=row.rowid // 2 if row.rowid % 2 == 0 else None,
+            list_title=row.list_title,
+            title=_highlight(row.title),
+            snippet=_highlight(row.snippet),
+            after=(row.score, row.rowid)
+        )
+        for row in rows[:limit]
+    ]
+    more = len(rows) > limit
+    return results, results[-1].after if more else None
@@ -1,6 +1,8 @@
 # Classes and functions relating to users
 # Copyright 2019. Licensed under MIT
 
+import string
+import sys
 from datetime import datetime
 from enum import IntEnum
 
@@ -11,6 +13,8 @@ from checklist_app import db
 __all__ = (
     "AccountStatus",
     "User",
+    "count_users",
+    "find_users",
     "get_user",
     "get_user_or_404"
 )
@@ -25,6 +29,17 @@ class AccountStatus(IntEnum):
 
 
 class User(db.Model):
+    __table_args__ = (
+        # The admin's list of users, paged by email, and the searches of
+        # it by the start of an email or a name ignoring case.
+        db.Index('ix_user_email_nocase',
+                 db.collate(db.column('email'), 'NOCASE'), 'id'),
+        db.Index('ix_user_given_name_nocase',
+                 db.collate(db.column('given_name'), 'NOCASE')),
+        db.Index('ix_user_family_name_nocase',
+                 db.collate(db.column('family_name'), 'NOCASE')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String, unique=True, nullable=False)
     password = db.Column(db.String, nullable=False)
@@ -33,6 +48,9 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     deactivated = db.Column(db.Integer, default=AccountStatus.ACTIVE.value)
     created = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped whenever one of the user's checklists changes.
+    lists_version = db.Column(db.Integer, nullable=False, default=0,
+                              server_default='0')
 
     """User object here as a stub for future development."""
     def __init__(self, **kwargs):
@@ -50,6 +68,13 @@ class User(db.Model):
     def account_status(self, value):
         self.deactivated = value.value
 
+    def touch_lists(self):
+        """Bump the version of the user's lists after one changes."""
+        if db.inspect(self).persistent:
+            self.lists_version = User.lists_version + 1
+        else:
+            self.lists_version = (self.lists_version or 0) + 1
+
 
 def get_user(username=None, id=None):
     """
@@ -73,3 +98,95 @@ def get_user_or_404(username=None, id=None):
         abort(404)
 
     return user
+
+
+# SQLite's NOCASE collation only folds the case of ASCII letters.
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _nocase(column):
+    return db.collate(column, 'NOCASE')
+
+
+def _starts_with(column, prefix):
+    """A range on the column matching values that start with the prefix,
+    ignoring the case of ASCII letters as NOCASE does, which unlike LIKE
+    can use a NOCASE index. Other letters must match their case."""
+    prefix = prefix.translate(_ASCII_LOWER)
+    following = _following(prefix)
+    if following is None:
+        return _nocase(column) >= prefix
+    return db.and_(_nocase(column) >= prefix, _nocase(column) < following)
+
+
+def _following(prefix):
+    """Returns the least string after all of those that start with the
+    lowercase prefix in NOCASE order, or None if there is none."""
+    while prefix:
+        last = ord(prefix[-1])
+        if last < sys.maxunicode:
+            following = chr(last + 1)
+            # NOCASE sorts A-Z as a-z so the next after @ is [.
+            if following in string.ascii_uppercase:
+                following = '['
+            return prefix[:-1] + following
+        # Nothing follows the last code point so carry to the one before.
+        prefix = prefix[:-1]
+    return None
+
+
+def _filter_users(query, search=None, is_admin=None, status=None):
+    if search:
+        columns = [User.email]
+        if '@' not in search:
+            columns += [User.given_name, User.family_name]
+        query = query.filter(db.or_(*(_starts_with(c, search)
+                                      for c in columns)))
+    if is_admin is not None:
+        query = query.filter(User.is_admin == is_admin)
+    if status is not None:
+        query = query.filter(User.deactivated == status.value)
+    return query
+
+
+def find_users(search=None, is_admin=None, status=None, after=None,
+               limit=50):
+    """Find a page of users ordered by email.
+
+    Parameters:
+    -----------
+    * search: Only users whose email, given name or family name starts
+      with this, ignoring case.
+    * is_admin: Only administrators if True or only other users if False.
+    * status: Only users with this AccountStatus.
+    * after: The id of the last user of the previous page.
+    * limit: The number of users in a page.
+
+    Returns:
+    --------
+    The users and the id to pass as after for the next page, or None if
+    this is the last page.
+    """
+    query = _filter_users(User.query, search, is_admin, status)
+
+    if after is not None:
+        last = db.session.query(User.email).filter_by(id=after).scalar()
+        if last is not None:
+            # Equivalent to (email, id) > (last, after), written so that
+            # the range on the email can be read from the index.
+            query = query.filter(
+                _nocase(User.email) >= last,
+                db.or_(_nocase(User.email) > last, User.id > after)
+            )
+
+    users = query.order_by(_nocase(User.email), User.id) \
+        .limit(limit + 1).all()
+    more = len(users) > limit
+    users = users[:limit]
+    return users, users[-1].id if more else None
+
+
+def count_users(search=None, is_admin=None, status=None):
+    """Count the users that find_users would find."""
+    return _filter_users(db.session.query(db.func.count(User.id)),
+                         search, is_admin, status).scalar()
@@ -0,0 +1,149 @@
+# ------------------------------------------------------------------
+# checklist.passwords
+# Hashes and checks passwords in a bounded pool of worker processes
+# so that a burst of logins can't tie up the request threads.
+# ------------------------------------------------------------------
+
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import BoundedSemaphore, Lock
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+__all__ = (
+    "HasherBusyError",
+    "PasswordHasher",
+    "check_password",
+    "hash_password",
+    "init_app",
+    "password_needs_rehash",
+)
+
+
+class HasherBusyError(ServiceUnavailable):
+    """Raised when every worker is busy and the queue is full. Returned to
+    the client as a 503 with a Retry-After header."""
+    description = "The server is busy. Please try again in a moment."
+
+
+class PasswordHasher():
+    """Hashes and checks passwords with the method configured.
+
+    Parameters:
+    -----------
+    * method: The werkzeug hash method, including the number of iterations.
+    * salt_length: The length of the salt.
+    * workers: The number of worker processes. If 0 hash in the caller.
+    * max_pending: The most hashes running or waiting at once. Anything
+      more is rejected with a HasherBusyError.
+    * timeout: Seconds to wait for a hash before giving up.
+    * retry_after: Seconds the client is told to wait when rejected.
+    """
+
+    def __init__(self, method, salt_length=16, workers=2, max_pending=8,
+                 timeout=10, retry_after=1):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = BoundedSemaphore(max_pending)
+        self._lock = Lock()
+        self._pool = None
+        self._prefix = None
+
+    def _get_pool(self):
+        # Start the pool on first use so that it is created in the process
+        # serving requests rather than in a parent that forks workers.
+        with self._lock:
+            if self._pool is None:
+                # Spawn the workers rather than fork them so that they don't
+                # inherit the locks, connections and threads of the app.
+                # Python 3.6 can only fork.
+                options = {}
+                if sys.version_info >= (3, 7):
+                    options['mp_context'] = \
+                        multiprocessing.get_context('spawn')
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 **options)
+            return self._pool
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusyError(retry_after=self.retry_after)
+
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HasherBusyError(retry_after=self.retry_after)
+
+    def hash(self, password):
+        """Returns the hash of the password."""
+        return self._run(generate_password_hash, password, self.method,
+                         self.salt_length)
+
+    def check(self, pwhash, password):
+        """Returns True if the password matches the hash."""
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Returns True if the hash wasn't made with the current method."""
+        if self._prefix is None:
+            # werkzeug adds the default iterations to the method when they
+            # aren't given so compare against a hash it has made.
+            self._prefix = generate_password_hash(
+                '', self.method, 1).split('$', 1)[0]
+
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def init_app(app):
+    """Create the password hasher for the app from its configuration."""
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        salt_length=app.config['PASSWORD_HASH_SALT_LENGTH'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+        retry_after=app.config['PASSWORD_HASH_RETRY_AFTER']
+    )
+
+
+def _hasher():
+    return current_app.extensions['password_hasher']
+
+
+def hash_password(password):
+    """Returns the hash of the password using the app's hasher."""
+    return _hasher().hash(password)
+
+
+def check_password(pwhash, password):
+    """Returns True if the password matches the hash."""
+    return _hasher().check(pwhash, password)
+
+
+def password_needs_rehash(pwhash):
+    """Returns True if the hash should be replaced with a new one."""
+    return _hasher().needs_rehash(pwhash)
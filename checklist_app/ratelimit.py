@@ -0,0 +1,261 @@
+# ------------------------------------------------------------------
+# checklist.ratelimit
+# Token bucket limits on the views that hash passwords or send mail,
+# kept per client address and per account so that a burst of
+# attempts is turned away before any of that work is done.
+#
+# Buckets are kept in memory, for a single process, or in an SQLite
+# file shared by every worker on the host.
+# ------------------------------------------------------------------
+
+import functools
+import logging
+import math
+import sqlite3
+from collections import Counter, OrderedDict
+from threading import Lock, local
+from time import time
+
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+__all__ = (
+    "MemoryBackend",
+    "RateLimitedError",
+    "RateLimiter",
+    "SQLiteBackend",
+    "client_address",
+    "init_app",
+    "rate_limit_info",
+    "rate_limited",
+)
+
+log = logging.getLogger(__name__)
+
+# Seconds between prunes of the buckets left alone long enough to be full.
+_PRUNE_INTERVAL = 60
+
+
+class RateLimitedError(TooManyRequests):
+    """Raised when a client has used up its requests. Returned to the
+    client as a 429 with a Retry-After header."""
+    description = "Too many attempts. Please wait a moment and try again."
+
+
+def _take(state, capacity, period, now):
+    """Take a token from the bucket in the state given as its tokens and
+    when they were counted, or a full bucket if None.
+
+    Returns:
+    --------
+    The new state of the bucket and 0 if a token was taken, or otherwise
+    the seconds until one will be.
+    """
+    rate = capacity / period
+    tokens, updated = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + max(0, now - updated) * rate)
+
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class MemoryBackend():
+    """Buckets kept in the process, the least recently used dropped once
+    there are more than max_keys of them."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key, capacity, period, now):
+        with self._lock:
+            state, wait = _take(self._buckets.get(key), capacity, period,
+                                now)
+            self._buckets[key] = state
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def prune(self, before):
+        with self._lock:
+            for key in [k for k, (_, updated) in self._buckets.items()
+                        if updated < before]:
+                del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBackend():
+    """Buckets kept in an SQLite file so that every worker shares them.
+    Each check is one short write transaction on a connection kept by
+    the thread."""
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self._local = local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS rate_limit_bucket '
+                               '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                               'updated REAL NOT NULL)')
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, capacity, period, now):
+        connection = self._connection()
+        # Take the write lock before reading so that two workers can't
+        # both spend the last token.
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            state = connection.execute(
+                'SELECT tokens, updated FROM rate_limit_bucket WHERE key = ?',
+                (key,)).fetchone()
+            state, wait = _take(state, capacity, period, now)
+            connection.execute('INSERT OR REPLACE INTO rate_limit_bucket '
+                               '(key, tokens, updated) VALUES (?, ?, ?)',
+                               (key,) + state)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    def prune(self, before):
+        self._connection().execute(
+            'DELETE FROM rate_limit_bucket WHERE updated < ?', (before,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM rate_limit_bucket')
+
+
+class RateLimiter():
+    """Checks requests against the limits and counts those allowed and
+    rejected.
+
+    Parameters:
+    -----------
+    * backend: The MemoryBackend or SQLiteBackend keeping the buckets.
+    * limits: A dict of the name of each limit to a dict of the scope,
+      ip or account, to the requests allowed and the seconds over which
+      they are allowed. Up to that many may be made at once.
+    """
+
+    def __init__(self, backend, limits):
+        self.backend = backend
+        self.limits = limits
+        self._counts = Counter()
+        self._lock = Lock()
+        self._pruned = time()
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def _prune_if_due(self, now):
+        with self._lock:
+            if now - self._pruned < _PRUNE_INTERVAL:
+                return
+            self._pruned = now
+
+        # A bucket left alone for the longest period is full again so is
+        # no different from one that isn't kept.
+        longest = max(period for scopes in self.limits.values()
+                      for _, period in scopes.values())
+        self.backend.prune(now - longest)
+
+    def check(self, name, ip=None, account=None):
+        """Take a token from each of the buckets of the request, first that
+        of the address then that of the account. Raises a RateLimitedError
+        if either is empty."""
+        now = time()
+        self._prune_if_due(now)
+        for scope, value in (('ip', ip), ('account', account)):
+            limit = self.limits.get(name, {}).get(scope)
+            if not value or not limit:
+                continue
+
+            wait = self.backend.take(f'{name}:{scope}:{value}', *limit, now)
+            if wait:
+                self._count(f'{name}.rejected.{scope}')
+                log.info(f'Rate limited {name} for {scope} {value}.')
+                raise RateLimitedError(retry_after=math.ceil(wait))
+
+        self._count(f'{name}.allowed')
+
+    def info(self):
+        """Returns the number of requests allowed and rejected for each
+        limit, as name.allowed and name.rejected.scope."""
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        """Empty the buckets and reset the counters."""
+        self.backend.clear()
+        with self._lock:
+            self._counts.clear()
+
+
+def init_app(app):
+    """Create the rate limiter for the app from its configuration."""
+    if app.config['RATELIMIT_BACKEND'] == 'sqlite':
+        backend = SQLiteBackend(app.config['RATELIMIT_SQLITE_PATH'])
+    else:
+        backend = MemoryBackend(app.config['RATELIMIT_MEMORY_MAX_KEYS'])
+
+    app.extensions['rate_limiter'] = RateLimiter(
+        backend, app.config['RATELIMIT_LIMITS'])
+
+
+def _limiter():
+    return current_app.extensions['rate_limiter']
+
+
+def rate_limit_info():
+    """Returns the requests allowed and rejected by the app's limiter."""
+    return _limiter().info()
+
+
+def client_address():
+    """Returns the address of the client. Behind RATELIMIT_TRUSTED_PROXIES
+    proxies it is the one the furthest of them added to X-Forwarded-For;
+    anything before that was sent by the client and can't be trusted."""
+    hops = current_app.config['RATELIMIT_TRUSTED_PROXIES']
+    if hops:
+        forwarded = [a.strip() for a in
+                     request.headers.get('X-Forwarded-For', '').split(',')
+                     if a.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+
+    return request.remote_addr or 'unknown'
+
+
+def rate_limited(name):
+    """Limit the POSTs to the view by the address of the client and by the
+    account in the username field of the form, before the view does any
+    work."""
+    def decorator(view):
+        @functools.wraps(view)
+        def check_rate(**kwargs):
+            if request.method == 'POST' and \
+                    current_app.config['RATELIMIT_ENABLED']:
+                account = request.form.get('username', '').strip().lower()
+                _limiter().check(name, client_address(), account)
+
+            return view(**kwargs)
+
+        return check_rate
+
+    return decorator
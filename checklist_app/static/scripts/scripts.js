@@ -1,18 +1,152 @@
-// check that jQuery has loaded and if not load from the local source.
-window.jQuery || document.write('<script src="/static/js/jquery-min.3.4.1.min.js">\x3c</script>');
+// Changes to items are posted in the background and the page patched with
+// the result. If the request fails fall back to the full page version.
+$.ajaxSetup({
+    headers: {"X-CSRFToken": $('meta[name="csrf-token"]').attr("content")}
+});
+
+function historyItem(change) {
+    var text = change.created + " - " + change.description;
+    if (change.changes > 1) {
+        text += " (" + change.changes + " changes)";
+    }
+    return $("<li>").attr("data-id", change.id).text(text);
+}
+
+// The history is shown newest first. A change may come both in the reply
+// to a request and from the live updates so is only added once.
+function addHistory(change) {
+    if ($("#list_history li[data-id='" + change.id + "']").length === 0) {
+        historyItem(change).prependTo("#list_history ol");
+    }
+}
+
+function setProgress(fraction) {
+    var percent = Math.round(fraction * 100);
+    $("#list_progress .percent").text(percent + "%");
+    $("#list_progress .progress").attr("class", "progress w-" + percent);
+}
+
+function renderItem(item) {
+    var links = $("<span>").addClass("edit_item_links").hide()
+        .append($("<a>").addClass("edit-item").attr("href", item.edit_url).text("✏"))
+        .append(" ")
+        .append($("<a>").addClass("delete-item").attr("href", item.delete_url)
+            .attr("data-url", item.delete_json_url).text("❌"));
+
+    return $("<div>").addClass("list_item").attr("id", item.id)
+        .append($("<input>").attr("type", "checkbox").addClass("toggle-item")
+            .val(item.toggle_url).attr("data-url", item.toggle_json_url)
+            .prop("checked", item.done))
+        .append("&nbsp;")
+        .append($("<span>").addClass("item_text").text(item.text))
+        .append("&nbsp;")
+        .append(links);
+}
+
+$(document).on("change", ".toggle-item", function(e) {
+    var checkbox = $(e.target);
+
+    $.post(checkbox.data("url"))
+        .done(function(data) {
+            checkbox.prop("checked", data.item.done);
+            addHistory(data.history);
+            setProgress(data.percent_complete);
+        })
+        .fail(function() {
+            window.location.href = e.target.value;
+        });
+});
+
+$(document).on("click", ".delete-item", function(e) {
+    var link = $(e.currentTarget);
+    e.preventDefault();
+
+    $.post(link.data("url"))
+        .done(function(data) {
+            $(document.getElementById(data.item.id)).addClass("inactive").hide();
+            addHistory(data.history);
+            setProgress(data.percent_complete);
+        })
+        .fail(function() {
+            window.location.href = link.attr("href");
+        });
+});
+
+$("#add_item_form").submit(function(e) {
+    var form = $(e.target);
+    e.preventDefault();
 
-$(".toggle-item").change(function(e) {
-    window.location.href = e.target.value;
+    $.post(form.data("url"), form.serialize())
+        .done(function(data) {
+            renderItem(data.item).insertBefore("#list_items_end");
+            addHistory(data.history);
+            setProgress(data.percent_complete);
+            form.find("#item_text").val("");
+        })
+        .fail(function() {
+            e.target.submit();
+        });
 });
 
+$(document).on("click", "#older_history", function(e) {
+    var link = $(e.currentTarget);
+    e.preventDefault();
+
+    $.getJSON(link.attr("href"))
+        .done(function(data) {
+            data.history.forEach(function(change) {
+                historyItem(change).appendTo("#list_history ol");
+            });
+            if (data.older_url) {
+                link.attr("href", data.older_url);
+            } else {
+                link.remove();
+            }
+        })
+        .fail(function() {
+            window.location.href = link.attr("href");
+        });
+});
+
+// Apply the changes made by anyone else viewing the list as they are made.
+function applyChange(data) {
+    if (data.reload) {
+        window.location.reload();
+        return;
+    }
+
+    if (data.item) {
+        var existing = $(document.getElementById(data.item.id));
+        if (existing.length === 0) {
+            if (data.item.active) {
+                renderItem(data.item).insertBefore("#list_items_end");
+            }
+        } else {
+            existing.find(".toggle-item").prop("checked", data.item.done);
+            if (!data.item.active) {
+                existing.addClass("inactive").hide();
+            }
+        }
+    }
+    addHistory(data.history);
+    setProgress(data.percent_complete);
+}
+
+if (window.EventSource && $("#list_history").data("events-url")) {
+    // The browser reconnects when the stream ends, resuming from the last
+    // change it was sent.
+    new EventSource($("#list_history").data("events-url"))
+        .addEventListener("change", function(e) {
+            applyChange(JSON.parse(e.data));
+        });
+}
+
 $(".inactive").hide();
 $(".edit_item_links").hide();
 
-$(".list_item").hover( 
-    function() {
-        $(this).children(".edit_item_links").fadeIn();
-    },
-    function() {
-        $(this).children(".edit_item_links").hide();
-    }
-);
+$(document).on("mouseenter", ".list_item", function() {
+    $(this).children(".edit_item_links").fadeIn();
+});
+$(document).on("mouseleave", ".list_item", function() {
+    $(this).children(".edit_item_links").hide();
+});
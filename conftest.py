@@ -4,15 +4,19 @@
 import pytest
 from werkzeug.security import generate_password_hash
 
-from checklist_app import create_app, db, init_db, mail, talisman
+from checklist_app import create_app, db, init_db, mail
 from checklist_app.models import AccountStatus, Checklist, User, get_user
 
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     """Define a new instance for the tests."""
     app = create_app({"TESTING": True, "WTF_CSRF_ENABLED": False,
-                      "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+                      "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+                      "ASSETS_FOLDER": str(tmp_path / "assets"),
+                      "PASSWORD_HASH_WORKERS": 0,
+                      "FORCE_HTTPS": False,
+                      "QUERY_REPEAT_LIMIT": 3})
 
     with app.app_context():
         init_db()
@@ -49,8 +53,6 @@ def app():
 
         app.mail = mail
 
-        talisman.force_https = False
-
     yield app
 
 
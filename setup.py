@@ -32,5 +32,6 @@ setup(
     extras_require={
         "test": ["pytest", "coverage"],
         "lint": ["flake8"],
+        "brotli": ["brotli"],
     },
 )
@@ -4,7 +4,8 @@ from secrets import token_urlsafe
 import pytest
 
 from checklist_app.models import (PasswordToken, TokenExpiredError,
-                                  TokenInvalidError, TokenPurpose, save_token,
+                                  TokenInvalidError, TokenPurpose,
+                                  purge_expired_tokens, save_token,
                                   validate_token)
 
 
@@ -39,3 +40,58 @@ def test_invalid(app):
             validate_token(token, user_id=2)
 
         assert not validate_token(None)
+
+
+def test_expiry_computed_per_token(app, monkeypatch):
+    with app.app_context():
+        later = datetime.utcnow() + timedelta(hours=6)
+
+        class _datetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return later
+
+        monkeypatch.setattr("checklist_app.models.password_token.datetime",
+                            _datetime)
+        token = save_token(1)
+        saved = PasswordToken.query.filter_by(token=token).first()
+        assert saved.expires == later + timedelta(hours=24)
+
+
+def test_tokens_limited_per_user(app):
+    app.config['PASSWORD_TOKEN_MAX_PER_USER'] = 2
+    with app.app_context():
+        tokens = [save_token(1) for _ in range(4)]
+        save_token(2)
+
+        saved = PasswordToken.query.filter_by(user_id=1).all()
+        assert sorted(t.token for t in saved) == sorted(tokens[2:])
+        assert PasswordToken.query.filter_by(user_id=2).count() == 1
+
+
+def test_purge_expired_tokens(app):
+    with app.app_context():
+        yesterday = datetime.utcnow() - timedelta(days=1)
+        for user_id in (1, 2, 3):
+            save_token(user_id, expiry=yesterday)
+        valid = save_token(1)
+
+        assert purge_expired_tokens(batch_size=2) == 3
+        assert [t.token for t in PasswordToken.query.all()] == [valid]
+
+
+def test_sweep_on_save(app):
+    app.config['PASSWORD_TOKEN_SWEEP_INTERVAL'] = 0
+    with app.app_context():
+        yesterday = datetime.utcnow() - timedelta(days=1)
+        save_token(2, expiry=yesterday)
+        save_token(1)
+        assert PasswordToken.query.count() == 1
+
+
+def test_purge_tokens_cli(app, runner):
+    with app.app_context():
+        save_token(1, expiry=datetime.utcnow() - timedelta(days=1))
+
+    result = runner.invoke(args=['purge-tokens'])
+    assert 'Deleted 1 expired token(s).' in result.output
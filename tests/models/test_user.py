@@ -1,6 +1,8 @@
 import pytest
 
-from checklist_app.models.user import AccountStatus, get_user, User
+from checklist_app import db
+from checklist_app.models.user import (AccountStatus, find_users, get_user,
+                                       User)
 
 
 def test_get_user(app):
@@ -22,6 +24,25 @@ def test_get_user(app):
             assert 'No username or id' in str(e.value)
 
 
+@pytest.mark.parametrize(("search", "expected"), (
+    # After @ the next character is A, which NOCASE sorts as a.
+    ("bob@", ['bob@x.com']),
+    ("BOB", ['bob@x.com', 'bob[1]@x.com', 'bob_smith@x.com',
+             'bob\U0010ffff@x.com']),
+    ("bob\U0010ffff", ['bob\U0010ffff@x.com']),
+    ("\U0010ffff", []),
+))
+def test_find_users_prefix(app, search, expected):
+    with app.app_context():
+        db.session.add_all(User(email=email, password='x') for email in (
+            'bob@x.com', 'bob_smith@x.com', 'bob[1]@x.com',
+            'bob\U0010ffff@x.com', 'boc@x.com'))
+        db.session.commit()
+
+        users, _ = find_users(search)
+        assert [u.email for u in users] == expected
+
+
 def test_initialize_new_user():
     user = User()
     assert user is not None
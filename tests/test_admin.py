@@ -3,8 +3,11 @@
 #
 # 2020-01-02: Added tests for disabling a user.
 
+import re
+
 import pytest
 
+from checklist_app import db
 from checklist_app.models import AccountStatus, User, get_user
 
 login_test_paths = ['/admin/users', '/admin/users/1', '/admin/users/new']
@@ -71,6 +74,86 @@ def test_list_users(client, auth):
     assert b'<h2>Users</h2>' in response.data
 
 
+def test_list_users_pages(app, client, auth):
+    app.config['ADMIN_USERS_PAGE_SIZE'] = 2
+    auth.login(username="admin@bebleo.url", password="admin")
+
+    emails = []
+    path = '/admin/users'
+    while path:
+        response = client.get(path)
+        emails.extend(re.findall(rb'<td>([^<]+@bebleo.url)</td>',
+                                 response.data))
+        more = re.search(rb'<a href="([^"]+)">Next page', response.data)
+        path = more.group(1).decode().replace('&amp;', '&') if more else None
+
+    assert emails == [b'admin@bebleo.url', b'disabled@bebleo.url',
+                      b'other@bebleo.url', b'test@bebleo.url']
+
+
+@pytest.mark.parametrize(("query", "expected"), (
+    ("q=OTH", [b'other@bebleo.url']),
+    ("q=ja", [b'test@bebleo.url']),
+    ("q=warne", [b'test@bebleo.url']),
+    ("q=bebleo", []),
+    ("admin=1", [b'admin@bebleo.url']),
+    ("admin=0&status=DEACTIVATED", [b'disabled@bebleo.url']),
+))
+def test_list_users_search(app, client, auth, query, expected):
+    with app.app_context():
+        user = User.query.get(2)
+        user.given_name, user.family_name = "James", "Warne"
+        db.session.commit()
+
+    auth.login(username="admin@bebleo.url", password="admin")
+    response = client.get(f'/admin/users?{query}')
+    assert re.findall(rb'<td>([^<]+@bebleo.url)</td>',
+                      response.data) == expected
+
+
+@pytest.mark.parametrize(("query", "expected"), (
+    ("ÉM", [b'test@bebleo.url']),
+    ("éMI", [b'other@bebleo.url']),
+))
+def test_list_users_search_accents(app, client, auth, query, expected):
+    # Only the case of ASCII letters is ignored, as NOCASE does.
+    with app.app_context():
+        User.query.get(2).given_name = "Émile"
+        User.query.get(3).given_name = "émile"
+        db.session.commit()
+
+    auth.login(username="admin@bebleo.url", password="admin")
+    response = client.get('/admin/users', query_string={"q": query})
+    assert re.findall(rb'<td>([^<]+@bebleo.url)</td>',
+                      response.data) == expected
+
+
+def test_list_users_search_last_code_point(client, auth):
+    auth.login(username="admin@bebleo.url", password="admin")
+    response = client.get('/admin/users', query_string={"q": "a\U0010ffff"})
+    assert response.status_code == 200
+
+
+def test_list_users_count(app, client, auth):
+    auth.login(username="admin@bebleo.url", password="admin")
+    assert b'4 users' in client.get('/admin/users').data
+
+    # The count is kept for a while rather than counted every time...
+    with app.app_context():
+        db.session.add(User(email="new@bebleo.url", password="new"))
+        db.session.commit()
+    assert b'4 users' in client.get('/admin/users').data
+    assert b'1 user<' in client.get('/admin/users?admin=1').data
+
+    # ...but is counted again once an admin changes the users.
+    client.post('/admin/users/new', data={"username": "added@bebleo.url",
+                                          "password": "added",
+                                          "confirm": "added"})
+    assert b'6 users' in client.get('/admin/users').data
+
+    assert client.get('/admin/users?status=UNKNOWN').status_code == 400
+
+
 def test_get_edit_user(client, auth):
     auth.login(username="admin@bebleo.url", password="admin")
     response = client.get('/admin/users/1')
@@ -0,0 +1,110 @@
+# Tests for building and serving the bundles in checklist_app.assets
+
+import gzip
+import json
+import os
+
+from checklist_app import create_app
+from checklist_app.assets import (build_assets, minify_css, minify_js,
+                                  source_digests)
+
+
+def test_minify_css():
+    css = """/* comment */
+    a:hover,  p > span {
+        color:   red;
+        margin: 0 auto;
+    }
+    """
+    assert minify_css(css) == 'a:hover,p>span{color:red;margin:0 auto}'
+
+
+def test_minify_js():
+    js = """// comment
+    $(".item").hide();
+
+        var x = 1; // trailing comments are kept
+    """
+    assert minify_js(js) == \
+        '$(".item").hide();\nvar x = 1; // trailing comments are kept'
+
+
+def test_build_assets(app, tmp_path):
+    folder = str(tmp_path / "built")
+    manifest = build_assets(app.static_folder, folder)
+
+    assert sorted(manifest) == ['app.css', 'checklist.js']
+    with open(os.path.join(folder, 'manifest.json')) as f:
+        saved = json.load(f)
+    assert saved['bundles'] == manifest
+    assert saved['sources'] == source_digests(app.static_folder)
+
+    with open(os.path.join(folder, manifest['app.css']), 'rb') as f:
+        css = f.read()
+    # The imported stylesheets are included and the commented one isn't.
+    assert b'@import' not in css
+    assert b'.w-50{' in css
+    assert b'.card' not in css
+
+    with open(os.path.join(folder, manifest['app.css'] + '.gz'), 'rb') as f:
+        assert gzip.decompress(f.read()) == css
+
+    # Building again gives the same names.
+    assert build_assets(app.static_folder, folder) == manifest
+
+
+def test_asset_url(client):
+    response = client.get('/')
+    assert b'/assets/app.' in response.data
+    assert b'static/style.css' not in response.data
+
+
+def test_serve_asset(app, client):
+    with app.test_request_context():
+        from checklist_app.assets import asset_url
+        url = asset_url('checklist.js')
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/javascript'
+    assert 'Content-Encoding' not in response.headers
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+    plain = response.data
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.mimetype == 'application/javascript'
+    assert gzip.decompress(response.data) == plain
+
+
+def test_serve_unknown_asset(client):
+    assert client.get('/assets/manifest.json').status_code == 404
+    assert client.get('/assets/app.css').status_code == 404
+
+
+def test_stale_build_rebuilt(app, tmp_path):
+    folder = str(tmp_path / "assets")
+    manifest = build_assets(app.static_folder, folder)
+
+    # A build left from sources that have since changed, as when the
+    # instance folder survives a deploy, is replaced on first use.
+    path = os.path.join(folder, 'manifest.json')
+    with open(path) as f:
+        saved = json.load(f)
+    saved['bundles']['checklist.js'] = 'checklist.old.js'
+    saved['sources']['checklist.js'] = 'old'
+    with open(path, 'w') as f:
+        json.dump(saved, f)
+
+    app = create_app({"TESTING": True,
+                      "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+                      "ASSETS_FOLDER": folder})
+    with app.test_request_context():
+        from checklist_app.assets import asset_url
+        assert asset_url('checklist.js') == \
+            f"/assets/{manifest['checklist.js']}"
+
+    with open(path) as f:
+        assert json.load(f)['bundles'] == manifest
@@ -1,6 +1,8 @@
 import pytest
 
-from checklist_app.models import get_user, PasswordToken
+from checklist_app.auth import user_cache_info
+from checklist_app.mailer import send_pending
+from checklist_app.models import get_user, outbox_depth, PasswordToken
 
 
 def test_get_send_password_change(client):
@@ -15,17 +17,38 @@ def test_get_send_password_change(client):
         ("admin@bebleo.url", b"Password Sent", 1)
     ]
 )
-def test_post_send_password_change(client, outbox, username, expected,
+def test_post_send_password_change(app, client, outbox, username, expected,
                                    msgcount):
     response = client.post('/auth/forgotpassword', data={"username": username})
     assert expected in response.data
+    assert len(outbox) == 0
+
+    with app.app_context():
+        assert outbox_depth() == msgcount
+        send_pending()
+        assert outbox_depth() == 0
     assert len(outbox) == msgcount
 
 
+def test_send_password_change_commits_once(app, client, monkeypatch):
+    def fail(**kwargs):
+        raise RuntimeError("Outbox unavailable")
+
+    monkeypatch.setattr('checklist_app.auth.queue_message', fail)
+    with pytest.raises(RuntimeError):
+        client.post('/auth/forgotpassword',
+                    data={"username": "test@bebleo.url"})
+
+    # The token isn't kept without the message that sends it.
+    with app.app_context():
+        assert PasswordToken.query.count() == 0
+
+
 def test_forgot_password(app, outbox, client):
     with app.app_context():
         username = 'test@bebleo.url'
         client.post('/auth/forgotpassword', data={"username": username})
+        send_pending()
 
         user = get_user(username)
         reset_token = PasswordToken.query.filter_by(user=user).first()
@@ -150,3 +173,41 @@ def test_post_login_bad_user(client):
 def test_logout(client):
     response = client.get('/auth/logout')
     assert response.status_code == 302
+
+
+def test_logged_in_user_cached(app, client, auth):
+    auth.login()
+    client.get('/')
+    client.get('/')
+
+    with app.app_context():
+        info = user_cache_info()
+        assert info.misses == 1
+        assert info.hits == 1
+        assert info.currsize == 1
+
+
+def test_static_skips_logged_in_user(app, client, auth):
+    auth.login()
+    client.get('/favicon.ico')
+    client.get('/static/style.css')
+
+    with app.app_context():
+        assert user_cache_info().misses == 0
+
+
+def test_edit_user_invalidates_cache(app, client, auth):
+    auth.login(username="admin@bebleo.url", password="admin")
+    client.get('/')
+    response = client.post('/admin/users/1',
+                           data={"username": "admin@bebleo.url",
+                                 "given_name": "Changed",
+                                 "family_name": "Name",
+                                 "is_admin": "checked"})
+    assert b'Success' in response.data
+
+    with app.app_context():
+        assert user_cache_info().currsize == 0
+
+    response = client.get('/admin/users/1')
+    assert b'Changed' in response.data
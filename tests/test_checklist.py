@@ -1,13 +1,23 @@
 # Tests for the checklist module in checklist_app
 # December 2019, see LICENSE for licensing details.
 
+import re
+from datetime import datetime
+from io import BytesIO
+
 import pytest
+from sqlalchemy import event
 
-from checklist_app.models import Checklist, ChecklistItem
+from checklist_app import db
+from checklist_app.models import (Checklist, ChecklistHistory, ChecklistItem,
+                                  HistoryAction, User, describe_history)
 
 login_required = {
-    "get": ['', '/', '/create', '/edit/1', '/1/check/1', '/1/add'],
-    "post": ['/create', '/edit/1', '/1/add']
+    "get": ['', '/', '/create', '/edit/1', '/1/check/1', '/1/add',
+            '/1/add/bulk', '/1/clone', '/1/template', '/search',
+            '/1/events'],
+    "post": ['/create', '/edit/1', '/1/add', '/1/add/bulk',
+             '/1/items/1/toggle', '/1/items/1/delete', '/1/items/add']
 }
 
 
@@ -21,6 +31,241 @@ def test_get_checklists(app, client, auth):
         assert b'0%' in response.data
 
 
+def record_statements(app, client, path, method='get', **kwargs):
+    """Returns the response and the statements executed for the path."""
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record)
+        response = getattr(client, method)(path, **kwargs)
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    return response, statements
+
+
+def test_get_checklists_does_not_load_items(app, client, auth):
+    auth.login()
+    response, statements = record_statements(app, client, '/checklist')
+
+    assert response.status_code == 200
+    assert b'33%' in response.data
+    assert not [s for s in statements if 'checklist_item' in s]
+
+
+def test_view_checklist(app, client, auth):
+    auth.login()
+    client.get('/checklist/1/delete/2')
+    client.get('/checklist')
+    response, statements = record_statements(app, client, '/checklist/1')
+
+    assert response.status_code == 200
+    assert b'class="list_item" id="1"' in response.data
+    assert b'class="list_item" id="2"' not in response.data
+    assert b'deleted Item 1.2.' in response.data
+    # The version of the list, the list, the active items, the latest page
+    # of the history, then the deleted item it names. The user and the
+    # active items are already loaded.
+    assert len(statements) == 5
+    assert 'checklist.version' in statements[0]
+    assert 'checklist_item.active = 1' in statements[2]
+    assert 'ORDER BY checklist_history.created DESC' in statements[3]
+    assert 'checklist_item.id IN (?)' in statements[4]
+
+
+def test_view_checklist_history_page(app, client, auth):
+    app.config['HISTORY_PAGE_SIZE'] = 2
+    auth.login()
+    response = client.get('/checklist/1')
+
+    # Only the newest entries are shown, newest first.
+    assert re.findall(rb'added (Item 1\.\d)', response.data) == \
+        [b'Item 1.3', b'Item 1.2']
+    more = re.search(rb'id="older_history" href="([^"]+)"', response.data)
+    assert more.group(1) == b'/checklist/1/history?before=2'
+
+    response = client.get('/checklist/1/history?before=2',
+                          headers={"Accept": "application/json"})
+    assert [e['description'] for e in response.json['history']] == \
+        ['None None added Item 1.1.']
+    assert response.json['older_url'] is None
+
+    response = client.get('/checklist/1/history?before=3')
+    assert re.findall(rb'added (Item 1\.\d)', response.data) == \
+        [b'Item 1.2', b'Item 1.1']
+
+
+def test_history_page_same_time(app):
+    with app.app_context():
+        # Entries made in the same instant are ordered by id.
+        ChecklistHistory.query.update(
+            {ChecklistHistory.created: datetime(2020, 1, 1)})
+        db.session.commit()
+        checklist = Checklist.query.get(1)
+
+        entries, before = checklist.history_page(limit=2)
+        assert [e.id for e in entries] == [3, 2]
+        entries, before = checklist.history_page(before, limit=2)
+        assert [e.id for e in entries] == [1]
+        assert before is None
+        assert checklist.history_page(99) == ([], None)
+
+
+def test_history_events(app):
+    with app.app_context():
+        user = User.query.get(2)
+        item = ChecklistItem.query.get(1)
+        item.toggle(user)
+        db.session.commit()
+
+        change = ChecklistHistory.query.filter_by(
+            item_id=1, action=HistoryAction.DONE).one()
+        assert (change.user_id, change.description) == (2, None)
+        assert describe_history([change]) == \
+            ['None None marked Item 1.1 as done.']
+
+        # The description is made when shown so follows the item's text.
+        item.text = 'Renamed'
+        db.session.commit()
+        assert describe_history([change]) == \
+            ['None None marked Renamed as done.']
+
+
+def test_archive_history(app, runner):
+    with app.app_context():
+        checklist = Checklist.query.get(1)
+        user = User.query.get(2)
+        item = ChecklistItem.query.get(1)
+        for _ in range(3):
+            item.toggle(user)
+        checklist.items[1].toggle(user)
+        db.session.commit()
+        ChecklistHistory.query.update(
+            {ChecklistHistory.created: datetime(2020, 1, 1)})
+        db.session.commit()
+        version, updated = checklist.version, checklist.updated
+
+    result = runner.invoke(args=['archive-history', '--days', '30'])
+    assert 'Archived 7 history entries of 1 list(s) as 5.' in result.output
+
+    with app.app_context():
+        checklist = Checklist.query.get(1)
+        assert checklist.archived_count == 5
+        assert checklist.version == version + 1
+        assert checklist.updated > updated
+        assert ChecklistHistory.query.count() == 0
+        entries, _ = checklist.history_page(archived=True, limit=10)
+        # The three toggles of Item 1.1 are collapsed into the last.
+        assert list(zip(describe_history(entries),
+                        [e.changes for e in entries])) == [
+            ('None None marked Item 1.2 as done.', 1),
+            ('None None marked Item 1.1 as done.', 3),
+            ('None None added Item 1.3.', 1),
+            ('None None added Item 1.2.', 1),
+            ('None None added Item 1.1.', 1),
+        ]
+
+    # Nothing is left to archive.
+    result = runner.invoke(args=['archive-history', '--days', '30'])
+    assert 'Archived 0 history entries of 0 list(s) as 0.' in result.output
+
+
+def test_view_archived_history(app, client, auth, runner):
+    app.config['HISTORY_PAGE_SIZE'] = 2
+    with app.app_context():
+        db.session.execute('UPDATE checklist_history SET created = :created '
+                           'WHERE id < 3', {"created": datetime(2020, 1, 1)})
+        db.session.commit()
+    runner.invoke(args=['archive-history'])
+
+    auth.login()
+    response = client.get('/checklist/1')
+    assert re.findall(rb'added (Item 1\.\d)', response.data) == [b'Item 1.3']
+    more = re.search(rb'id="older_history" href="([^"]+)"', response.data)
+    assert more.group(1) == b'/checklist/1/history?archived=1'
+
+    response = client.get('/checklist/1/history?archived=1',
+                          headers={"Accept": "application/json"})
+    assert [e['description'] for e in response.json['history']] == \
+        ['None None added Item 1.2.', 'None None added Item 1.1.']
+    assert response.json['older_url'] is None
+
+
+@pytest.mark.parametrize("path", ['/edit/1', '/delete/1'])
+def test_header_only(app, client, auth, path):
+    auth.login()
+    client.get('/checklist')
+    response, statements = record_statements(app, client, '/checklist' + path)
+
+    assert response.status_code in (200, 302)
+    assert not [s for s in statements
+                if 'checklist_item' in s or 'checklist_history' in s]
+
+
+def test_get_checklists_not_modified(app, client, auth):
+    auth.login()
+    response = client.get('/checklist')
+    etag = response.headers['ETag']
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    response, statements = record_statements(
+        app, client, '/checklist', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert len(statements) == 1
+
+    # Changing any of the user's lists changes the index.
+    client.get('/checklist/1/check/1')
+    response = client.get('/checklist', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_view_checklist_not_modified(app, client, auth):
+    auth.login()
+    response = client.get('/checklist/1')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+    response, statements = record_statements(
+        app, client, '/checklist/1', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert not response.data
+    assert len(statements) == 1
+
+    # The page is sent again after a change to an item or the header.
+    client.get('/checklist/1/check/1')
+    response = client.get('/checklist/1', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    client.post('/checklist/edit/1', data={"list_title": "Edited"})
+    response = client.get('/checklist/1', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b'Edited' in response.data
+
+
+def test_view_checklist_not_modified_other_user(client, auth):
+    auth.login(username="admin@bebleo.url", password="admin")
+    etag = client.get('/checklist/1').headers['ETag']
+
+    auth.login()
+    response = client.get('/checklist/1', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_view_checklist_flashed_message(client, auth):
+    auth.login()
+    etag = client.get('/checklist/1').headers['ETag']
+
+    response = client.get('/checklist/delete/1')
+    response = client.get('/checklist/1', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b'confirm_delete' in response.data
+
+
 def test_add_checklist(app, client, auth):
     checklist = {
         "list_title": "List no. 3",
@@ -74,6 +319,30 @@ def test_mark_item_done(app, client, auth):
 
         item = ChecklistItem.query.get(1)
         assert item.done
+        assert item.checklist.done_count == 2
+        assert item.checklist.active_count == 3
+
+
+def test_counts_not_lost(app):
+    with app.app_context():
+        user = User.query.get(2)
+        item = ChecklistItem.query.get(1)
+        assert item.checklist.done_count == 1
+
+        # Another session ticks an item after this one read the list...
+        with db.engine.begin() as connection:
+            connection.execute(
+                'UPDATE checklist_item SET done = 1 WHERE id = 2')
+            connection.execute(
+                'UPDATE checklist SET done_count = done_count + 1 '
+                'WHERE id = 1')
+
+        # ...which isn't overwritten by this one ticking another.
+        item.toggle(user)
+        item.checklist.add_item("New item", user)
+        db.session.commit()
+        assert (item.checklist.done_count, item.checklist.active_count) == \
+            (3, 4)
 
 
 def test_unmark_item_done(app, client, auth):
@@ -98,6 +367,268 @@ def test_delete_item(app, client, auth):
         assert checklist.percent_complete == 0.5
 
 
+def test_toggle_item_json(app, client, auth):
+    with app.app_context():
+        auth.login()
+        response = client.post('/checklist/1/items/1/toggle')
+        assert response.status_code == 200
+        assert response.json['item']['id'] == 1
+        assert response.json['item']['done']
+        assert 'marked Item 1.1 as done.' in \
+            response.json['history']['description']
+        assert response.json['percent_complete'] == 2 / 3
+
+        assert ChecklistItem.query.get(1).done
+
+
+def test_toggle_item_json_wrong_list(app, client, auth):
+    with app.app_context():
+        auth.login()
+        response = client.post('/checklist/2/items/1/toggle')
+        assert response.status_code == 404
+        assert not ChecklistItem.query.get(1).done
+
+
+def test_delete_item_json(app, client, auth):
+    with app.app_context():
+        auth.login()
+        response = client.post('/checklist/1/items/1/delete')
+        assert response.status_code == 200
+        assert not response.json['item']['active']
+        assert 'deleted Item 1.1.' in response.json['history']['description']
+        assert response.json['percent_complete'] == 0.5
+
+
+def test_add_item_json(app, client, auth):
+    with app.app_context():
+        auth.login()
+        response = client.post('/checklist/1/items/add',
+                               data={"item_text": "Added item"})
+        assert response.status_code == 201
+        assert response.json['item']['text'] == 'Added item'
+        item = response.json['item']
+        assert '/checklist/1/items/' in item['toggle_json_url']
+        assert 'added Added item.' in response.json['history']['description']
+
+        response = client.post('/checklist/1/items/add',
+                               data={"item_text": ""})
+        assert response.status_code == 400
+        assert 'Text for item required.' in \
+            response.json['errors']['item_text']
+
+
+def test_add_items_bulk(app, client, auth):
+    auth.login()
+    text = "\n".join(f"Step {n}" for n in range(400)) + "\n\n"
+    response, statements = record_statements(
+        app, client, '/checklist/1/add/bulk', method='post',
+        data={"items_text": text})
+    assert response.status_code == 302
+    assert '/checklist/1' in response.headers['Location']
+
+    # 400 items take three INSERTs of up to 150 rows.
+    inserts = [s for s in statements
+               if s.startswith('INSERT INTO checklist_item')]
+    assert len(inserts) == 3
+
+    with app.app_context():
+        checklist = Checklist.query.get(1)
+        assert checklist.active_count == 403
+        assert checklist.done_count == 1
+        assert [i.text for i in checklist.active_items][3:5] == \
+            ['Step 0', 'Step 1']
+        assert 'added 400 items.' in describe_history(checklist.history)[-1]
+        assert len(checklist.history) == 4
+
+
+@pytest.mark.parametrize(("upload", "filename", "data", "expected"), (
+    # The header names the column of the text.
+    (b'notes,Text\r\nx,"First, with a comma"\r\n,Second\r\n', 'items.csv',
+     {"has_header": "y"}, ['First, with a comma', 'Second']),
+    (b'Heading\r\nFirst\r\n', 'items.csv', {"has_header": "y"},
+     ['First']),
+    # The first row is only a header if it is said to be, whatever it is.
+    (b'Task\r\nFirst\r\n', 'items.csv', {}, ['Task', 'First']),
+    # Text files are read a line at a time, commas and all.
+    (b'Task\nBuy milk, eggs and bread\r\nCall Bob, then Alice\n',
+     'runbook.txt', {"has_header": "y"},
+     ['Task', 'Buy milk, eggs and bread', 'Call Bob, then Alice']),
+))
+def test_add_items_bulk_file(app, client, auth, upload, filename, data,
+                             expected):
+    auth.login()
+    data["items_file"] = (BytesIO(upload), filename)
+    response = client.post('/checklist/1/add/bulk', data=data,
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+
+    with app.app_context():
+        texts = [i.text for i in Checklist.query.get(1).active_items]
+        assert texts[3:] == expected
+
+
+def test_add_items_bulk_csv_line_numbers(app, client, auth):
+    auth.login()
+    upload = BytesIO(b'text\r\nFine\r\n' + b'x' * 1001 + b'\r\n')
+    response = client.post('/checklist/1/add/bulk',
+                           data={"items_file": (upload, 'items.csv'),
+                                 "has_header": "y"},
+                           content_type='multipart/form-data')
+    assert b'Item on line 3 is longer than 1000 characters.' in \
+        response.data
+
+
+@pytest.mark.parametrize(("data", "message"), (
+    ({"items_text": "\n \n"}, b'Enter or upload at least one item.'),
+    ({"items_text": "Fine\n" + "x" * 1001},
+     b'Item on line 2 is longer than 1000 characters.'),
+    ({"items_text": "One\nTwo\nThree"},
+     b'No more than 2 items can be added at once.'),
+    ({"items_file": (BytesIO(b'\xff\xfe'), 'items.csv')},
+     b"The file couldn't be read as UTF-8 CSV."),
+    ({"items_file": (BytesIO(b'Item'), 'items.exe')},
+     b'Upload a .csv or .txt file.'),
+))
+def test_add_items_bulk_invalid(app, client, auth, data, message):
+    app.config['BULK_ADD_MAX_ITEMS'] = 2
+    auth.login()
+    response = client.post('/checklist/1/add/bulk', data=data,
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert message in response.data
+
+    with app.app_context():
+        assert Checklist.query.get(1).active_count == 3
+
+
+def test_clone_checklist(app, client, auth):
+    auth.login()
+    client.get('/checklist/1/delete/2')
+    response, statements = record_statements(app, client, '/checklist/1/clone')
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/checklist/3')
+
+    # The items are copied without being read.
+    assert not [s for s in statements if s.startswith('SELECT checklist_item')]
+
+    with app.app_context():
+        copy = Checklist.query.get(3)
+        assert copy.title == 'List'
+        assert not copy.is_template
+        assert [(i.text, i.done) for i in copy.items] == \
+            [('Item 1.1', False), ('Item 1.3', False)]
+        assert (copy.active_count, copy.done_count) == (2, 0)
+        assert len(copy.history) == 1
+        assert 'created this list from the list List.' in \
+            describe_history(copy.history)[0]
+
+        # The original is left as it was.
+        assert Checklist.query.get(1).done_count == 1
+
+
+def test_clone_keep_done(app):
+    with app.app_context():
+        user = User.query.get(1)
+        copy = Checklist.query.get(1).clone(user, title="Copy",
+                                            reset_done=False)
+        db.session.commit()
+
+        assert copy.title == "Copy"
+        assert [i.done for i in copy.items] == [False, False, True]
+        assert copy.percent_complete == 1 / 3
+
+
+def test_templates(app, client, auth):
+    auth.login()
+    response = client.get('/checklist/1/template')
+    assert response.headers['Location'].endswith('/checklist/3')
+
+    response = client.get('/checklist/')
+    assert b'Templates' in response.data
+    assert b'/checklist/3/clone' in response.data
+
+    response = client.get('/checklist/3')
+    assert b'Create list from template' in response.data
+
+    response = client.get('/checklist/3/clone')
+    assert response.headers['Location'].endswith('/checklist/4')
+
+    with app.app_context():
+        assert Checklist.query.get(3).is_template
+        checklist = Checklist.query.get(4)
+        assert not checklist.is_template
+        assert checklist.active_count == 3
+        assert 'from the template List.' in \
+            describe_history(checklist.history)[0]
+
+
+def test_search(app, client, auth):
+    auth.login()
+    response = client.get('/checklist/search?q=item')
+    assert response.status_code == 200
+    assert b'<mark>Item</mark> 1.1' in response.data
+    assert b'<mark>Item</mark> 1.3' in response.data
+
+    # Words are matched by prefix and stem and every one must match.
+    response = client.get('/checklist/search?q=testing+lis')
+    assert b'<mark>List</mark>' in response.data
+    assert b'created for <mark>testing</mark> purposes' in response.data
+    assert b'Empty List' not in response.data
+
+    # Nothing typed is taken as search syntax.
+    response = client.get('/checklist/search?q="OR+NEAR(')
+    assert response.status_code == 200
+
+    # Only the lists of the user are searched.
+    auth.logout()
+    auth.login("other@bebleo.url", "other")
+    response = client.get('/checklist/search?q=item')
+    assert b'Item 1.1' not in response.data
+
+
+def test_search_follows_changes(app, client, auth):
+    auth.login()
+    client.post('/checklist/1/add', data={"item_text": "Restart <servers>"})
+    client.get('/checklist/1/delete/1')
+    client.post('/checklist/edit/2', data={"list_title": "Deploy runbook",
+                                           "list_description": ""})
+
+    response = client.get('/checklist/search?q=serv')
+    assert b'Restart &lt;<mark>servers</mark>&gt;' in response.data
+
+    response = client.get('/checklist/search?q=item')
+    assert b'Item 1.1' not in response.data
+
+    response = client.get('/checklist/search?q=deploy')
+    assert b'<mark>Deploy</mark> runbook' in response.data
+    assert client.get('/checklist/search?q=empty').data.count(b'<li>') == 0
+
+    client.post('/checklist/delete/2', data={"confirm_delete": "1"})
+    response = client.get('/checklist/search?q=deploy')
+    assert b'Deploy runbook' not in response.data
+
+
+def test_search_pages(app, client, auth):
+    app.config['SEARCH_PAGE_SIZE'] = 2
+    with app.app_context():
+        user = User.query.get(2)
+        Checklist.query.get(1).add_items(
+            [f"Step {n}" for n in range(5)], user)
+        db.session.commit()
+
+    auth.login()
+    seen = []
+    path = '/checklist/search?q=step'
+    while path:
+        response = client.get(path)
+        seen.extend(re.findall(rb'<mark>Step</mark> (\d)', response.data))
+        more = re.search(rb'<a href="([^"]+)">More results', response.data)
+        path = more.group(1).decode().replace('&amp;', '&') if more else None
+
+    assert sorted(seen) == [b'0', b'1', b'2', b'3', b'4']
+    assert client.get('/checklist/search?q=x&after=bad').status_code == 400
+
+
 def test_mark_all_items_done(app, client, auth):
     with app.app_context():
         auth.login()
@@ -109,6 +640,60 @@ def test_mark_all_items_done(app, client, auth):
             assert item.done
 
 
+def test_mark_all_items_done_history(app, client, auth):
+    with app.app_context():
+        auth.login()
+        history = len(Checklist.query.get(1).history)
+        client.get('/checklist/1/check/all')
+
+        checklist = Checklist.query.get(1)
+        assert checklist.done_count == 3
+        assert len(checklist.history) == history + 1
+        assert 'marked 2 items as done.' in \
+            describe_history(checklist.history)[-1]
+
+
+def test_mark_all_items_not_done(app, client, auth):
+    with app.app_context():
+        auth.login()
+        response = client.get('/checklist/1/uncheck/all')
+        assert response.status_code == 302
+        assert '/checklist/1' in response.headers['Location']
+
+        checklist = Checklist.query.get(1)
+        assert checklist.done_count == 0
+        assert not [i for i in checklist.items if i.done]
+
+
+def test_mark_items_json(app, client, auth):
+    with app.app_context():
+        auth.login()
+        client.get('/checklist/1/delete/2')
+        response = client.post('/checklist/1/items/mark',
+                               data={"item_id": [1, 2, 3]})
+        assert response.json['count'] == 1
+        assert response.json['percent_complete'] == 1
+
+        assert ChecklistItem.query.get(1).done
+        assert not ChecklistItem.query.get(2).done
+
+        response = client.post('/checklist/1/items/mark',
+                               data={"item_id": [3], "done": "0"})
+        assert response.json['count'] == 1
+        assert not ChecklistItem.query.get(3).done
+
+
+def test_mark_items_pending(app):
+    with app.app_context():
+        user = User.query.get(2)
+        checklist = Checklist.query.get(1)
+        item = checklist.add_item("Pending item", user)
+
+        assert checklist.mark_items(True, user) == 3
+        assert item.done
+        assert checklist.percent_complete == 1
+
+
 def test_delete_checklist(app, client, auth):
     with app.app_context():
         auth.login()
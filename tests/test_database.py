@@ -0,0 +1,183 @@
+# Tests the SQLite settings and replica routing in checklist_app.database
+
+import sqlite3
+
+import pytest
+from sqlalchemy.pool import QueuePool
+from werkzeug.security import generate_password_hash
+
+from checklist_app import create_app, db, init_db
+from checklist_app.models import Checklist, User
+
+
+@pytest.fixture
+def file_app(tmp_path):
+    """An app using a SQLite file rather than an in-memory database."""
+    app = create_app({"TESTING": True,
+                      "SQLALCHEMY_DATABASE_URI":
+                          f"sqlite:///{tmp_path / 'checklist.sqlite3'}",
+                      "ASSETS_FOLDER": str(tmp_path / "assets"),
+                      "PASSWORD_HASH_WORKERS": 0})
+
+    with app.app_context():
+        init_db()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def _connect(app):
+    """Returns a DBAPI connection from the pool that begins transactions
+    only when told to."""
+    connection = db.engine.raw_connection()
+    connection.connection.isolation_level = None
+    return connection
+
+
+def test_pragmas_applied(file_app):
+    runner = file_app.test_cli_runner()
+    result = runner.invoke(args=['db-pragmas'])
+
+    assert 'journal_mode = wal' in result.output
+    assert 'synchronous = 1' in result.output
+    assert 'busy_timeout = 5000' in result.output
+    assert 'foreign_keys = 1' in result.output
+
+    with file_app.app_context():
+        assert isinstance(db.engine.pool, QueuePool)
+
+
+def test_pragmas_from_config(tmp_path):
+    app = create_app({"TESTING": True,
+                      "SQLALCHEMY_DATABASE_URI":
+                          f"sqlite:///{tmp_path / 'checklist.sqlite3'}",
+                      "SQLITE_PRAGMAS": {"journal_mode": "DELETE",
+                                         "busy_timeout": 100}})
+
+    result = app.test_cli_runner().invoke(args=['db-pragmas'])
+    assert result.output == 'journal_mode = delete\nbusy_timeout = 100\n'
+
+    with app.app_context():
+        db.engine.dispose()
+
+
+def test_readers_proceed_during_writes(file_app):
+    with file_app.app_context():
+        reader = _connect(file_app)
+        writer = _connect(file_app)
+        try:
+            # A reader in the middle of a transaction...
+            reader.execute('BEGIN')
+            assert reader.execute(
+                'SELECT count(*) FROM user').fetchone()[0] == 1
+
+            # ...doesn't stop a writer from committing, which without WAL
+            # would wait out the busy timeout and fail as locked.
+            writer.execute('BEGIN IMMEDIATE')
+            writer.execute("INSERT INTO user (email, password, is_admin, "
+                           "deactivated, created, lists_version) VALUES "
+                           "('new@bebleo.url', '', 0, 0, "
+                           "CURRENT_TIMESTAMP, 0)")
+
+            # Nor does the write in progress stop the reader, which sees
+            # the database as it was when its transaction began.
+            assert reader.execute(
+                'SELECT count(*) FROM user').fetchone()[0] == 1
+            writer.execute('COMMIT')
+            assert reader.execute(
+                'SELECT count(*) FROM user').fetchone()[0] == 1
+
+            reader.execute('COMMIT')
+            assert reader.execute(
+                'SELECT count(*) FROM user').fetchone()[0] == 2
+        finally:
+            reader.close()
+            writer.close()
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    """An app with a primary and a replica that is only brought up to date
+    by copy_to_replica."""
+    app = create_app({"TESTING": True, "WTF_CSRF_ENABLED": False,
+                      "SQLALCHEMY_DATABASE_URI":
+                          f"sqlite:///{tmp_path / 'primary.sqlite3'}",
+                      "SQLALCHEMY_REPLICA_URI":
+                          f"sqlite:///{tmp_path / 'replica.sqlite3'}",
+                      "ASSETS_FOLDER": str(tmp_path / "assets"),
+                      "PASSWORD_HASH_WORKERS": 0,
+                      "FORCE_HTTPS": False})
+    app.primary = str(tmp_path / 'primary.sqlite3')
+    app.replica = str(tmp_path / 'replica.sqlite3')
+
+    with app.app_context():
+        init_db()
+        user = User(email="test@bebleo.url",
+                    password=generate_password_hash("test"))
+        db.session.add(Checklist(title="Primary", created_by=user))
+        db.session.commit()
+
+    copy_to_replica(app)
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.get_engine(app).dispose()
+        db.get_engine(app, bind='__replica__').dispose()
+
+
+def copy_to_replica(app, title=None):
+    """Copy the primary to the replica, optionally changing the title of
+    the replica's list so that the tests can tell which was read."""
+    with app.app_context():
+        db.get_engine(app, bind='__replica__').dispose()
+
+    source = sqlite3.connect(app.primary)
+    target = sqlite3.connect(app.replica)
+    try:
+        source.backup(target)
+        if title:
+            target.execute('UPDATE checklist SET title = ?', (title,))
+            target.commit()
+    finally:
+        source.close()
+        target.close()
+
+
+def login(client):
+    client.post('/auth/login', data={"username": "test@bebleo.url",
+                                     "password": "test"})
+    # Forget any write made while logging in.
+    with client.session_transaction() as session:
+        session.pop('_primary_until', None)
+
+
+def test_reads_from_replica(replica_app):
+    client = replica_app.test_client()
+    login(client)
+    copy_to_replica(replica_app, title="Replica")
+
+    assert b'Replica' in client.get('/checklist/').data
+    assert b'Replica' in client.get('/checklist/1').data
+
+    # Views that aren't marked read from the primary.
+    assert b'Primary' in client.get('/checklist/edit/1').data
+
+
+def test_primary_after_write(replica_app):
+    client = replica_app.test_client()
+    login(client)
+    copy_to_replica(replica_app, title="Replica")
+
+    client.post('/checklist/1/add', data={"item_text": "New item"})
+    response = client.get('/checklist/1')
+    assert b'Primary' in response.data
+    assert b'New item' in response.data
+
+    # Once the user has been away long enough they read from the replica.
+    with client.session_transaction() as session:
+        session['_primary_until'] = 0
+    assert b'Replica' in client.get('/checklist/1').data
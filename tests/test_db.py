@@ -10,3 +10,170 @@ def test_init_db_cli(runner, monkeypatch):
     result = runner.invoke(args=['init-db'])
     assert 'Initialized' in result.output
     assert Recorder.called
+
+
+def test_recount_items_cli(app, runner):
+    from checklist_app import db
+    from checklist_app.models import Checklist
+
+    with app.app_context():
+        checklist = Checklist.query.get(1)
+        checklist.active_count = 0
+        checklist.done_count = 0
+        db.session.commit()
+
+    result = runner.invoke(args=['recount-items'])
+    assert 'Recounted items for 2 checklist(s).' in result.output
+
+    with app.app_context():
+        checklist = Checklist.query.get(1)
+        assert checklist.active_count == 3
+        assert checklist.done_count == 1
+
+
+def test_db_indexes_cli(app, runner):
+    from checklist_app import db
+
+    with app.app_context():
+        db.session.execute('DROP INDEX ix_password_token_token')
+        db.session.execute('DROP INDEX ix_checklist_item_checklist_id_active')
+        db.session.commit()
+
+    result = runner.invoke(args=['db-indexes'])
+    assert 'Created index ix_checklist_item_checklist_id_active.' \
+        in result.output
+    assert 'Created index ix_password_token_token.' in result.output
+    assert 'Created 2 missing index(es).' in result.output
+
+    result = runner.invoke(args=['db-indexes'])
+    assert 'Created 0 missing index(es).' in result.output
+
+    with app.app_context():
+        assert db.session.execute('SELECT count(*) FROM checklist').scalar()
+
+
+def test_upgrade_db_cli(app, runner):
+    from checklist_app import db
+
+    with app.app_context():
+        db.session.execute('DROP TABLE outbox_message')
+        db.session.execute('DROP INDEX ix_password_token_token')
+        # An index replaced by ix_checklist_history_checklist_id_created_id.
+        db.session.execute('CREATE INDEX '
+                           'ix_checklist_history_checklist_id_created ON '
+                           'checklist_history (checklist_id, created)')
+        # SQLite can't drop a column so rebuild the table without one, with
+        # the foreign keys off as SQLite's instructions for that say.
+        db.session.execute('PRAGMA foreign_keys = OFF')
+        db.session.execute('ALTER TABLE user RENAME TO old_user')
+        db.session.execute('CREATE TABLE user AS SELECT id, email, password, '
+                           'given_name, family_name, is_admin, deactivated, '
+                           'created FROM old_user')
+        db.session.execute('DROP TABLE old_user')
+        db.session.commit()
+
+    result = runner.invoke(args=['upgrade-db'])
+    assert 'Added table outbox_message.' in result.output
+    assert 'Added column user.lists_version.' in result.output
+    assert 'Added index ix_password_token_token.' in result.output
+    assert 'Dropped index ix_checklist_history_checklist_id_created.' in \
+        result.output
+    assert 'Upgraded database.' in result.output
+
+    with app.app_context():
+        assert db.session.execute(
+            'SELECT lists_version FROM user WHERE id = 1').scalar() == 0
+        indexes = db.inspect(db.engine).get_indexes('checklist_history')
+        assert 'ix_checklist_history_checklist_id_created' not in \
+            [i['name'] for i in indexes]
+
+    result = runner.invoke(args=['upgrade-db'])
+    assert result.output == 'Upgraded database.\n'
+
+
+def test_rebuild_search_cli(app, runner):
+    from checklist_app import db
+    from checklist_app.models import search_checklists
+
+    with app.app_context():
+        db.session.execute('DELETE FROM checklist_search')
+        db.session.commit()
+        assert search_checklists(2, 'item') == ([], None)
+
+    result = runner.invoke(args=['rebuild-search'])
+    assert 'Indexed 5 list(s) and item(s).' in result.output
+
+    with app.app_context():
+        results, _ = search_checklists(2, 'item')
+        assert len(results) == 4
+
+
+def test_upgrade_db_adds_search(app, runner):
+    from checklist_app import db
+    from checklist_app.models import search_checklists
+
+    with app.app_context():
+        db.session.execute('DROP TABLE checklist_search')
+        db.session.execute('DROP TRIGGER checklist_search_item_insert')
+        db.session.commit()
+
+    result = runner.invoke(args=['upgrade-db'])
+    assert 'Added table checklist_search.' in result.output
+
+    with app.app_context():
+        results, _ = search_checklists(2, 'list')
+        assert [r.checklist_id for r in results] == [1, 2]
+        db.session.execute("INSERT INTO checklist_item (text, done, active, "
+                           "checklist_id, created) VALUES ('New item', 0, 1, "
+                           "2, CURRENT_TIMESTAMP)")
+        results, _ = search_checklists(2, 'new')
+        assert len(results) == 1
+
+
+def test_migrate_history_cli(app, runner):
+    from checklist_app import db
+    from checklist_app.models import ChecklistHistory, describe_history
+
+    with app.app_context():
+        before = describe_history(ChecklistHistory.query.order_by(
+            ChecklistHistory.id))
+
+        # Put the history back as it was stored before actions were.
+        db.session.execute('PRAGMA foreign_keys = OFF')
+        db.session.execute('DROP INDEX ix_checklist_history_item_id_action')
+        db.session.execute('DROP INDEX '
+                           'ix_checklist_history_checklist_id_created_id')
+        db.session.execute('ALTER TABLE checklist_history RENAME TO old')
+        db.session.execute('CREATE TABLE checklist_history (id INTEGER NOT '
+                           'NULL PRIMARY KEY, description TEXT NOT NULL, '
+                           'created DATETIME, checklist_id INTEGER, '
+                           'user_id INTEGER)')
+        db.session.execute('INSERT INTO checklist_history SELECT id, '
+                           ':description, created, checklist_id, user_id '
+                           'FROM old WHERE id = 1',
+                           {"description": before[0]})
+        db.session.execute('INSERT INTO checklist_history SELECT id, '
+                           ':description, created, checklist_id, user_id '
+                           'FROM old WHERE id = 3',
+                           {"description": before[2]})
+        db.session.execute("INSERT INTO checklist_history VALUES (2, "
+                           "'Someone did something.', NULL, 1, 2)")
+        db.session.execute('DROP TABLE old')
+        db.session.commit()
+
+    result = runner.invoke(args=['migrate-history'])
+    assert 'Added column checklist_history.action.' in result.output
+    assert 'Added nullable columns to checklist_history.' in result.output
+    assert 'Converted 2 history entries, leaving 1 that could not be read.' \
+        in result.output
+
+    with app.app_context():
+        entries = ChecklistHistory.query.order_by(ChecklistHistory.id).all()
+        assert [(e.action, e.item_id) for e in entries] == \
+            [(1, 1), (None, None), (1, 3)]
+        assert describe_history(entries) == \
+            [before[0], 'Someone did something.', before[2]]
+
+    result = runner.invoke(args=['migrate-history'])
+    assert result.output == \
+        'Converted 0 history entries, leaving 1 that could not be read.\n'
@@ -0,0 +1,121 @@
+# Tests the exports in checklist_app.export
+
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from checklist_app import db
+from checklist_app.export import render
+from checklist_app.models import Checklist, User
+
+
+def test_export_lists_csv(client, auth):
+    auth.login()
+    response = client.get('/checklist/export.csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'checklists.csv' in response.headers['Content-Disposition']
+    assert response.is_streamed
+
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [(r['id'], r['title'], r['active_count']) for r in rows] == \
+        [('1', 'List', '3'), ('2', 'Empty List', '0')]
+
+
+def test_export_lists_since(app, client, auth):
+    with app.app_context():
+        checklist = Checklist.query.get(2)
+        checklist.updated = datetime(2000, 1, 1)
+        db.session.commit()
+
+    auth.login()
+    response = client.get('/checklist/export.ndjson?since=2001-01-01')
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.splitlines()]
+    assert [r['id'] for r in rows] == [1]
+
+    assert client.get('/checklist/export.ndjson?since=soon').status_code \
+        == 400
+    assert client.get('/checklist/export.xml').status_code == 404
+
+
+def test_export_checklist(app, client, auth):
+    auth.login()
+    client.get('/checklist/1/delete/2')
+
+    response = client.get('/checklist/1/export.ndjson')
+    rows = [json.loads(line) for line in response.data.splitlines()]
+    assert [(r['record'], r['text']) for r in rows] == [
+        ('list', 'List'),
+        ('item', 'Item 1.1'),
+        ('item', 'Item 1.3'),
+        ('history', 'None None added Item 1.1.'),
+        ('history', 'None None added Item 1.2.'),
+        ('history', 'None None added Item 1.3.'),
+        ('history', 'None None deleted Item 1.2.'),
+    ]
+    assert rows[2]['done'] is True
+
+
+def test_export_checklist_owner_only(client, auth):
+    auth.login("other@bebleo.url", "other")
+    for fmt in ('csv', 'ndjson'):
+        assert client.get(f'/checklist/1/export.{fmt}').status_code == 404
+
+
+def test_export_checklist_since(app, client, auth):
+    since = datetime.utcnow() + timedelta(seconds=1)
+    with app.app_context():
+        db.session.execute('UPDATE checklist_history SET created = :created',
+                           {"created": since - timedelta(days=1)})
+        db.session.commit()
+
+    auth.login()
+    path = f'/checklist/1/export.csv?since={since:%Y-%m-%dT%H:%M:%S}'
+
+    # Nothing has changed since then...
+    assert client.get(path).data.splitlines() == \
+        [b'record,id,created,text,done,active,user_id']
+
+    # ...until the list is.
+    with app.app_context():
+        checklist = Checklist.query.get(1)
+        checklist.add_item("Late item", User.query.get(2))
+        checklist.updated = since + timedelta(seconds=1)
+        checklist.last_change.created = since + timedelta(seconds=1)
+        db.session.commit()
+
+    rows = list(csv.DictReader(io.StringIO(
+        client.get(path).get_data(as_text=True))))
+    assert [r['record'] for r in rows] == \
+        ['list', 'item', 'item', 'item', 'item', 'history']
+    assert rows[-1]['text'] == 'None None added Late item.'
+
+
+def test_render_chunks():
+    rows = ({"id": n, "text": "x" * 100} for n in range(1000))
+    chunks = list(render(rows, ('id', 'text'), 'csv'))
+
+    assert len(chunks) > 1
+    assert all(len(chunk) < 17 * 1024 for chunk in chunks)
+    assert ''.join(chunks).count('\n') == 1001
+
+
+def test_export_cli(app, runner, tmp_path):
+    result = runner.invoke(args=['export', '--user', 'test@bebleo.url'])
+    assert result.output.splitlines()[0] == \
+        'id,title,description,created,updated,is_template,active_count,' \
+        'done_count'
+    assert len(result.output.splitlines()) == 3
+
+    output = tmp_path / 'list.ndjson'
+    runner.invoke(args=['export', '--user', 'test@bebleo.url', '--list', '1',
+                        '--format', 'ndjson', '--output', str(output)])
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(rows) == 7
+
+    result = runner.invoke(args=['export', '--user', 'other@bebleo.url',
+                                 '--list', '1'])
+    assert result.exit_code != 0
+    assert 'other@bebleo.url has no list 1.' in result.output
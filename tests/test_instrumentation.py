@@ -0,0 +1,52 @@
+# Tests for the per-request query counting in checklist_app.instrumentation
+
+import pytest
+
+from checklist_app.instrumentation import RepeatedQueryError
+from checklist_app.models import User
+
+
+@pytest.fixture
+def repeat_route(app):
+    def repeat():
+        for _ in range(3):
+            User.query.filter_by(id=1).first()
+        return "repeated"
+
+    app.add_url_rule('/repeat', 'repeat', repeat)
+
+
+def test_server_timing(client, auth):
+    auth.login()
+    response = client.get('/checklist/1')
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('db;dur=')
+    assert 'app;dur=' in timing
+
+    queries = int(timing.split('desc="')[1].split(' ')[0])
+    assert queries > 0
+
+
+def test_server_timing_disabled(app, client):
+    app.config['SERVER_TIMING'] = False
+    response = client.get('/')
+    assert 'Server-Timing' not in response.headers
+
+
+def test_repeated_query_raises(app, client, repeat_route):
+    app.config['QUERY_REPEAT_LIMIT'] = 2
+    with pytest.raises(RepeatedQueryError, match='3 times'):
+        client.get('/repeat')
+
+
+def test_repeated_query_warns(app, client, repeat_route, caplog):
+    app.config['QUERY_REPEAT_LIMIT'] = 2
+    app.config['QUERY_REPEAT_ACTION'] = 'warn'
+    response = client.get('/repeat')
+    assert response.status_code == 200
+    assert 'ran the same statement 3 times' in caplog.text
+
+
+def test_repeated_query_under_limit(app, client, repeat_route):
+    app.config['QUERY_REPEAT_LIMIT'] = 3
+    assert client.get('/repeat').status_code == 200
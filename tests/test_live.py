@@ -0,0 +1,110 @@
+# Tests the live updates of lists in checklist_app.live
+
+import json
+
+import pytest
+
+from checklist_app import db
+from checklist_app.models import Checklist, User
+
+
+def events(response):
+    """Returns the changes in the stream as (id, data) pairs."""
+    changes = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines()
+                      if not line.startswith(':'))
+        if fields.get('event') == 'change':
+            changes.append((int(fields['id']), json.loads(fields['data'])))
+    return changes
+
+
+@pytest.fixture(autouse=True)
+def live(app):
+    app.config['LIVE_ENABLED'] = True
+
+
+def test_commit_wakes_streams(app, client, auth):
+    broker = app.extensions['live_broker']
+    first = broker.subscribe(1)
+    second = broker.subscribe(2)
+    assert broker.count() == 2
+
+    auth.login()
+    client.post('/checklist/1/items/1/toggle')
+    assert first.is_set()
+    assert not second.is_set()
+
+    # Changes that are rolled back aren't published.
+    first.clear()
+    with app.app_context():
+        Checklist.query.get(1).add_item("Not kept", User.query.get(2))
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+    assert not first.is_set()
+
+    broker.unsubscribe(1, first)
+    broker.unsubscribe(2, second)
+    assert broker.count() == 0
+
+
+def test_stream_changes(app, client, auth):
+    app.config['LIVE_STREAM_TIMEOUT'] = 0
+    auth.login()
+    client.post('/checklist/1/items/1/toggle')
+
+    response = client.get('/checklist/1/events?last_id=2')
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.get_data(as_text=True).startswith('retry: 3000\n\n')
+
+    changes = events(response)
+    assert [id for id, _ in changes] == [3, 4]
+    data = changes[1][1]
+    assert data['history']['description'] == \
+        'None None marked Item 1.1 as done.'
+    assert (data['item']['id'], data['item']['done']) == (1, True)
+    assert not data['reload']
+    assert data['percent_complete'] == 2 / 3
+
+    # A browser reconnecting resumes after the last change it was sent.
+    response = client.get('/checklist/1/events?last_id=2',
+                          headers={"Last-Event-ID": "3"})
+    assert [id for id, _ in events(response)] == [4]
+
+    assert app.extensions['live_broker'].count() == 0
+
+
+def test_stream_bulk_change_reloads(app, client, auth):
+    app.config['LIVE_STREAM_TIMEOUT'] = 0
+    auth.login()
+    client.get('/checklist/1/check/all')
+
+    [(_, data)] = events(client.get('/checklist/1/events?last_id=3'))
+    assert data['reload']
+    assert data['item'] is None
+
+
+def test_stream_heartbeat(app, client, auth):
+    app.config.update(LIVE_STREAM_TIMEOUT=0.05, LIVE_HEARTBEAT=0.01,
+                      LIVE_POLL_INTERVAL=0.01)
+    auth.login()
+
+    response = client.get('/checklist/1/events?last_id=3')
+    assert ': heartbeat' in response.get_data(as_text=True)
+    assert events(response) == []
+
+
+def test_view_links_stream(app, client, auth):
+    auth.login()
+    response = client.get('/checklist/1')
+    assert b'data-events-url="/checklist/1/events?last_id=3"' in \
+        response.data
+
+    # The progress shown is updated with the percent_complete of each change.
+    assert b'<span class="percent">33%</span>' in response.data
+
+    app.config['LIVE_ENABLED'] = False
+    assert b'data-events-url' not in client.get('/checklist/1').data
+    assert client.get('/checklist/1/events').status_code == 404
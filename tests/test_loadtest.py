@@ -0,0 +1,39 @@
+# Smoke test for the load test harness in benchmarks/loadtest.py
+
+from benchmarks.loadtest import ROUTES, compare, percentile, run, seed
+from checklist_app.models import Checklist, ChecklistItem
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
+
+
+def test_seed_counts(app):
+    with app.app_context():
+        owned = seed(users=1, lists=1, items=10, history=0)
+        [[checklist_id]] = owned.values()
+        checklist = Checklist.query.get(checklist_id)
+        assert checklist.active_count == 10
+        assert checklist.done_count == ChecklistItem.query.filter_by(
+            checklist_id=checklist_id, done=True).count()
+
+
+def test_run():
+    # Enough logins per account to be rate limited if the limits applied.
+    summary = run(users=2, lists=2, items=5, history=5, threads=2,
+                  iterations=12, config={"PASSWORD_HASH_METHOD":
+                                         "pbkdf2:sha256:1000"})
+
+    assert summary["requests"] == 2 * 12 * len(ROUTES)
+    for route in ROUTES:
+        stats = summary["routes"][route]
+        assert stats["requests"] == 24
+        assert stats["errors"] == 0
+        assert stats["queries_per_request"] > 0
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+
+    assert compare(summary, summary)["checklist.view"]["p50_ms"] == 0
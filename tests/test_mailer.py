@@ -0,0 +1,124 @@
+# Tests for sending the messages in the outbox in checklist_app.mailer
+
+from datetime import datetime, timedelta
+
+from flask_mail import Connection
+
+from checklist_app import db
+from checklist_app.mailer import send_pending
+from checklist_app.models import OutboxMessage, outbox_depth, queue_message
+
+
+def queue(count):
+    for i in range(count):
+        queue_message(subject=f"Message {i}", recipients=["test@bebleo.url"],
+                      sender="noreply@bebleo.url", body="Body")
+    db.session.commit()
+
+
+def test_send_pending(app, outbox):
+    with app.app_context():
+        queue(3)
+        assert outbox_depth() == 3
+
+        assert send_pending(batch_size=2) == 2
+        assert outbox_depth() == 1
+        assert send_pending() == 1
+        assert send_pending() == 0
+
+        assert [m.subject for m in outbox] == \
+            ["Message 0", "Message 1", "Message 2"]
+        assert outbox[0].recipients == ["test@bebleo.url"]
+
+
+def test_send_pending_one_connection(app, monkeypatch):
+    connections = []
+    enter = Connection.__enter__
+
+    def record(self):
+        connections.append(self)
+        return enter(self)
+
+    monkeypatch.setattr(Connection, "__enter__", record)
+
+    with app.app_context():
+        queue(3)
+        assert send_pending() == 3
+        assert len(connections) == 1
+
+
+def test_send_pending_retries(app, outbox, monkeypatch):
+    def fail(self, message, envelope_from=None):
+        raise ConnectionError("Connection refused")
+
+    app.config['MAIL_OUTBOX_MAX_ATTEMPTS'] = 2
+
+    with app.app_context():
+        queue(1)
+        monkeypatch.setattr(Connection, "send", fail)
+        assert send_pending() == 0
+
+        message = OutboxMessage.query.get(1)
+        assert message.attempts == 1
+        assert message.next_attempt > datetime.utcnow()
+        assert "Connection refused" in message.last_error
+
+        # Not due again until the back off has passed.
+        assert send_pending() == 0
+        assert message.attempts == 1
+
+        message.next_attempt = datetime.utcnow()
+        db.session.commit()
+        assert send_pending() == 0
+        assert message.failed
+        assert outbox_depth() == 0
+
+    assert len(outbox) == 0
+
+
+def test_send_pending_lost_connection(app, outbox, monkeypatch):
+    def fail(self, message, envelope_from=None):
+        raise ConnectionError("Connection refused")
+
+    def lost(self, *args):
+        raise ConnectionError("Connection lost")
+
+    app.config['MAIL_OUTBOX_MAX_ATTEMPTS'] = 1
+
+    with app.app_context():
+        queue(1)
+        monkeypatch.setattr(Connection, "send", fail)
+        monkeypatch.setattr(Connection, "__exit__", lost)
+        assert send_pending() == 0
+
+        # Given up on once, not counted again when the connection is lost.
+        message = OutboxMessage.query.get(1)
+        assert message.failed
+        assert message.attempts == 1
+        assert "Connection refused" in message.last_error
+
+
+def test_send_pending_claimed(app, outbox):
+    with app.app_context():
+        queue(2)
+        first, second = OutboxMessage.query.order_by(OutboxMessage.id)
+        # One is being sent by another worker, the other by a worker that
+        # died long ago.
+        first.claimed_by, first.claimed_at = 'other', datetime.utcnow()
+        second.claimed_by = 'dead'
+        second.claimed_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+
+        assert send_pending() == 1
+        assert [m.subject for m in outbox] == ["Message 1"]
+        assert second.claimed_by is None
+        assert first.claimed_by == 'other'
+
+
+def test_mail_worker_cli(app, runner, outbox):
+    with app.app_context():
+        queue(2)
+
+    result = runner.invoke(args=['mail-worker', '--once'])
+    assert 'Sent 2 message(s), 0 waiting.' in result.output
+    assert len(outbox) == 2
@@ -0,0 +1,75 @@
+# Tests for the password hashing service in checklist_app.passwords
+
+import sys
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from checklist_app import db
+from checklist_app.models import User, get_user
+from checklist_app.passwords import HasherBusyError, PasswordHasher
+
+
+def test_hash_and_check_in_pool():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+    try:
+        if sys.version_info >= (3, 7):
+            assert hasher._get_pool()._mp_context.get_start_method() == \
+                'spawn'
+        pwhash = hasher.hash('password')
+        assert pwhash.startswith('pbkdf2:sha256:1000$')
+        assert hasher.check(pwhash, 'password')
+        assert not hasher.check(pwhash, 'not-password')
+    finally:
+        hasher.shutdown()
+
+
+def test_busy_rejected():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, max_pending=1,
+                            retry_after=5)
+    hasher._slots.acquire()
+
+    with pytest.raises(HasherBusyError) as e:
+        hasher.hash('password')
+
+    assert e.value.code == 503
+    assert e.value.get_response().headers['Retry-After'] == '5'
+    assert hasher._pool is None
+
+
+@pytest.mark.parametrize(
+    "method, pwhash, expected",
+    [
+        ("pbkdf2:sha256:1000", "pbkdf2:sha256:1000$salt$hash", False),
+        ("pbkdf2:sha256:2000", "pbkdf2:sha256:1000$salt$hash", True),
+        ("pbkdf2:sha256", "pbkdf2:sha256:1000$salt$hash", True),
+    ]
+)
+def test_needs_rehash(method, pwhash, expected):
+    assert PasswordHasher(method).needs_rehash(pwhash) == expected
+
+
+def test_rehash_on_login(app, auth):
+    with app.app_context():
+        user = get_user(username="other@bebleo.url")
+        user.password = generate_password_hash("other", "pbkdf2:sha256:1000")
+        db.session.commit()
+
+    response = auth.login(username="other@bebleo.url", password="other")
+    assert response.status_code == 302
+
+    with app.app_context():
+        user = User.query.filter_by(email="other@bebleo.url").first()
+        assert user.password.startswith(
+            app.config['PASSWORD_HASH_METHOD'] + '$')
+
+
+def test_login_busy(app, auth):
+    hasher = app.extensions['password_hasher']
+    hasher.workers = 1
+    hasher._slots = type(hasher._slots)(1)
+    hasher._slots.acquire()
+
+    response = auth.login()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,156 @@
+# Tests the limits on logins and password resets in checklist_app.ratelimit
+
+import pytest
+
+from checklist_app.models import OutboxMessage
+from checklist_app.ratelimit import (MemoryBackend, RateLimitedError,
+                                     RateLimiter, SQLiteBackend,
+                                     client_address, rate_limit_info)
+
+
+@pytest.mark.parametrize("backend", ['memory', 'sqlite'])
+def test_token_bucket(tmp_path, backend):
+    if backend == 'memory':
+        backend = MemoryBackend()
+    else:
+        backend = SQLiteBackend(str(tmp_path / 'ratelimit.sqlite3'))
+
+    # Two at once, then one every five seconds.
+    assert backend.take('key', 2, 10, 100) == 0
+    assert backend.take('key', 2, 10, 100) == 0
+    assert backend.take('key', 2, 10, 101) == pytest.approx(4)
+    assert backend.take('key', 2, 10, 105) == 0
+    assert backend.take('other', 2, 10, 105) == 0
+
+    # The bucket never holds more than it started with.
+    assert backend.take('key', 2, 10, 1000) == 0
+    assert backend.take('key', 2, 10, 1000) == 0
+    assert backend.take('key', 2, 10, 1000) > 0
+
+    backend.prune(500)
+    assert backend.take('other', 2, 10, 1000) == 0
+
+
+def test_sqlite_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'ratelimit.sqlite3')
+    limits = {'login': {'ip': (1, 60)}}
+    first = RateLimiter(SQLiteBackend(path), limits)
+    second = RateLimiter(SQLiteBackend(path), limits)
+
+    first.check('login', ip='10.0.0.1')
+    with pytest.raises(RateLimitedError) as e:
+        second.check('login', ip='10.0.0.1')
+
+    assert e.value.code == 429
+    assert e.value.get_response().headers['Retry-After'] == '60'
+    assert first.info() == {'login.allowed': 1}
+    assert second.info() == {'login.rejected.ip': 1}
+
+
+def test_pruned_by_time(monkeypatch):
+    pruned = []
+    backend = MemoryBackend()
+    monkeypatch.setattr(backend, 'prune', pruned.append)
+    limiter = RateLimiter(backend, {'login': {'ip': (1, 600),
+                                              'account': (1, 300)}})
+    clock = [limiter._pruned]
+    monkeypatch.setattr('checklist_app.ratelimit.time', lambda: clock[0])
+
+    # Rejected checks prune as well as allowed ones, once a minute.
+    limiter.check('login', ip='10.0.0.1')
+    for _ in range(3):
+        with pytest.raises(RateLimitedError):
+            limiter.check('login', ip='10.0.0.1')
+    assert pruned == []
+
+    clock[0] += 61
+    with pytest.raises(RateLimitedError):
+        limiter.check('login', ip='10.0.0.1')
+    assert pruned == [clock[0] - 600]
+
+
+def test_login_limited_by_account(app, client):
+    limiter = app.extensions['rate_limiter']
+    limiter.limits = {'login': {'ip': (100, 60), 'account': (2, 60)}}
+    hasher = app.extensions['password_hasher']
+    checks = []
+    check = hasher.check
+    hasher.check = lambda *args: checks.append(1) or check(*args)
+
+    for _ in range(2):
+        response = client.post('/auth/login',
+                               data={"username": "test@bebleo.url",
+                                     "password": "wrong"})
+        assert response.status_code == 200
+
+    # The address and case of the account don't matter.
+    response = client.post('/auth/login',
+                           data={"username": " Test@Bebleo.url",
+                                 "password": "test"},
+                           environ_base={"REMOTE_ADDR": "10.0.0.2"})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == 30
+    # The rejected attempt never reached the hasher.
+    assert len(checks) == 2
+
+    # Other accounts can still log in.
+    response = client.post('/auth/login',
+                           data={"username": "admin@bebleo.url",
+                                 "password": "admin"})
+    assert response.status_code == 302
+
+    with app.app_context():
+        assert rate_limit_info() == {'login.allowed': 3,
+                                     'login.rejected.account': 1}
+
+
+def test_login_limited_by_ip(app, client):
+    app.extensions['rate_limiter'].limits = {'login': {'ip': (2, 60)}}
+
+    for username in ('a@bebleo.url', 'b@bebleo.url'):
+        client.post('/auth/login', data={"username": username,
+                                         "password": "x"})
+    response = client.post('/auth/login', data={"username": "c@bebleo.url",
+                                                "password": "x"})
+    assert response.status_code == 429
+
+    # Only POSTs are limited.
+    assert client.get('/auth/login').status_code == 200
+
+    app.config['RATELIMIT_ENABLED'] = False
+    response = client.post('/auth/login', data={"username": "c@bebleo.url",
+                                                "password": "x"})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "hops, forwarded, expected",
+    [
+        (0, "10.0.0.3", "10.0.0.1"),
+        (1, "10.0.0.3", "10.0.0.3"),
+        (1, "1.2.3.4, 10.0.0.3", "10.0.0.3"),
+        (2, "1.2.3.4, 10.0.0.3, 10.0.0.4", "10.0.0.3"),
+        (2, "10.0.0.3", "10.0.0.1"),
+        (1, None, "10.0.0.1"),
+    ]
+)
+def test_client_address(app, hops, forwarded, expected):
+    app.config['RATELIMIT_TRUSTED_PROXIES'] = hops
+    headers = {"X-Forwarded-For": forwarded} if forwarded else {}
+    with app.test_request_context(headers=headers,
+                                  environ_base={"REMOTE_ADDR": "10.0.0.1"}):
+        assert client_address() == expected
+
+
+def test_password_reset_limited(app, client):
+    for _ in range(3):
+        client.post('/auth/forgotpassword',
+                    data={"username": "test@bebleo.url"})
+
+    response = client.post('/auth/forgotpassword',
+                           data={"username": "test@bebleo.url"})
+    assert response.status_code == 429
+
+    with app.app_context():
+        assert OutboxMessage.query.count() == 3
+        assert rate_limit_info()['password_reset.rejected.account'] == 1